@@ -0,0 +1,136 @@
+"""
+Async connection pools for the HTTP service.
+
+AsyncPool runs core operations on mysql.connector.aio connections, so a
+request waiting on MySQL only parks its coroutine and one event loop can
+serve thousands of open clients with a handful of connections. It keeps the
+same borrow_timeout/PoolStats bookkeeping as db.ConnectionPool.
+
+SQLite has no async driver; ThreadedPool runs the same operations through
+db.unit_of_work() on worker threads instead. Sharded backends (shards.py)
+use it too, so db.for_showtime()/db.fan_out() around pool.run() apply: the
+worker thread runs in a copy of the caller's context.
+
+    pool = aiodb.for_backend(backend)
+    await pool.open()
+    shows = await pool.run(core.showtimes())
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import backends
+import core
+import db
+
+
+class AsyncPool:
+    def __init__(self, config, pool_name="cinema_aio", pool_size=10, borrow_timeout=5.0,
+                 return_timeout=30.0, **_ignored):
+        self.config = dict(config)
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+        self.borrow_timeout = borrow_timeout
+        self.return_timeout = return_timeout
+        self.stats = db.PoolStats()
+        self._pool = None
+        self._slots = None
+        self._integrity_errors = ()
+
+    async def open(self):
+        from mysql.connector import errors
+        from mysql.connector.aio.pooling import MySQLConnectionPool
+
+        self._integrity_errors = (errors.IntegrityError,)
+        self._pool = MySQLConnectionPool(pool_name=self.pool_name, pool_size=self.pool_size)
+        await self._pool.initialize_pool(**self.config)
+        self.stats.incr("connections_created", self.pool_size)
+        self._slots = asyncio.Semaphore(self.pool_size)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close_pool()
+            self._pool = None
+            self.stats.incr("connections_closed", self.pool_size)
+
+    @asynccontextmanager
+    async def unit_of_work(self, dictionary=True):
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.borrow_timeout)
+        except asyncio.TimeoutError:
+            self.stats.incr("timeouts")
+            raise db.PoolTimeout(f"no connection free after {self.borrow_timeout:.1f}s "
+                                 f"({self.pool_size} in use)") from None
+        try:
+            conn = await self._pool.get_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        self.stats.borrowed(time.monotonic() - start)
+        borrowed = time.monotonic()
+        try:
+            cur = await conn.cursor(dictionary=dictionary, buffered=True)
+            try:
+                yield cur
+                await conn.commit()
+            except self._integrity_errors as exc:
+                await conn.rollback()
+                raise db.IntegrityError(str(exc)) from exc
+            except BaseException:
+                await conn.rollback()
+                raise
+            finally:
+                await cur.close()
+        finally:
+            held = time.monotonic() - borrowed
+            await conn.close()  # back to the aio pool
+            self._slots.release()
+            self.stats.returned(held, held > self.return_timeout)
+
+    async def run(self, op):
+        """Drive a core operation (see core.run) on one pooled connection."""
+        try:
+            step = next(op)
+        except StopIteration as done:
+            return done.value
+        async with self.unit_of_work() as cur:
+            while True:
+                kind, sql, params = step
+                await cur.execute(sql, params)
+                if kind == "one":
+                    result = await cur.fetchone()
+                elif kind == "all":
+                    result = await cur.fetchall()
+                else:
+                    result = cur.rowcount
+                try:
+                    step = op.send(result)
+                except StopIteration as done:
+                    return done.value
+
+
+class ThreadedPool:
+    """Runs core operations on the blocking db pool from worker threads."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def stats(self):
+        return self.backend.pool.stats
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def run(self, op):
+        return await asyncio.to_thread(core.run, op)
+
+
+def for_backend(backend):
+    if isinstance(backend, backends.MySQLBackend):
+        return AsyncPool(backend.config, **backend.pool_options)
+    return ThreadedPool(backend)
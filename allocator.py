@@ -0,0 +1,183 @@
+"""
+Best-available seat allocation for group bookings.
+
+FreeRunIndex keeps, for every row of a showtime, the sorted list of free runs
+(start_col, end_col). Finding N seats only has to look at runs long enough
+to hold the group, and taking seats splits one run in place, so allocation
+does not rescan the seat map.
+
+Groups are seated together in the run closest to the centre of the screen;
+when no single run is long enough they are split across the best runs
+available. Indexes are cached per showtime and rebuilt from the seat bitmap
+plus live holds when a hold attempt reveals they are stale, when a hold in
+them expires or is released (reservations.release()), or after
+REFRESH_AFTER seconds, which bounds how long holds released by other
+processes stay taken.
+"""
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+import db
+import inventory
+import reservations
+
+REFRESH_AFTER = 30  # seconds; other processes' released holds reappear after this
+
+
+class FreeRunIndex:
+    def __init__(self, rows, cols, taken=()):
+        self.rows = rows
+        self.cols = cols
+        self.built_at = time.monotonic()
+        self.refresh_at = self.built_at + REFRESH_AFTER
+        taken_by_row = [set() for _ in range(rows)]
+        for label, col in taken:
+            r = ord(label) - 65
+            if 0 <= r < rows:
+                taken_by_row[r].add(col)
+        self.runs = [self._runs_for(taken_by_row[r]) for r in range(rows)]
+        self._centre_row = (rows - 1) / 2
+        self._centre_col = (cols + 1) / 2
+
+    def _runs_for(self, taken):
+        runs, start = [], None
+        for c in range(1, self.cols + 2):
+            free = c <= self.cols and c not in taken
+            if free and start is None:
+                start = c
+            elif not free and start is not None:
+                runs.append((start, c - 1))
+                start = None
+        return runs
+
+    @classmethod
+    def from_inventory(cls, inv, held=()):
+        taken = [(inventory.row_label(r), c)
+                 for r in range(inv.rows)
+                 for c in range(1, inv.cols + 1)
+                 if (inv.row_bits(r) >> (c - 1)) & 1]
+        return cls(inv.rows, inv.cols, taken + list(held))
+
+    def free_count(self):
+        return sum(e - s + 1 for runs in self.runs for s, e in runs)
+
+    def take(self, label, col):
+        """Mark one seat as taken, splitting the run that contains it."""
+        runs = self.runs[ord(label) - 65]
+        i = bisect_right(runs, (col, self.cols + 1)) - 1
+        if i < 0 or not runs[i][0] <= col <= runs[i][1]:
+            raise ValueError(f"seat {label}{col} is not free")
+        s, e = runs[i]
+        pieces = [p for p in ((s, col - 1), (col + 1, e)) if p[0] <= p[1]]
+        runs[i:i + 1] = pieces
+
+    def _score(self, r, start, n):
+        dr = r - self._centre_row
+        dc = start + (n - 1) / 2 - self._centre_col
+        return dr * dr + dc * dc
+
+    def best_block(self, n):
+        """(row_index, start_col) of the best run of n adjacent free seats, or None."""
+        best = None
+        for r, runs in enumerate(self.runs):
+            for s, e in runs:
+                if e - s + 1 < n:
+                    continue
+                # Slide the block as close to the centre column as the run allows
+                start = round(self._centre_col - (n - 1) / 2)
+                start = max(s, min(start, e - n + 1))
+                score = self._score(r, start, n)
+                if best is None or score < best[0]:
+                    best = (score, r, start)
+        return None if best is None else (best[1], best[2])
+
+    def largest_run(self):
+        return max((e - s + 1 for runs in self.runs for s, e in runs), default=0)
+
+    def allocate(self, n, allow_split=True):
+        """Pick and take n seats; returns [(row_label, col), ...] or None if they don't fit."""
+        if n <= 0 or n > self.free_count():
+            return None
+        block = self.best_block(n)
+        if block is None and not allow_split:
+            return None
+
+        seats = []
+        remaining = n
+        while remaining:
+            size = remaining if block else min(remaining, self.largest_run())
+            r, start = block or self.best_block(size)
+            for c in range(start, start + size):
+                seats.append((inventory.row_label(r), c))
+                self.take(inventory.row_label(r), c)
+            remaining -= size
+            block = None
+        return seats
+
+
+# =====================
+# Per-showtime index cache
+# =====================
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _build(showtime_id, fresh=False):
+    if fresh:
+        # The cached bitmap only knows this process's bookings
+        inventory.invalidate(showtime_id)
+    inv = inventory.get(showtime_id)
+    if inv is None:
+        return None
+    now = datetime.now().replace(microsecond=0)
+    with db.for_showtime(showtime_id), db.unit_of_work() as cur:
+        cur.execute("SELECT seat_row, seat_col, expires_at FROM seat_holds "
+                    "WHERE showtime_id = %s AND expires_at > %s",
+                    (showtime_id, now.strftime("%Y-%m-%d %H:%M:%S")))
+        held = cur.fetchall()
+    idx = FreeRunIndex.from_inventory(inv, [(label, col) for label, col, _ in held])
+    if held:
+        # The first hold to expire frees its seats: rebuild then
+        first = min(datetime.fromisoformat(str(expires)[:19]) for _, _, expires in held)
+        idx.refresh_at = min(idx.refresh_at, idx.built_at + (first - now).total_seconds())
+    return idx
+
+
+def get_index(showtime_id, refresh=False):
+    idx = _indexes.get(showtime_id)
+    if refresh or idx is None or time.monotonic() >= idx.refresh_at:
+        idx = _build(showtime_id, fresh=refresh)
+        _indexes[showtime_id] = idx
+    return idx
+
+
+def invalidate(showtime_id):
+    _indexes.pop(showtime_id, None)
+
+
+def auto_hold(user_id, showtime_id, n, allow_split=True, attempts=3):
+    """
+    Hold the best n available seats for a user. Returns (token, seats), or
+    None when the show cannot seat the group.
+    """
+    for attempt in range(attempts):
+        with _lock:
+            idx = get_index(showtime_id, refresh=attempt > 0)
+            seats = idx.allocate(n, allow_split) if idx else None
+        if not seats:
+            return None
+        try:
+            return reservations.hold_seats(user_id, showtime_id, seats), seats
+        except reservations.SeatUnavailable:
+            continue  # another process took some of them; rebuild and retry
+    return None
+
+
+def auto_hold_many(showtime_id, requests, allow_split=True):
+    """
+    Seat a queue of group requests [(user_id, n), ...] in order, e.g. during
+    an on-sale spike. Returns one (token, seats) or None per request.
+    """
+    return [auto_hold(user_id, showtime_id, n, allow_split) for user_id, n in requests]
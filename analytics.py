@@ -0,0 +1,384 @@
+"""
+Columnar analytics over booking history.
+
+A snapshot copies the booking facts (one row per booking: showtime, seats,
+amount, booked_at) and the showtime dimension (movie, screen, start,
+capacity) into NumPy column arrays, saved as .npy files under SNAPSHOT_DIR
+and memory-mapped on load. Reports then run as vectorized filters and
+np.bincount() group-bys over those arrays -- no SQL, no Python loop per
+booking -- so multi-year ranges over millions of bookings take milliseconds
+and never touch the OLTP database.
+
+refresh() brings a saved snapshot up to date cheaply: the (small) showtime,
+movie and screen tables are re-read, only bookings from the last
+REFRESH_LOOKBACK ids on are fetched (ids are handed out in blocks per
+process and journaled bookings land late, so they do not arrive in id
+order) and merged, and facts of deleted showtimes are dropped. A booking
+committed even later than that would be missed, so once a snapshot's last
+full build is REBUILD_AFTER old, refresh() builds it from scratch instead.
+
+    snap = analytics.refresh()                         # load + catch up
+    report = snap.report("2024-01-01", "2025-12-31", by="month")
+    yoy = snap.year_over_year("2025-01-01", "2025-03-31", by="movie")
+
+Reports group by show date, like the daily/monthly reports.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+import db
+
+SNAPSHOT_DIR = os.environ.get("CINEMA_ANALYTICS_DIR", "analytics_snapshot")
+FETCH_SIZE = 10000
+REFRESH_LOOKBACK = 10000
+REBUILD_AFTER = 24 * 3600   # seconds between full builds, see refresh()
+GROUPS = ("total", "year", "month", "day", "weekday", "hour", "movie", "screen")
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+# Hot and archived showtimes (see archive.py)
+SHOWS_SQL = """
+    SELECT s.id AS id, s.movie_id, s.screen_id, s.start_time, sc.total_rows * sc.total_cols AS capacity
+    FROM showtimes s
+    JOIN screens sc ON s.screen_id = sc.id
+    UNION ALL
+    SELECT s.id, s.movie_id, s.screen_id, s.start_time, sc.total_rows * sc.total_cols
+    FROM showtimes_archive s
+    JOIN screens sc ON s.screen_id = sc.id
+    ORDER BY id
+"""
+
+# Hot and archived bookings after a given id, with their seat counts
+BOOKINGS_SQL = """
+    SELECT b.id AS id, b.showtime_id, b.total_amount, b.booked_at,
+           (SELECT COUNT(*) FROM booking_seats bs WHERE bs.booking_id = b.id) AS seats
+    FROM bookings b
+    WHERE b.id > %s
+    UNION ALL
+    SELECT b.id, b.showtime_id, b.total_amount, b.booked_at,
+           (SELECT COUNT(*) FROM booking_seats_archive bs WHERE bs.booking_id = b.id)
+    FROM bookings_archive b
+    WHERE b.id > %s
+    ORDER BY id
+"""
+
+SHOW_COLUMNS = {"show_id": np.int64, "show_movie": np.int32, "show_screen": np.int32,
+                "show_start": "datetime64[m]", "show_capacity": np.int32}
+FACT_COLUMNS = {"booking_id": np.int64, "booking_show": np.int64, "booking_amount": np.float64,
+                "booking_at": "datetime64[s]", "booking_seats": np.int32}
+
+
+def _columns(rows, spec):
+    """Column arrays from a list of row tuples, in spec order."""
+    if not rows:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in spec.items()}
+    cols = list(zip(*rows))
+    return {name: np.array(col, dtype=dtype) for (name, dtype), col in zip(spec.items(), cols)}
+
+
+def _fetch_bookings(after_id):
+    batches = []
+    with db.fan_out(), db.read_only(), db.unit_of_work(buffered=False) as cur:
+        cur.execute(BOOKINGS_SQL, (after_id, after_id))
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            batches.append(_columns([tuple(r) for r in rows], FACT_COLUMNS))
+    if not batches:
+        return _columns([], FACT_COLUMNS)
+    return {name: np.concatenate([b[name] for b in batches]) for name in FACT_COLUMNS}
+
+
+def _fetch_dimensions():
+    with db.fan_out(), db.read_only(), db.unit_of_work() as cur:
+        cur.execute(SHOWS_SQL)
+        shows = _columns([tuple(r) for r in cur.fetchall()], SHOW_COLUMNS)
+        cur.execute("SELECT id, title FROM movies")
+        movies = {int(i): t for i, t in cur.fetchall()}
+        cur.execute("SELECT id, name FROM screens")
+        screens = {int(i): n for i, n in cur.fetchall()}
+    # Sharded, every node holds a copy of the catalog: keep one row per show
+    _, first = np.unique(shows["show_id"], return_index=True)
+    if len(first) < len(shows["show_id"]):
+        shows = {name: array[first] for name, array in shows.items()}
+    return shows, {"movies": movies, "screens": screens}
+
+
+def _column_file(path, name, generation):
+    # Snapshots saved before generations existed use plain <name>.npy
+    return os.path.join(path, f"{name}.{generation}.npy" if generation else f"{name}.npy")
+
+
+def _generation(path):
+    """The generation meta.json at path points to, or None."""
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            return json.load(f).get("generation")
+    except (OSError, ValueError):
+        return None
+
+
+class Snapshot:
+    def __init__(self, columns, names, taken_at=None, built_at=None):
+        self.columns = columns
+        self.names = names
+        self.taken_at = taken_at or time.strftime("%Y-%m-%d %H:%M:%S")
+        self.built_at = built_at or time.time()  # last full build()
+        c = columns
+        # Position of each booking's showtime in the show arrays (ids are sorted)
+        self._show_idx = np.searchsorted(c["show_id"], c["booking_show"])
+
+    def __len__(self):
+        return len(self.columns["booking_id"])
+
+    @property
+    def last_booking_id(self):
+        ids = self.columns["booking_id"]
+        return int(ids.max()) if len(ids) else 0
+
+    # ---------------------
+    # Persistence
+    # ---------------------
+    def save(self, path=SNAPSHOT_DIR):
+        """
+        Write the columns as a new generation of files, then switch meta.json
+        to it atomically: files of the previous generation are never
+        overwritten while another snapshot may still map them, and a crash
+        leaves the previous snapshot intact.
+        """
+        os.makedirs(path, exist_ok=True)
+        previous = _generation(path)
+        generation = f"{time.time_ns():x}"
+        for name, array in self.columns.items():
+            with open(_column_file(path, name, generation), "wb") as out:
+                np.save(out, array)
+                out.flush()
+                os.fsync(out.fileno())
+        tmp = os.path.join(path, f"meta.json.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as out:
+            json.dump({"taken_at": self.taken_at, "built_at": self.built_at, "names": self.names,
+                       "generation": generation}, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, os.path.join(path, "meta.json"))
+        # Keep the previous generation for readers that loaded it a moment ago
+        keep = {os.path.basename(_column_file(path, name, g))
+                for name in self.columns for g in (generation, previous)}
+        for entry in os.listdir(path):
+            if entry.endswith(".npy") and entry not in keep:
+                try:
+                    os.remove(os.path.join(path, entry))
+                except OSError:
+                    pass  # still mapped (Windows); removed by a later save
+
+    @classmethod
+    def load(cls, path=SNAPSHOT_DIR, mmap=True):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        names = {kind: {int(k): v for k, v in table.items()} for kind, table in meta["names"].items()}
+        columns = {name: np.load(_column_file(path, name, meta.get("generation")),
+                                 mmap_mode="r" if mmap else None)
+                   for name in (*SHOW_COLUMNS, *FACT_COLUMNS)}
+        return cls(columns, names, meta["taken_at"], meta.get("built_at", 0))
+
+    # ---------------------
+    # Group keys (computed on the show arrays, then broadcast to bookings)
+    # ---------------------
+    def _show_keys(self, by):
+        """(key per show, label function) for a grouping."""
+        c = self.columns
+        start = c["show_start"]
+        if by == "total":
+            return np.zeros(len(start), dtype=np.int64), lambda k: "total"
+        if by == "year":
+            return start.astype("datetime64[Y]").astype(np.int64), lambda k: str(1970 + k)
+        if by == "month":
+            return (start.astype("datetime64[M]").astype(np.int64),
+                    lambda k: str(np.datetime64(k, "M")))
+        if by == "day":
+            return (start.astype("datetime64[D]").astype(np.int64),
+                    lambda k: str(np.datetime64(k, "D")))
+        if by == "weekday":
+            # 1970-01-01 was a Thursday
+            return (start.astype("datetime64[D]").astype(np.int64) + 3) % 7, lambda k: WEEKDAYS[k]
+        if by == "hour":
+            minutes = (start - start.astype("datetime64[D]")).astype(np.int64)
+            return minutes // 60, lambda k: f"{k:02d}:00"
+        if by == "movie":
+            movies = self.names["movies"]
+            return c["show_movie"].astype(np.int64), lambda k: movies.get(k, f"movie #{k}")
+        if by == "screen":
+            screens = self.names["screens"]
+            return c["show_screen"].astype(np.int64), lambda k: screens.get(k, f"screen #{k}")
+        raise ValueError(f"unknown grouping: {by} (expected one of {', '.join(GROUPS)})")
+
+    # ---------------------
+    # Reports
+    # ---------------------
+    def report(self, start, end, by="month"):
+        """
+        Bookings, tickets, revenue, capacity and occupancy per group for shows
+        whose date falls in [start, end] ('YYYY-MM-DD', inclusive).
+        """
+        started = time.perf_counter()
+        c = self.columns
+        first = np.datetime64(start, "D")
+        last = np.datetime64(end, "D") + np.timedelta64(1, "D")
+        in_range = (c["show_start"] >= first) & (c["show_start"] < last)
+
+        keys, label = self._show_keys(by)
+        groups, show_group = np.unique(keys[in_range], return_inverse=True)
+        n = len(groups)
+
+        # Showtime-level: capacity of every show in range, booked or not
+        capacity = np.bincount(show_group, weights=c["show_capacity"][in_range], minlength=n)
+
+        # Booking-level: map each booking to its show's group (-1 when out of range)
+        group_of_show = np.full(len(keys), -1, dtype=np.int64)
+        group_of_show[np.flatnonzero(in_range)] = show_group
+        booking_group = group_of_show[self._show_idx] if len(self) else np.empty(0, np.int64)
+        hit = booking_group >= 0
+        booking_group = booking_group[hit]
+        bookings = np.bincount(booking_group, minlength=n)
+        tickets = np.bincount(booking_group, weights=c["booking_seats"][hit], minlength=n)
+        revenue = np.bincount(booking_group, weights=c["booking_amount"][hit], minlength=n)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            occupancy = np.where(capacity > 0, tickets / capacity * 100, 0.0)
+        rows = [{"group": label(int(k)), "shows": int(s), "bookings": int(b), "tickets": int(t),
+                 "revenue": float(r), "capacity": int(cap), "occupancy": float(o)}
+                for k, s, b, t, r, cap, o in zip(groups, np.bincount(show_group, minlength=n),
+                                                 bookings, tickets, revenue, capacity, occupancy)]
+        total_capacity = int(capacity.sum())
+        total_tickets = int(tickets.sum())
+        return {
+            "from": str(first), "to": str(np.datetime64(end, "D")), "by": by,
+            "rows": rows,
+            "totals": {
+                "shows": int(in_range.sum()),
+                "bookings": int(bookings.sum()),
+                "tickets": total_tickets,
+                "revenue": float(revenue.sum()),
+                "capacity": total_capacity,
+                "occupancy": total_tickets / total_capacity * 100 if total_capacity else 0.0,
+            },
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
+        }
+
+    def year_over_year(self, start, end, by="month"):
+        """report() for [start, end] next to the same dates a year earlier."""
+        def year_back(day):
+            d = np.datetime64(day, "D").astype(object)
+            try:
+                return d.replace(year=d.year - 1).isoformat()
+            except ValueError:  # 29 February
+                return d.replace(year=d.year - 1, day=28).isoformat()
+
+        current = self.report(start, end, by)
+        previous = self.report(year_back(start), year_back(end), by)
+
+        def align(group):
+            # Compare calendar positions, not absolute dates
+            if by in ("month", "day"):
+                return group[5:]
+            return "total" if by == "year" else group
+
+        before = {align(r["group"]): r for r in previous["rows"]}
+        for r in current["rows"]:
+            old = before.get(align(r["group"]))
+            r["revenue_prev"] = old["revenue"] if old else 0.0
+            r["revenue_change"] = _change(r["revenue"], r["revenue_prev"])
+        return {
+            "current": current,
+            "previous": previous,
+            "revenue_change": _change(current["totals"]["revenue"], previous["totals"]["revenue"]),
+            "tickets_change": _change(current["totals"]["tickets"], previous["totals"]["tickets"]),
+        }
+
+
+def _change(now, before):
+    """Percent change, or None when there is nothing to compare with."""
+    return (now - before) / before * 100 if before else None
+
+
+# =====================
+# Building and refreshing
+# =====================
+def build():
+    """A full snapshot of the current database."""
+    shows, names = _fetch_dimensions()
+    return _assemble(shows, names, _fetch_bookings(0))
+
+
+def _assemble(shows, names, facts, built_at=None):
+    # Keep only bookings of known showtimes: deleted ones took their bookings
+    # with them (ON DELETE CASCADE), and one created after the showtimes were
+    # read waits for the next refresh
+    keep = np.isin(facts["booking_show"], shows["show_id"])
+    if not keep.all():
+        facts = {name: array[keep] for name, array in facts.items()}
+    return Snapshot({**shows, **facts}, names, built_at=built_at)
+
+
+def refresh(path=SNAPSHOT_DIR, save=True):
+    """
+    Load the snapshot at path (building it if missing or due for a full
+    rebuild), catch up, and save it back.
+    """
+    old = Snapshot.load(path, mmap=True) if os.path.exists(os.path.join(path, "meta.json")) else None
+    if old is None or time.time() - old.built_at >= REBUILD_AFTER:
+        snap = build()
+    else:
+        shows, names = _fetch_dimensions()
+        new = _fetch_bookings(max(0, old.last_booking_id - REFRESH_LOOKBACK))
+        fresh = ~np.isin(new["booking_id"], old.columns["booking_id"])
+        facts = {name: np.concatenate([np.asarray(old.columns[name]), new[name][fresh]])
+                 for name in FACT_COLUMNS}
+        snap = _assemble(shows, names, facts, old.built_at)
+    del old  # drop its memory maps before the save removes older files
+    if save:
+        snap.save(path)
+        snap = Snapshot.load(path)
+    return snap
+
+
+def print_report(report):
+    print(f"\n📈 {report['from']} → {report['to']} by {report['by']}")
+    for r in report["rows"]:
+        line = (f"{r['group']:<24} Shows: {r['shows']:>6} | Tickets: {r['tickets']:>8} | "
+                f"Revenue: ₹{r['revenue']:>12.2f} | Occupancy: {r['occupancy']:5.1f}%")
+        if "revenue_change" in r:
+            change = r["revenue_change"]
+            line += f" | vs last year: {'n/a' if change is None else f'{change:+.1f}%'}"
+        print(line)
+    t = report["totals"]
+    print(f"{'Total':<24} Shows: {t['shows']:>6} | Tickets: {t['tickets']:>8} | "
+          f"Revenue: ₹{t['revenue']:>12.2f} | Occupancy: {t['occupancy']:5.1f}%")
+    print(f"(computed in {report['elapsed_ms']:.1f} ms)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import main
+
+    parser = argparse.ArgumentParser(description="Booking analytics from a columnar snapshot")
+    parser.add_argument("start", help="first show date, YYYY-MM-DD")
+    parser.add_argument("end", help="last show date, YYYY-MM-DD")
+    parser.add_argument("--by", choices=GROUPS, default="month")
+    parser.add_argument("--yoy", action="store_true", help="compare with the year before")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="snapshot directory")
+    args = parser.parse_args()
+
+    db.configure(main.make_backend())
+    snapshot = refresh(args.dir)
+    if args.yoy:
+        result = snapshot.year_over_year(args.start, args.end, args.by)
+        print_report(result["current"])
+        change = result["revenue_change"]
+        print(f"Revenue vs last year: {'n/a' if change is None else f'{change:+.1f}%'}")
+    else:
+        print_report(snapshot.report(args.start, args.end, args.by))
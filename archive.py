@@ -0,0 +1,124 @@
+"""
+Archival of closed months.
+
+Showtimes of months that are over, with their bookings, booking seats and
+showtime_sales rollup rows, are moved to the *_archive tables (migration 6),
+so the hot tables -- and every index and join behind booking, seat maps and
+the listings -- only carry recent and upcoming shows. Rows keep their ids.
+
+The move goes CHUNK_SIZE showtimes per transaction: copy the rows into the
+archive tables, then delete the showtimes, which cascades to their bookings,
+seats, holds and rollup rows. A crash between chunks leaves every showtime
+either fully hot or fully archived, and the job simply carries on when run
+again.
+
+Reports read both sides: the daily report unions the hot and archive
+tables, movie_daily_sales keeps covering archived days, and exports and
+analytics snapshots include archived bookings. The admin listings and My
+Bookings show the hot tables only, i.e. the last KEEP_MONTHS closed months
+and everything after.
+
+    python archive.py                   # archive every month before the last KEEP_MONTHS
+    python archive.py --before 2025-01  # archive everything before January 2025
+"""
+import time
+from datetime import date
+
+import catalog
+import db
+import inventory
+
+CHUNK_SIZE = 200   # showtimes per transaction
+KEEP_MONTHS = 1    # closed months left in the hot tables
+
+# Hot table -> (archive table, columns, showtime column)
+TABLES = [
+    ("showtimes", "showtimes_archive",
+     ("id", "movie_id", "screen_id", "start_time", "price", "created_at"), "id"),
+    ("bookings", "bookings_archive",
+     ("id", "user_id", "showtime_id", "total_amount", "booked_at"), "showtime_id"),
+    ("booking_seats", "booking_seats_archive",
+     ("id", "booking_id", "showtime_id", "seat_row", "seat_col"), "showtime_id"),
+    ("showtime_sales", "showtime_sales_archive",
+     ("showtime_id", "bookings", "seats_sold", "revenue"), "showtime_id"),
+]
+
+
+def cutoff(keep_months=KEEP_MONTHS, today=None):
+    """'YYYY-MM-01' of the oldest month that stays hot."""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - keep_months
+    return f"{months // 12:04d}-{months % 12 + 1:02d}-01"
+
+
+def _month_start(month):
+    """'YYYY-MM-01' for 'YYYY-MM' (or a full date); raises ValueError if malformed."""
+    return date.fromisoformat(f"{month[:7]}-01").isoformat()
+
+
+def _move_chunk(cur, before, chunk_size):
+    """Archive up to chunk_size showtimes starting before `before`; returns rows moved per table."""
+    cur.execute("SELECT id FROM showtimes WHERE start_time < %s ORDER BY id LIMIT %s",
+                (f"{before} 00:00:00", chunk_size))
+    ids = [row[0] for row in cur.fetchall()]
+    if not ids:
+        return {}
+    marks = ", ".join(["%s"] * len(ids))
+    moved = {}
+    for table, archived, columns, key in TABLES:
+        cols = ", ".join(columns)
+        cur.execute(f"INSERT INTO {archived} ({cols}) SELECT {cols} FROM {table} WHERE {key} IN ({marks})",
+                    ids)
+        moved[table] = cur.rowcount
+    cur.execute(f"DELETE FROM showtimes WHERE id IN ({marks})", ids)
+    catalog.bump(cur)
+    return moved
+
+
+def archive(before=None, chunk_size=CHUNK_SIZE):
+    """
+    Move showtimes starting before `before` ('YYYY-MM', default cutoff()) and
+    their bookings to the archive tables. Returns the rows moved per table.
+    """
+    before = _month_start(before) if before else cutoff()
+    if before > cutoff(0):
+        raise ValueError(f"only closed months can be archived (before {cutoff(0)[:7]} at the latest)")
+    started = time.perf_counter()
+    totals = {table: 0 for table, _, _, _ in TABLES}
+    # Sharded, each node archives its copy of the showtimes with its own
+    # bookings; home goes last, since the shards copy its catalog
+    for node in reversed(db.nodes()):
+        with db.on_node(node):
+            while True:
+                moved = db.transaction(lambda cur: _move_chunk(cur, before, chunk_size))
+                if not moved:
+                    break
+                for table, count in moved.items():
+                    if node is None or table != "showtimes":
+                        totals[table] += count
+    if totals["showtimes"]:
+        inventory.clear()
+    return {"before": before, "moved": totals, "elapsed_s": time.perf_counter() - started}
+
+
+def print_report(result):
+    moved = result["moved"]
+    print(f"✅ Archived {moved['showtimes']} showtimes before {result['before']} "
+          f"({moved['bookings']} bookings, {moved['booking_seats']} seats) "
+          f"in {result['elapsed_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import main
+
+    parser = argparse.ArgumentParser(description="Move closed months to the archive tables")
+    parser.add_argument("--before", help="first month to keep hot, YYYY-MM (default: keep the "
+                                         f"current month and {KEEP_MONTHS} before it)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="showtimes per transaction")
+    args = parser.parse_args()
+
+    db.configure(main.make_backend())
+    main.init_db()
+    print_report(archive(args.before, args.chunk))
@@ -0,0 +1,345 @@
+"""
+Password hashing and login sessions.
+
+bcrypt is deliberately slow (~250 ms of CPU at cost 12), so hashing and
+checking run in a bounded process pool instead of on the caller's thread:
+the CLI simply waits for the result, the HTTP service awaits it without
+blocking the event loop, and a burst of logins uses every core instead of
+queueing behind the GIL.
+
+A successful login issues a signed session token
+
+    <session id>.<user id>.<expires>.<HMAC-SHA256 signature>
+
+and keeps the user in a server-side session cache, so later requests are
+authenticated with one HMAC and a dict lookup instead of another bcrypt
+round. The cached user (and role) is reloaded from the database once it is
+USER_REFRESH seconds old, so a demotion or deletion applies within that.
+A valid token whose session is not cached (another process, a restart) is
+accepted once its user is reloaded too; share CINEMA_SESSION_SECRET between
+processes for that. logout() revokes a token in this process; otherwise
+tokens live until they expire.
+
+Hashes made with a cost other than BCRYPT_ROUNDS are rehashed on the next
+successful login, so raising the cost needs no migration.
+
+    session = auth.login("alice", "secret")      # None if the password is wrong
+    user = core.run(auth.authenticate(session["token"]))
+
+bcrypt, asyncio and the process pool are imported on first use, so scripts
+that never hash a password (reports, exports) don't pay for them.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import core
+
+BCRYPT_ROUNDS = int(os.environ.get("CINEMA_BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = os.cpu_count() or 1   # 0 hashes inline on the calling thread
+MAX_PENDING = 64                     # queued hash jobs before callers wait (or get AuthBusy)
+SESSION_TTL = 8 * 3600               # seconds
+USER_REFRESH = 60                    # seconds a session's cached user and role are trusted
+SESSION_CACHE_SIZE = 10000
+
+_secret = os.environ.get("CINEMA_SESSION_SECRET", "").encode() or secrets.token_bytes(32)
+
+
+class AuthBusy(Exception):
+    """Too many password hashes are already queued; try again shortly."""
+
+
+# =====================
+# bcrypt in a process pool
+# =====================
+def _hash(password, rounds):
+    import bcrypt
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+    import bcrypt
+    return bcrypt.checkpw(password, hashed)
+
+
+class HashPool:
+    def __init__(self, workers=HASH_WORKERS, max_pending=MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._executor = ProcessPoolExecutor(self.workers)
+        return self._executor
+
+    def submit(self, fn, *args, block=True):
+        """Run fn(*args) in a worker; returns a concurrent.futures.Future."""
+        if not self._pending.acquire(blocking=block):
+            raise AuthBusy(f"{self.max_pending} password hashes already queued")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def call(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        return self.submit(fn, *args).result()
+
+    async def acall(self, fn, *args):
+        import asyncio
+        if not self.workers:
+            return await asyncio.to_thread(fn, *args)
+        return await asyncio.wrap_future(self.submit(fn, *args, block=False))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+_pool = HashPool()
+_dummy_hash = None  # checked against for unknown users so they take as long as a wrong password
+
+
+def _as_bytes(hashed):
+    return hashed.encode() if isinstance(hashed, str) else bytes(hashed)
+
+
+def hash_password(password):
+    return _pool.call(_hash, password.encode(), BCRYPT_ROUNDS)
+
+
+def verify_password(password, hashed):
+    return _pool.call(_check, password.encode(), _as_bytes(hashed))
+
+
+def cost(hashed):
+    """The bcrypt cost a hash was made with ($2b$<cost>$...)."""
+    return int(_as_bytes(hashed).split(b"$")[2])
+
+
+def needs_rehash(hashed):
+    return cost(hashed) != BCRYPT_ROUNDS
+
+
+# Making the dummy hash costs one bcrypt round, like the check it stands in
+# for, so even the first unknown user takes as long as a wrong password
+def _check_dummy(password):
+    global _dummy_hash
+    if _dummy_hash is None or needs_rehash(_dummy_hash):
+        _dummy_hash = _pool.call(_hash, secrets.token_bytes(16), BCRYPT_ROUNDS)
+    else:
+        _pool.call(_check, password.encode(), _dummy_hash)
+
+
+async def _acheck_dummy(password):
+    global _dummy_hash
+    if _dummy_hash is None or needs_rehash(_dummy_hash):
+        _dummy_hash = await _pool.acall(_hash, secrets.token_bytes(16), BCRYPT_ROUNDS)
+    else:
+        await _pool.acall(_check, password.encode(), _dummy_hash)
+
+
+# =====================
+# Session tokens
+# =====================
+class SessionCache:
+    """Thread-safe LRU of session id -> (user, expires, loaded at)."""
+
+    def __init__(self, maxsize=SESSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._revoked = {}  # session id -> expires
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            item = self._items.get(sid)
+            now = time.time()
+            if item is None or item[1] < now or now - item[2] > USER_REFRESH:
+                self._items.pop(sid, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(sid)
+            self.hits += 1
+            return item[0]
+
+    def put(self, sid, user, expires):
+        with self._lock:
+            self._items[sid] = (user, expires, time.time())
+            self._items.move_to_end(sid)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def revoke(self, sid, expires):
+        with self._lock:
+            self._items.pop(sid, None)
+            now = time.time()
+            self._revoked = {s: e for s, e in self._revoked.items() if e > now}
+            self._revoked[sid] = expires
+
+    def is_revoked(self, sid):
+        with self._lock:
+            return sid in self._revoked
+
+    def snapshot(self):
+        with self._lock:
+            return {"sessions": len(self._items), "hits": self.hits, "misses": self.misses,
+                    "revoked": len(self._revoked)}
+
+
+_sessions = SessionCache()
+
+
+def _sign(payload):
+    digest = hmac.new(_secret, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def _public(user):
+    return {"id": user["id"], "username": user["username"], "role": user["role"]}
+
+
+def issue_token(user, ttl=None):
+    """Start a session for a user row; returns {"token", "user", "expires"}."""
+    sid = secrets.token_urlsafe(16)
+    expires = int(time.time()) + (ttl or SESSION_TTL)
+    payload = f"{sid}.{user['id']}.{expires}"
+    user = _public(user)
+    _sessions.put(sid, user, expires)
+    return {"token": f"{payload}.{_sign(payload)}", "user": user, "expires": expires}
+
+
+def _parse(token):
+    """(session id, user id, expires) for a well-signed, unexpired token, else None."""
+    try:
+        sid, user_id, expires, sig = token.split(".")
+        user_id, expires = int(user_id), int(expires)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(sig, _sign(f"{sid}.{user_id}.{expires}")):
+        return None
+    if expires < time.time() or _sessions.is_revoked(sid):
+        return None
+    return sid, user_id, expires
+
+
+def logout(token):
+    parsed = _parse(token)
+    if parsed:
+        _sessions.revoke(parsed[0], parsed[2])
+
+
+def session_stats():
+    return _sessions.snapshot()
+
+
+# =====================
+# Operations (see core.py)
+# =====================
+def find_user(username):
+    return (yield core.fetchone("SELECT id, username, password_hash, role FROM users "
+                            "WHERE username = %s", (username,)))
+
+
+def load_user(user_id):
+    return (yield core.fetchone("SELECT id, username, role FROM users WHERE id = %s", (user_id,)))
+
+
+def create_user(username, password_hash, role="user"):
+    return (yield core.execute("INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s)",
+                             (username, password_hash, role)))
+
+
+def store_hash(user_id, password_hash):
+    return (yield core.execute("UPDATE users SET password_hash = %s WHERE id = %s",
+                             (password_hash, user_id)))
+
+
+def authenticate(token):
+    """Operation returning the session's user, or None for a bad/expired token."""
+    parsed = _parse(token)
+    if parsed is None:
+        return None
+    sid, user_id, expires = parsed
+    user = _sessions.get(sid)
+    if user is None:
+        row = yield from load_user(user_id)
+        if row is None:
+            return None
+        user = _public(row)
+        _sessions.put(sid, user, expires)
+    return user
+
+
+# =====================
+# Blocking API (CLI)
+# =====================
+def register(username, password, role="user"):
+    """Create a user; raises db.IntegrityError if the username is taken."""
+    core.run(create_user(username, hash_password(password), role))
+
+
+def login(username, password):
+    """Check a password and start a session; returns issue_token()'s dict or None."""
+    user = core.run(find_user(username))
+    if user is None:
+        _check_dummy(password)
+        return None
+    if not verify_password(password, user["password_hash"]):
+        return None
+    if needs_rehash(user["password_hash"]):
+        core.run(store_hash(user["id"], hash_password(password)))
+    return issue_token(user)
+
+
+# =====================
+# Async API (service.py); pool is an aiodb pool
+# =====================
+async def aregister(pool, username, password, role="user"):
+    hashed = await _pool.acall(_hash, password.encode(), BCRYPT_ROUNDS)
+    await pool.run(create_user(username, hashed, role))
+
+
+async def alogin(pool, username, password):
+    user = await pool.run(find_user(username))
+    if user is None:
+        await _acheck_dummy(password)
+        return None
+    if not await _pool.acall(_check, password.encode(), _as_bytes(user["password_hash"])):
+        return None
+    if needs_rehash(user["password_hash"]):
+        hashed = await _pool.acall(_hash, password.encode(), BCRYPT_ROUNDS)
+        await pool.run(store_hash(user["id"], hashed))
+    return issue_token(user)
+
+
+def configure(rounds=None, workers=None, secret=None, session_ttl=None):
+    global BCRYPT_ROUNDS, SESSION_TTL, _pool, _secret
+    if rounds is not None:
+        BCRYPT_ROUNDS = rounds
+    if session_ttl is not None:
+        SESSION_TTL = session_ttl
+    if secret is not None:
+        _secret = secret.encode() if isinstance(secret, str) else secret
+    if workers is not None and workers != _pool.workers:
+        _pool.shutdown()
+        _pool = HashPool(workers)
@@ -0,0 +1,196 @@
+"""
+Storage backends behind db.unit_of_work().
+
+Both backends run the same schema (schema.py, applied by migrations.py) and the same SQL text from
+main.py. Queries are written with %s placeholders; the SQLite cursor rewrites
+them to ? before handing them to sqlite3.
+
+    MySQLBackend(DB_CONFIG)         -- pooled mysql.connector connections
+    MySQLBackend(DB_CONFIG, use_pure=False, prepared=True)
+                                    -- ... on the C extension, hot statements prepared
+    SQLiteBackend("cinema.db")      -- in-process SQLite in WAL mode
+    SQLiteBackend(":memory:")       -- shared in-memory database (tests/benchmarks)
+
+shards.ShardedBackend(home, {"east": ..., "west": ...}) spreads bookings over
+several of them.
+"""
+import queue
+import sqlite3
+import threading
+from decimal import Decimal
+from functools import lru_cache
+
+import db
+
+
+class Backend:
+    """Common surface used by db.py; subclasses provide self.pool."""
+
+    dialect = None
+
+    def unit_of_work(self, dictionary=False, buffered=True):
+        return self.pool.unit_of_work(dictionary=dictionary, buffered=buffered)
+
+    def stats(self):
+        return self.pool.stats.snapshot()
+
+    def nodes(self):
+        return [None]
+
+    def shard_of(self, showtime_id):
+        return None
+
+    def init_schema(self):
+        """Bring the schema up to date; returns the migration versions applied."""
+        import migrations
+        return migrations.migrate(self)
+
+
+# =====================
+# MySQL
+# =====================
+class MySQLBackend(Backend):
+    dialect = "mysql"
+
+    def __init__(self, config, **pool_options):
+        self.config = dict(config)
+        self.pool_options = {**db.POOL_DEFAULTS, **pool_options}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Created lazily: the database may not exist until init_schema() ran.
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = db.ConnectionPool(self.config, **self.pool_options)
+        return self._pool
+
+    def init_schema(self):
+        import mysql.connector
+
+        # First connect without database to create it
+        cfg = {k: v for k, v in self.config.items() if k != "database"}
+        conn = mysql.connector.connect(**cfg)
+        cur = conn.cursor()
+        cur.execute(f"CREATE DATABASE IF NOT EXISTS {self.config['database']} "
+                    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;")
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return super().init_schema()
+
+
+# =====================
+# SQLite
+# =====================
+# DECIMAL columns have numeric affinity, so a Decimal bound as text is stored
+# as a number, the same value mysql.connector would send
+sqlite3.register_adapter(Decimal, str)
+
+
+@lru_cache(maxsize=512)
+def _qmark(sql):
+    return sql.replace("%s", "?")
+
+
+def _dict_row(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+class SQLiteCursor:
+    """Gives sqlite3 cursors the slice of the mysql.connector API main.py uses."""
+
+    def __init__(self, cur, dictionary):
+        self._cur = cur
+        if dictionary:
+            cur.row_factory = _dict_row
+
+    def execute(self, sql, params=()):
+        self._cur.execute(_qmark(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        self._cur.executemany(_qmark(sql), seq_of_params)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._cur.fetchmany(size)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        self._cur.close()
+
+
+class SQLitePool(db.BasePool):
+    """A fixed set of sqlite3 connections handed out through a queue."""
+
+    integrity_errors = (sqlite3.IntegrityError,)
+    explain_prefix = "EXPLAIN QUERY PLAN "
+
+    def __init__(self, connect, pool_size=5, **options):
+        super().__init__(pool_size=pool_size, **options)
+        self._idle = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._idle.put(connect())
+        self.stats.incr("connections_created", pool_size)
+
+    def _get(self):
+        # The semaphore in BasePool.acquire() guarantees one is idle
+        return self._idle.get_nowait()
+
+    def _put(self, conn):
+        self._idle.put(conn)
+
+    def _cursor(self, conn, dictionary, buffered):
+        return SQLiteCursor(conn.cursor(), dictionary)
+
+    def is_retryable(self, exc):
+        # SQLite reports lock upgrades it refuses to wait for as "locked"
+        return isinstance(exc, sqlite3.OperationalError) and "locked" in str(exc)
+
+
+class SQLiteBackend(Backend):
+    dialect = "sqlite"
+
+    def __init__(self, path="cinema.db", busy_timeout=5.0, **pool_options):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._uri = path == ":memory:"
+        if self._uri:
+            # Every pooled connection must see the same in-memory database,
+            # and it only lives while at least one connection is open.
+            self.path = f"file:cinema-{id(self)}?mode=memory&cache=shared"
+            self._anchor = self._connect()
+        options = {k: v for k, v in pool_options.items() if k != "pool_name"}
+        self.pool = SQLitePool(self._connect, **options)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                               check_same_thread=False, uri=self._uri)
+        conn.execute("PRAGMA foreign_keys = ON")
+        if not self._uri:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
@@ -0,0 +1,76 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import backends  # noqa: E402
+import db  # noqa: E402
+
+
+def make_backend(kind, sqlite_path=None, pool_size=8, **driver):
+    """
+    A backend for benchmarking: a fresh SQLite file by default, or main.DB_CONFIG
+    (driver: use_pure/prepared/pool_name, see db.ConnectionPool).
+    """
+    if kind == "mysql":
+        import main
+        return backends.MySQLBackend(main.DB_CONFIG, pool_size=pool_size, **driver)
+    if sqlite_path is None:
+        sqlite_path = os.path.join(tempfile.mkdtemp(prefix="cinema-bench-"), "bench.db")
+    return backends.SQLiteBackend(sqlite_path, pool_size=pool_size, borrow_timeout=60.0)
+
+
+def seed_showtime(rows, cols, users, price=200, password_hash=b"x" * 60):
+    """Create one movie, screen and showtime plus `users` users; returns (showtime_id, user_ids)."""
+    stamp = int(time.time() * 1000)
+    with db.unit_of_work() as cur:
+        cur.execute("INSERT INTO movies (title, duration_min) VALUES (%s, %s)",
+                    (f"Bench {stamp}", 120))
+        movie_id = cur.lastrowid
+        cur.execute("INSERT INTO screens (name, total_rows, total_cols) VALUES (%s, %s, %s)",
+                    (f"Bench {stamp}", rows, cols))
+        screen_id = cur.lastrowid
+        cur.execute("INSERT INTO showtimes (movie_id, screen_id, start_time, price) "
+                    "VALUES (%s, %s, %s, %s)",
+                    (movie_id, screen_id, time.strftime("%Y-%m-%d %H:%M:%S"), price))
+        showtime_id = cur.lastrowid
+        cur.executemany("INSERT INTO users (username, password_hash) VALUES (%s, %s)",
+                        [(f"bench-{stamp}-{i}", password_hash) for i in range(users)])
+        cur.execute("SELECT id FROM users WHERE username LIKE %s ORDER BY id",
+                    (f"bench-{stamp}-%",))
+        user_ids = [row[0] for row in cur.fetchall()]
+    return showtime_id, user_ids
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """{'p50': ..., ...} in milliseconds from a list of seconds."""
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        idx = min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))
+        result[f"p{p}"] = ordered[idx] * 1000
+    return result
+
+
+def write_results(results, path=None):
+    """Print results as JSON and, if path is given, append them to that JSONL file."""
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        **results,
+    }
+    line = json.dumps(results, default=str)
+    print(json.dumps(results, indent=2, default=str))
+    if path:
+        with open(path, "a", encoding="utf-8") as out:
+            out.write(line + "\n")
+    return results
@@ -0,0 +1,105 @@
+"""
+Login throughput benchmark.
+
+Runs the full auth.login() path (user lookup, bcrypt check, session token)
+for a batch of users, first with bcrypt inline on the calling thread and
+then through auth's process pool, and reports logins/sec overall and per
+core. Also measures how fast an issued token is re-authenticated from the
+session cache.
+
+    python benchmarks/auth_login.py --rounds 12 --logins 64
+    python benchmarks/auth_login.py --workers 2 --out bench.jsonl
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import _common
+import auth
+import core
+import db
+
+
+def _seed(users, password, rounds):
+    stamp = int(time.time() * 1000)
+    names = [f"auth-{stamp}-{i}" for i in range(users)]
+    hashed = auth._pool.call(auth._hash, password.encode(), rounds)
+    with db.unit_of_work() as cur:
+        cur.executemany("INSERT INTO users (username, password_hash) VALUES (%s, %s)",
+                        [(name, hashed) for name in names])
+    return names
+
+
+def _logins(names, password, logins, threads):
+    """(elapsed, latencies, tokens) for `logins` concurrent auth.login() calls."""
+    def one(i):
+        start = time.perf_counter()
+        session = auth.login(names[i % len(names)], password)
+        return time.perf_counter() - start, session["token"]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(one, range(logins)))
+    return time.perf_counter() - started, [lat for lat, _ in results], [t for _, t in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--sqlite-path", help="database file (default: a fresh temp file)")
+    parser.add_argument("--rounds", type=int, default=auth.BCRYPT_ROUNDS, help="bcrypt cost")
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="hash processes for the pooled run")
+    parser.add_argument("--out", help="append the JSON result to this file")
+    args = parser.parse_args()
+
+    backend = _common.make_backend(args.backend, args.sqlite_path, pool_size=args.workers * 2)
+    db.configure(backend)
+    backend.init_schema()
+    password = "correct horse battery staple"
+
+    # Inline: bcrypt on the caller's thread, one login at a time
+    auth.configure(rounds=args.rounds, workers=0)
+    names = _seed(args.logins, password, args.rounds)
+    inline_s, inline_lat, _ = _logins(names, password, args.logins, threads=1)
+
+    # Pooled: enough callers to keep every hash process busy
+    auth.configure(workers=args.workers)
+    auth._pool.call(auth._check, b"warm", auth._hash(b"warm", 4))  # start the processes
+    pooled_s, pooled_lat, tokens = _logins(names, password, args.logins, threads=args.workers * 2)
+    auth._pool.shutdown()
+
+    # Repeat requests: token -> user from the session cache, no bcrypt
+    started = time.perf_counter()
+    checks = 0
+    while time.perf_counter() - started < 1.0:
+        for token in tokens:
+            core.run(auth.authenticate(token))
+        checks += len(tokens)
+    session_s = time.perf_counter() - started
+
+    _common.write_results({
+        "benchmark": "auth_login",
+        "backend": args.backend,
+        "bcrypt_rounds": args.rounds,
+        "logins": args.logins,
+        "cpu_count": os.cpu_count(),
+        "inline": {
+            "logins_per_s": args.logins / inline_s,
+            "logins_per_s_per_core": args.logins / inline_s,
+            "latency_ms": _common.percentiles(inline_lat),
+        },
+        "pooled": {
+            "workers": args.workers,
+            "logins_per_s": args.logins / pooled_s,
+            "logins_per_s_per_core": args.logins / pooled_s / args.workers,
+            "latency_ms": _common.percentiles(pooled_lat),
+        },
+        "session_checks_per_s": checks / session_s,
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Concurrent booking load test.
+
+Drives the same hold -> confirm path user_book_tickets uses, minus the
+input() prompts, with N simulated users racing for one showtime, then audits
+booking_seats for double-booked seats.
+
+    python benchmarks/booking_load.py --users 200 --workers 16
+    python benchmarks/booking_load.py --processes --workers 4 --mode auto --out bench.jsonl
+
+Results are printed as JSON and, with --out, appended to a JSONL file so
+runs can be compared over time.
+"""
+import argparse
+import multiprocessing
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import _common
+import allocator
+import db
+import reservations
+
+OUTCOMES = ("booked", "conflict", "expired", "no_seats", "error")
+
+
+def _one_user(showtime_id, user_id, rows, cols, seats_per_booking, mode, rng):
+    start = time.perf_counter()
+    try:
+        if mode == "auto":
+            held = allocator.auto_hold(user_id, showtime_id, seats_per_booking)
+            if held is None:
+                return "no_seats", time.perf_counter() - start
+            reservations.confirm(held[0])
+        else:
+            # Pick a random adjacent block the way a customer typing codes would
+            r = chr(65 + rng.randrange(rows))
+            c = rng.randrange(1, cols - seats_per_booking + 2)
+            seats = [(r, c + i) for i in range(seats_per_booking)]
+            reservations.book_seats(user_id, showtime_id, seats)
+        outcome = "booked"
+    except reservations.SeatUnavailable:
+        outcome = "conflict"
+    except reservations.HoldExpired:
+        outcome = "expired"
+    except Exception:
+        outcome = "error"
+    return outcome, time.perf_counter() - start
+
+
+def _run_users(args, showtime_id, user_ids, seed):
+    rng = random.Random(seed)
+    return [_one_user(showtime_id, uid, args.rows, args.cols, args.seats, args.mode, rng)
+            for uid in user_ids]
+
+
+def _process_worker(payload):
+    # Each process builds its own pool against the same database file
+    args, path, showtime_id, user_ids, seed = payload
+    db.configure(_common.make_backend(args.backend, path, pool_size=2))
+    results = _run_users(args, showtime_id, user_ids, seed)
+    return results, db.stats()
+
+
+def audit(showtime_id):
+    """Seats sold more than once, and seats whose count disagrees with the rollup."""
+    with db.unit_of_work() as cur:
+        cur.execute("""
+            SELECT seat_row, seat_col, COUNT(*) FROM booking_seats
+            WHERE showtime_id = %s
+            GROUP BY seat_row, seat_col
+            HAVING COUNT(*) > 1
+        """, (showtime_id,))
+        doubles = cur.fetchall()
+        cur.execute("SELECT COUNT(*) FROM booking_seats WHERE showtime_id = %s", (showtime_id,))
+        seats = cur.fetchone()[0]
+        cur.execute("SELECT seats_sold FROM showtime_sales WHERE showtime_id = %s", (showtime_id,))
+        rollup = cur.fetchone()
+    return {
+        "double_booked_seats": sum(n - 1 for _, _, n in doubles),
+        "seats_sold": seats,
+        "rollup_mismatch": (rollup[0] if rollup else 0) != seats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--sqlite-path", help="database file (default: a fresh temp file)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--processes", action="store_true", help="use processes instead of threads")
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--seats", type=int, default=2, help="seats per booking")
+    parser.add_argument("--mode", choices=("manual", "auto"), default="manual")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="append the JSON result to this file")
+    args = parser.parse_args()
+
+    backend = _common.make_backend(args.backend, args.sqlite_path, pool_size=args.workers)
+    db.configure(backend)
+    backend.init_schema()
+    showtime_id, user_ids = _common.seed_showtime(args.rows, args.cols, args.users)
+
+    # Round-robin users over workers so each worker gets a similar share
+    shares = [user_ids[i::args.workers] for i in range(args.workers)]
+    started = time.perf_counter()
+    if args.processes:
+        path = getattr(backend, "path", None)
+        payloads = [(args, path, showtime_id, share, args.seed + i) for i, share in enumerate(shares)]
+        with multiprocessing.Pool(args.workers) as procs:
+            parts = procs.map(_process_worker, payloads)
+        results = [r for part, _ in parts for r in part]
+        retries = sum(s["retries"] for _, s in parts)
+        deadlocks = sum(s["deadlocks"] for _, s in parts)
+    else:
+        with ThreadPoolExecutor(args.workers) as pool:
+            parts = pool.map(lambda p: _run_users(args, showtime_id, p[1], args.seed + p[0]),
+                             enumerate(shares))
+            results = [r for part in parts for r in part]
+        retries = db.stats()["retries"]
+        deadlocks = db.stats()["deadlocks"]
+    elapsed = time.perf_counter() - started
+
+    counts = {o: 0 for o in OUTCOMES}
+    for outcome, _ in results:
+        counts[outcome] += 1
+    latencies = [lat for _, lat in results]
+
+    _common.write_results({
+        "benchmark": "booking_load",
+        "backend": args.backend,
+        "mode": args.mode,
+        "concurrency": "processes" if args.processes else "threads",
+        "workers": args.workers,
+        "users": args.users,
+        "screen": f"{args.rows}x{args.cols}",
+        "seats_per_booking": args.seats,
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(results) / elapsed if elapsed else None,
+        "latency_ms": _common.percentiles(latencies),
+        "outcomes": counts,
+        "deadlocks": deadlocks,
+        "retries": retries,
+        **audit(showtime_id),
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
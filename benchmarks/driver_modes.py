@@ -0,0 +1,108 @@
+"""
+MySQL driver mode comparison on the booking and seat-map paths.
+
+Runs the same single-threaded loops once per driver mode, each on a fresh
+showtime: seat-map loads (inventory.load_inventory, past the inventory cache)
+of a half-sold screen, then one-seat bookings (reservations.book_seats):
+
+    pure       mysql.connector's pure-Python protocol, text statements
+    cext       the C extension (use_pure=False), text statements
+    prepared   the C extension with the db.prepared() statements prepared
+    pure-prepared  pure Python with prepared statements
+
+    python benchmarks/driver_modes.py --backend mysql --ops 2000
+    python benchmarks/driver_modes.py --backend mysql --modes cext,prepared --out bench.jsonl
+
+SQLite has no driver modes; --backend sqlite times the same loops once as a
+baseline. Results are printed as JSON and, with --out, appended to a JSONL file.
+"""
+import argparse
+import time
+
+import _common
+import db
+import inventory
+import reservations
+
+MODES = {
+    "pure": {"use_pure": True},
+    "cext": {"use_pure": False},
+    "prepared": {"use_pure": False, "prepared": True},
+    "pure-prepared": {"use_pure": True, "prepared": True},
+}
+
+
+def _timed(fn, n):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return {"ops": n, "ops_per_s": n / sum(samples) if samples else None,
+            "latency_ms": _common.percentiles(samples)}
+
+
+def run_mode(args, backend):
+    db.configure(backend)
+    capacity = args.rows * args.cols
+    showtime_id, user_ids = _common.seed_showtime(args.rows, args.cols, args.users)
+    seats = [(chr(65 + r), c) for r in range(args.rows) for c in range(1, args.cols + 1)]
+
+    # Half the screen sold up front, so every seat-map load reads capacity / 2 rows
+    for i, seat in enumerate(seats[:capacity // 2]):
+        reservations.book_seats(user_ids[i % len(user_ids)], showtime_id, [seat])
+    seat_map = _timed(lambda i: inventory.load_inventory(showtime_id), args.ops)
+
+    free = seats[capacity // 2:]
+    bookings = min(args.ops, len(free))
+    booking = _timed(lambda i: reservations.book_seats(user_ids[i % len(user_ids)], showtime_id,
+                                                       [free[i]]), bookings)
+    stats = db.stats()
+    return {"seat_map": seat_map, "booking": booking,
+            "borrows": stats["borrows"], "prepares": stats["prepares"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--sqlite-path", help="database file (default: a fresh temp file)")
+    parser.add_argument("--modes", default=",".join(MODES),
+                        help=f"comma-separated, from {', '.join(MODES)} (mysql only)")
+    parser.add_argument("--ops", type=int, default=500, help="seat-map loads and bookings per mode")
+    parser.add_argument("--rows", type=int, default=26)
+    parser.add_argument("--cols", type=int, default=40)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--out", help="append the JSON result to this file")
+    args = parser.parse_args()
+
+    if args.backend == "sqlite":
+        backends_by_mode = {"sqlite": _common.make_backend("sqlite", args.sqlite_path, pool_size=2)}
+    else:
+        modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            parser.error(f"unknown mode(s): {', '.join(sorted(unknown))}")
+        backends_by_mode = {m: _common.make_backend("mysql", pool_size=2, pool_name=f"bench_{m}",
+                                                    **MODES[m]) for m in modes}
+
+    first = next(iter(backends_by_mode.values()))
+    db.configure(first)
+    first.init_schema()
+    results = {mode: run_mode(args, backend) for mode, backend in backends_by_mode.items()}
+
+    extension = None
+    if args.backend == "mysql":
+        import mysql.connector
+        extension = mysql.connector.HAVE_CEXT  # False: the cext modes fell back to pure Python
+
+    _common.write_results({
+        "benchmark": "driver_modes",
+        "backend": args.backend,
+        "c_extension": extension,
+        "screen": f"{args.rows}x{args.cols}",
+        "modes": results,
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Read-through cache for the catalog: movies, screens and the showtime listing.
+
+The catalog only changes when an admin edits it, so the listings are kept
+in memory and served without a query. Every edit bumps the single-row
+catalog_version table in the same transaction (bump(cur)); a process
+compares its cached stamp with that row at most once per CHECK_INTERVAL,
+so edits made by another process (CLI, service, ...) are picked up within
+a couple of seconds for the price of one primary-key lookup. Entries are
+also reloaded after TTL regardless.
+
+The listings are core-style operations (see core.py):
+
+    movies = core.run(catalog.movies())
+
+Returned lists are shared between callers; treat them as read-only.
+"""
+import threading
+import time
+
+import queries
+
+TTL = 300.0            # seconds before an entry is reloaded unconditionally
+CHECK_INTERVAL = 2.0   # seconds between version-stamp checks
+
+VERSION_SQL = "SELECT version FROM catalog_version WHERE id = 1"
+BUMP_SQL = "UPDATE catalog_version SET version = version + 1 WHERE id = 1"
+
+LISTINGS = {
+    "movies": queries.LIST_MOVIES,
+    "screens": queries.LIST_SCREENS,
+    "showtimes": queries.LIST_SHOWTIMES,
+}
+
+
+class CatalogCache:
+    def __init__(self, ttl=TTL, check_interval=CHECK_INTERVAL):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0           # reloads caused by another writer's version bump
+        self.version_checks = 0
+        self.invalidations = 0
+        self._entries = {}       # name -> (version, loaded_at, rows)
+        self._version = None     # last stamp read from the database
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self, name, now):
+        """The cached rows if they can be served without checking the stamp."""
+        entry = self._entries.get(name)
+        if entry is None or now - entry[1] > self.ttl:
+            return None
+        if entry[0] != self._version or now - self._checked_at > self.check_interval:
+            return None
+        return entry[2]
+
+    def read(self, name):
+        """Operation returning the rows of one listing, loading them on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            rows = self._fresh(name, now)
+            if rows is not None:
+                self.hits += 1
+                return rows
+
+        # Read the stamp first: rows loaded in the same unit of work are at
+        # least as new as it, so a later bump always forces a reload.
+        row = yield "one", VERSION_SQL, ()
+        version = row["version"] if row else 0
+        with self._lock:
+            self.version_checks += 1
+            if self._version is not None and version != self._version:
+                self.stale += 1
+                self._entries.clear()
+            self._version = version
+            self._checked_at = now
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version and now - entry[1] <= self.ttl:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        rows = yield "all", LISTINGS[name], ()
+        with self._lock:
+            self._entries[name] = (version, now, rows)
+        return rows
+
+    def invalidate(self):
+        with self._lock:
+            self.invalidations += 1
+            self._entries.clear()
+            self._checked_at = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups * 100 if lookups else 0.0,
+                "stale_reloads": self.stale,
+                "version_checks": self.version_checks,
+                "invalidations": self.invalidations,
+                "version": self._version,
+                "entries": sorted(self._entries),
+            }
+
+
+_cache = CatalogCache()
+
+
+def movies():
+    return (yield from _cache.read("movies"))
+
+
+def screens():
+    return (yield from _cache.read("screens"))
+
+
+def showtimes():
+    return (yield from _cache.read("showtimes"))
+
+
+def bump(cur):
+    """Record a catalog edit inside the editing transaction and drop local entries."""
+    cur.execute(BUMP_SQL)
+    _cache.invalidate()
+
+
+def invalidate():
+    _cache.invalidate()
+
+
+def stats():
+    return _cache.snapshot()
@@ -0,0 +1,284 @@
+"""
+Cinema operations shared by the CLI (main.py) and the HTTP service (service.py).
+
+Read operations are generators that yield the statements they need and get
+the rows back, so the same code runs on the blocking pool and on the async
+one:
+
+    shows = core.run(core.showtimes())             # db.unit_of_work()
+    shows = await pool.run(core.showtimes())       # aiodb pool
+
+Steps are built with fetchone(), fetchall() and execute():
+
+    def movie_title(movie_id):
+        row = yield core.fetchone("SELECT title FROM movies WHERE id = %s", (movie_id,))
+        return row and row["title"]
+
+Each yielded step is ("one" | "all" | "exec", sql, params) and receives the
+fetched row(s), or the rowcount for "exec". An operation that yields
+nothing (e.g. a seat map already in the inventory cache) never borrows a
+connection. Results are plain dicts and lists ready to print or to JSON-encode.
+
+Booking goes through reservations/allocator as before and stays blocking;
+the service runs it on a worker thread.
+"""
+from datetime import date, datetime, timedelta
+
+import allocator
+import catalog
+import db
+import inventory
+import queries
+import reportcache
+import reservations
+
+
+def fetchone(sql, params=()):
+    return "one", sql, params
+
+
+def fetchall(sql, params=()):
+    return "all", sql, params
+
+
+def execute(sql, params=()):
+    return "exec", sql, params
+
+
+def _fetch(cur, kind):
+    if kind == "one":
+        return cur.fetchone()
+    if kind == "all":
+        return cur.fetchall()
+    return cur.rowcount
+
+
+def run(op):
+    """Drive an operation on a db.unit_of_work() cursor; returns its result."""
+    try:
+        step = next(op)
+    except StopIteration as done:
+        return done.value
+    with db.unit_of_work(dictionary=True) as cur:
+        while True:
+            kind, sql, params = step
+            cur.execute(sql, params)
+            result = _fetch(cur, kind)
+            try:
+                step = op.send(result)
+            except StopIteration as done:
+                return done.value
+
+
+# =====================
+# Catalog
+# =====================
+def movies():
+    return (yield from catalog.movies())
+
+
+def screens():
+    return (yield from catalog.screens())
+
+
+def showtimes():
+    return (yield from catalog.showtimes())
+
+
+def seat_map(showtime_id):
+    """SeatInventory for a showtime (cached between bookings), or None."""
+    inv = inventory.cached(showtime_id)
+    if inv is None:
+        screen = yield fetchone(queries.SHOWTIME_SCREEN, (showtime_id,))
+        if not screen:
+            return None
+        booked = yield fetchall(queries.BOOKED_SEATS, (showtime_id,))
+        inv = inventory.from_rows(showtime_id, screen, booked)
+        inventory.store(inv)
+    return inv
+
+
+def seats_sold(showtime_id):
+    """Seats sold for a showtime, per the showtime_sales rollup."""
+    row = yield fetchone(queries.SEATS_SOLD, (showtime_id,))
+    return int(row["sold"])
+
+
+def describe_seats(inv):
+    return {
+        "showtime_id": inv.showtime_id,
+        "rows": inv.rows,
+        "cols": inv.cols,
+        "map": inv.render(),
+        "available": inv.available_count(),
+        "capacity": inv.capacity,
+        "occupancy": round(inv.occupancy(), 1),
+    }
+
+
+# =====================
+# Bookings
+# =====================
+def parse_seat(code):
+    """'A5' -> ('A', 5)."""
+    code = code.strip().upper()
+    if len(code) < 2 or not code[0].isalpha() or not code[1:].isdigit():
+        raise ValueError(f"bad seat code: {code!r}")
+    return code[0], int(code[1:])
+
+
+def book(user_id, showtime_id, seats=None, count=None):
+    """
+    Book the given [(row, col), ...] seats, or the best `count` available
+    ones, for a user. Returns the booking dict from reservations.confirm().
+    Raises ValueError for unknown shows or seats and
+    reservations.SeatUnavailable when they are taken.
+    """
+    inv = inventory.get(showtime_id)
+    if inv is None:
+        raise ValueError(f"no such showtime: {showtime_id}")
+    if seats is None:
+        held = allocator.auto_hold(user_id, showtime_id, count)
+        if held is None:
+            raise reservations.SeatUnavailable([])
+        return reservations.confirm(held[0])
+
+    bad = [(r, c) for r, c in seats if not inv.is_valid(r, c)]
+    if bad:
+        raise ValueError("no such seat(s): " + ", ".join(f"{r}{c}" for r, c in bad))
+    try:
+        return reservations.book_seats(user_id, showtime_id, seats)
+    except reservations.SeatUnavailable:
+        inventory.invalidate(showtime_id)
+        allocator.invalidate(showtime_id)
+        raise
+
+
+def _page_key(row):
+    return row["start_time"], row["booking_id"] if "booking_id" in row else row["id"]
+
+
+def bookings_page(template, filters=(), after=None, limit=queries.PAGE_SIZE):
+    """One keyset page of a listing; after is (start_time, id) of the last row seen."""
+    rows = yield fetchall(*queries.keyset_page(template, filters, after, limit))
+    # Under db.fan_out() every node sends its own page; keep the newest of them
+    return sorted(rows, key=_page_key, reverse=True)[:limit]
+
+
+def my_bookings(user_id, after=None, limit=queries.PAGE_SIZE):
+    return (yield from bookings_page(queries.MY_BOOKINGS, [("b.user_id = %s", user_id)],
+                                     after, limit))
+
+
+def browse_showtimes(movie_id=None, title=None, screen_id=None, date_from=None, date_to=None,
+                     min_price=None, max_price=None, hide_sold_out=False,
+                     after=None, limit=queries.PAGE_SIZE):
+    """
+    One page of upcoming showtimes, earliest first, with seats remaining;
+    after is (start_time, id) of the last row seen. See queries.showtime_filters().
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    filters = queries.showtime_filters(now, movie_id, title, screen_id,
+                                       date_from, date_to, min_price, max_price)
+    page = []
+    while len(page) < limit:
+        rows = yield fetchall(*queries.keyset_page(queries.BROWSE_SHOWTIMES, filters, after,
+                                                   limit, newest_first=False))
+        # Every node lists the same shows with its own share of the seats sold
+        rows = sorted(_merge(rows, "id", ("seats_sold",)), key=_page_key)[:limit]
+        for r in rows:
+            r["remaining"] = r["capacity"] - r["seats_sold"]
+        page += [r for r in rows if r["remaining"] > 0 or not hide_sold_out]
+        if len(rows) < limit:
+            break
+        after = _page_key(rows[-1])
+    return page[:limit]
+
+
+# =====================
+# Reports
+# =====================
+def _merge(rows, key, totals):
+    """
+    Rows combined per key, summing the totals columns: under db.fan_out()
+    each node reports its own share of a show or day (see shards.py).
+    """
+    merged = {}
+    for r in rows:
+        seen = merged.get(r[key])
+        if seen is None:
+            merged[r[key]] = dict(r)
+        else:
+            for col in totals:
+                seen[col] = (seen[col] or 0) + (r[col] or 0)
+    return list(merged.values())
+
+
+def _top(revenue_by_title):
+    if not revenue_by_title:
+        return None
+    title, revenue = max(revenue_by_title.items(), key=lambda item: item[1])
+    if not revenue:
+        return None
+    return {"title": title, "revenue": revenue}
+
+
+def daily_report(day=None):
+    """Per-showtime sales for one 'YYYY-MM-DD' day (default today), with totals."""
+    day = day or date.today().isoformat()
+    return (yield from reportcache.cached("daily", day, day, lambda: _daily_report(day)))
+
+
+def _daily_report(day):
+    rows = yield fetchall(queries.DAILY_SHOWTIMES, queries.day_bounds(day) * 2)
+    rows = sorted(_merge(rows, "show_id", ("tickets_sold", "revenue")), key=lambda r: r["start_time"])
+
+    shows = []
+    by_movie = {}
+    for r in rows:
+        capacity = (r["total_rows"] or 0) * (r["total_cols"] or 0)
+        tickets_sold = int(r["tickets_sold"] or 0)
+        revenue = float(r["revenue"] or 0.0)
+        shows.append({
+            "show_id": r["show_id"],
+            "movie_title": r["movie_title"],
+            "screen_name": r["screen_name"],
+            "start_time": r["start_time"],
+            "tickets_sold": tickets_sold,
+            "capacity": capacity,
+            "occupancy": (tickets_sold / capacity * 100) if capacity > 0 else 0.0,
+            "revenue": revenue,
+            "avg_ticket": (revenue / tickets_sold) if tickets_sold > 0 else 0.0,
+        })
+        by_movie[r["movie_title"]] = by_movie.get(r["movie_title"], 0.0) + revenue
+    return {
+        "date": day,
+        "showtimes": shows,
+        "total_revenue": sum(s["revenue"] for s in shows),
+        "total_tickets": sum(s["tickets_sold"] for s in shows),
+        "top_movie": _top(by_movie),
+    }
+
+
+def monthly_report(days=30):
+    """Revenue and tickets per day over the last `days` days, with totals."""
+    since = (date.today() - timedelta(days=days)).isoformat()
+    # Shows from `since` on, including future ones already selling
+    return (yield from reportcache.cached("monthly", since, None, lambda: _monthly_report(since)))
+
+
+def _monthly_report(since):
+    rows = yield fetchall(queries.MONTHLY_BY_DAY, (since,))
+    rows = sorted(_merge(rows, "day", ("tickets_sold", "revenue")), key=lambda r: str(r["day"]))
+    movies = yield fetchall(queries.MONTHLY_BY_MOVIE, (since,))
+    movies = _merge(movies, "title", ("revenue",))
+
+    by_day = [{"day": r["day"], "tickets_sold": int(r["tickets_sold"] or 0),
+               "revenue": float(r["revenue"] or 0.0)} for r in rows]
+    return {
+        "since": since,
+        "days": by_day,
+        "total_revenue": sum(d["revenue"] for d in by_day),
+        "total_tickets": sum(d["tickets_sold"] for d in by_day),
+        "top_movie": _top({m["title"]: float(m["revenue"] or 0.0) for m in movies}),
+    }
@@ -0,0 +1,490 @@
+"""
+Pooled, session-scoped database connections.
+
+Every action in the CLI borrows one connection for the length of a single
+unit of work and hands it back on exit, instead of opening a fresh TCP+auth
+handshake per call:
+
+    with db.unit_of_work(dictionary=True) as cur:
+        cur.execute("SELECT * FROM movies")
+        movies = cur.fetchall()
+
+The unit of work commits when the block exits cleanly and rolls back if it
+raises. Which database sits behind it is decided by the backend passed to
+configure() (see backends.py).
+
+Hot statements with a fixed text are registered with prepared(); a MySQL
+pool created with prepared=True runs them as server-side prepared
+statements, parsed once per connection instead of on every call.
+"""
+import contextvars
+import random
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+
+import tracing
+
+# Defaults for ConnectionPool; override any of them via the backend options
+POOL_DEFAULTS = {
+    "pool_name": "cinema",
+    "pool_size": 5,
+    "borrow_timeout": 5.0,      # seconds to wait for a free connection
+    "return_timeout": 30.0,     # holding a connection longer counts as overdue
+    "health_check_idle": 30.0,  # ping connections idle for longer than this
+}
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within borrow_timeout."""
+
+
+class IntegrityError(Exception):
+    """A constraint (UNIQUE, FOREIGN KEY, ...) rejected the statement."""
+
+
+class DeadlockError(Exception):
+    """The transaction lost a deadlock or lock wait and can be retried."""
+
+
+class Rebalancing(Exception):
+    """The showtime's bookings are being moved to another node (shards.py); retry shortly."""
+
+
+class PoolStats:
+    """Thread-safe counters describing how the pool is being used."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.borrows = 0
+        self.returns = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.timeouts = 0
+        self.overdue = 0
+        self.health_checks = 0
+        self.reconnects = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.deadlocks = 0
+        self.retries = 0
+        self.prepares = 0
+
+    def borrowed(self, waited):
+        with self._lock:
+            self.borrows += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def returned(self, held, overdue):
+        with self._lock:
+            self.returns += 1
+            self.in_use -= 1
+            self.hold_total += held
+            self.hold_max = max(self.hold_max, held)
+            if overdue:
+                self.overdue += 1
+
+    def incr(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def snapshot(self):
+        with self._lock:
+            borrows = self.borrows or 1
+            return {
+                "borrows": self.borrows,
+                "returns": self.returns,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "avg_wait_ms": self.wait_total / borrows * 1000,
+                "max_wait_ms": self.wait_max * 1000,
+                "avg_hold_ms": self.hold_total / borrows * 1000,
+                "max_hold_ms": self.hold_max * 1000,
+                "timeouts": self.timeouts,
+                "overdue": self.overdue,
+                "health_checks": self.health_checks,
+                "reconnects": self.reconnects,
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "deadlocks": self.deadlocks,
+                "retries": self.retries,
+                "prepares": self.prepares,
+            }
+
+
+class BasePool:
+    """
+    Borrow/return bookkeeping shared by every backend's pool.
+
+    Subclasses implement _get(), _put(), _cursor() and is_retryable(), and
+    set integrity_errors to the driver exception types that should surface
+    as IntegrityError.
+    """
+
+    integrity_errors = ()
+    explain_prefix = "EXPLAIN "
+
+    def __init__(self, pool_size=5, borrow_timeout=5.0, return_timeout=30.0,
+                 health_check_idle=30.0):
+        self.pool_size = pool_size
+        self.borrow_timeout = borrow_timeout
+        self.return_timeout = return_timeout
+        self.health_check_idle = health_check_idle
+        self.stats = PoolStats()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def acquire(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.borrow_timeout):
+            self.stats.incr("timeouts")
+            raise PoolTimeout(f"no connection free after {self.borrow_timeout:.1f}s "
+                              f"({self.pool_size} in use)")
+        try:
+            conn = self._get()
+        except Exception:
+            self._slots.release()
+            raise
+        self.stats.borrowed(time.monotonic() - start)
+        return conn
+
+    def is_retryable(self, exc):
+        return False
+
+    def release(self, conn, borrowed_at):
+        held = time.monotonic() - borrowed_at
+        try:
+            self._put(conn)
+        finally:
+            self._slots.release()
+            self.stats.returned(held, held > self.return_timeout)
+
+    @contextmanager
+    def unit_of_work(self, dictionary=False, buffered=True):
+        conn = self.acquire()
+        borrowed_at = time.monotonic()
+        cur = self._cursor(conn, dictionary, buffered)
+        if tracing.tracer.active:
+            cur = tracing.TracedCursor(cur, tracing.tracer)
+        try:
+            yield cur
+            conn.commit()
+        except Exception as exc:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            if isinstance(exc, self.integrity_errors):
+                raise IntegrityError(str(exc)) from exc
+            if self.is_retryable(exc):
+                self.stats.incr("deadlocks")
+                raise DeadlockError(str(exc)) from exc
+            raise
+        finally:
+            cur.close()
+            self.release(conn, borrowed_at)
+            if getattr(cur, "slow", None):
+                tracing.tracer.log_slow(self, cur.slow)
+
+
+# =====================
+# Prepared statements
+# =====================
+_prepared = set()
+
+
+def prepared(sql):
+    """Register sql as a hot statement to run prepared (see ConnectionPool); returns it."""
+    _prepared.add(sql)
+    return sql
+
+
+class PreparedCursor:
+    """
+    A driver cursor that runs registered statements on server-side prepared
+    cursors kept per connection; everything else goes to the plain cursor.
+    """
+
+    def __init__(self, conn, cur, statements, dictionary, stats):
+        self._conn = conn
+        self._plain = cur
+        self._cur = cur
+        self._statements = statements   # this connection's {(sql, dictionary): prepared cursor}
+        self._dictionary = dictionary
+        self._stats = stats
+        self._rows = None
+        self._pos = 0
+
+    def execute(self, sql, params=()):
+        if sql not in _prepared:
+            self._cur, self._rows = self._plain, None
+            return self._plain.execute(sql, params)
+        key = (sql, self._dictionary)
+        cur = self._statements.get(key)
+        if cur is None:
+            cur = self._statements[key] = self._conn.cursor(prepared=True, dictionary=self._dictionary)
+            self._stats.incr("prepares")
+        try:
+            cur.execute(sql, tuple(params))
+            # Prepared cursors are unbuffered: read the result now, so the
+            # connection is free for the next statement whatever the caller fetches
+            self._rows = cur.fetchall() if cur.description else []
+            self._pos = 0
+        except Exception:
+            del self._statements[key]
+            try:
+                cur.close()
+            except Exception:
+                pass
+            raise
+        self._cur = cur
+
+    def executemany(self, sql, seq_of_params):
+        self._cur, self._rows = self._plain, None
+        return self._plain.executemany(sql, seq_of_params)
+
+    def fetchone(self):
+        if self._rows is None:
+            return self._plain.fetchone()
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows) - self._pos) if self._rows is not None else self._plain.fetchall()
+
+    def fetchmany(self, size=1):
+        if self._rows is None:
+            return self._plain.fetchmany(size)
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        # The prepared cursors stay open with their connection
+        self._plain.close()
+
+
+@lru_cache(maxsize=256)
+def _row_type(columns):
+    return namedtuple("Row", columns, rename=True)
+
+
+def named_rows(cur, rows):
+    """Tuple rows from cur as namedtuples with the result's column names."""
+    row_type = _row_type(tuple(d[0] for d in cur.description))
+    return [row_type._make(row) for row in rows]
+
+
+class ConnectionPool(BasePool):
+    """
+    A bounded pool on top of mysql.connector.pooling.MySQLConnectionPool.
+
+    The stock pool raises PoolError as soon as it is exhausted; this wrapper
+    queues borrowers for up to borrow_timeout seconds instead, pings
+    connections that sat idle for too long and keeps PoolStats.
+
+    use_pure=False asks for the driver's C extension (True: the pure-Python
+    protocol; None: the driver's default). prepared=True runs the statements
+    registered with prepared() as server-side prepared statements.
+    """
+
+    def __init__(self, config, pool_name="cinema", use_pure=None, prepared=False, **options):
+        from mysql.connector import pooling, errors
+        super().__init__(**options)
+        self.integrity_errors = (errors.IntegrityError,)
+        self._interface_error = errors.InterfaceError
+        self._last_used = {}
+        self._sessions = {}    # connection key -> server session id it was last borrowed with
+        self.prepared = prepared
+        self._statements = {}  # connection key -> (server session id, its prepared cursors)
+        if use_pure is not None:
+            config = {**config, "use_pure": use_pure}
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name=pool_name,
+            pool_size=self.pool_size,
+            # Resetting the session on return would deallocate the prepared statements
+            pool_reset_session=not prepared,
+            **config
+        )
+        self.stats.incr("connections_created", self.pool_size)  # the mysql pool opens them all up front
+
+    @staticmethod
+    def _key(conn):
+        # PooledMySQLConnection wraps a long-lived connection object in a
+        # fresh proxy on every borrow; track the underlying one.
+        return id(getattr(conn, "_cnx", conn))
+
+    def _get(self):
+        conn = self._pool.get_connection()
+        last = self._last_used.get(self._key(conn))
+        if last is not None and time.monotonic() - last >= self.health_check_idle:
+            self.stats.incr("health_checks")
+            try:
+                conn.ping(reconnect=False)
+            except self._interface_error:
+                conn.reconnect(attempts=2, delay=0)
+                self.stats.incr("reconnects")
+        # A new session id means the old connection was dropped and a new one
+        # opened, whether by us above or by the mysql pool on its own
+        key = self._key(conn)
+        session = conn.connection_id
+        if self._sessions.get(key, session) != session:
+            self.stats.incr("connections_closed")
+            self.stats.incr("connections_created")
+        self._sessions[key] = session
+        return conn
+
+    def _put(self, conn):
+        self._last_used[self._key(conn)] = time.monotonic()
+        conn.close()  # hands the connection back to the mysql pool
+
+    def _cursor(self, conn, dictionary, buffered):
+        cur = conn.cursor(dictionary=dictionary, buffered=buffered)
+        if not self.prepared:
+            return cur
+        # Prepared statements die with their server session, and the mysql
+        # pool reconnects dropped connections on its own: only reuse them
+        # while the connection still has the session they were prepared on
+        session, statements = self._statements.get(self._key(conn), (None, None))
+        if statements is None or session != conn.connection_id:
+            session, statements = conn.connection_id, {}
+            self._statements[self._key(conn)] = (session, statements)
+        return PreparedCursor(conn, cur, statements, dictionary, self.stats)
+
+    def is_retryable(self, exc):
+        # 1213 = ER_LOCK_DEADLOCK, 1205 = ER_LOCK_WAIT_TIMEOUT
+        return getattr(exc, "errno", None) in (1213, 1205)
+
+
+# =====================
+# Active backend
+# =====================
+_backend = None
+
+
+def configure(backend):
+    """Install the storage backend used by unit_of_work() and stats()."""
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    if _backend is None:
+        raise RuntimeError("db.configure() has not been called")
+    return _backend
+
+
+# =====================
+# Routing (see shards.py)
+# =====================
+# With a sharded backend every unit of work goes to one node: the home node
+# holding the catalog and users, unless the block is routed elsewhere. A
+# single database ignores routes. Independently, read_only() lets a backend
+# with replicas (see replicas.py) serve the block from one of them.
+_route = contextvars.ContextVar("db_route", default=None)
+_read_only = contextvars.ContextVar("db_read_only", default=False)
+
+
+@contextmanager
+def _setting(var, value):
+    token = var.set(value)
+    try:
+        yield
+    finally:
+        var.reset(token)
+
+
+def _routed(route):
+    return _setting(_route, route)
+
+
+def current_route():
+    return _route.get()
+
+
+def for_showtime(showtime_id, user_id=None):
+    """Route to the node with the showtime's bookings; user_id is copied there if missing."""
+    return _routed(("showtime", showtime_id, user_id))
+
+
+def on_node(name):
+    """Route to one node by name (see nodes()); None is the home node."""
+    return _routed(("node", name))
+
+
+def fan_out():
+    """Run each statement on every node; fetches return the rows of all of them."""
+    return _routed(("all",))
+
+
+def read_only():
+    """Mark the block as reads that tolerate a few seconds of replica lag."""
+    return _setting(_read_only, True)
+
+
+def primary():
+    """Undo read_only() for the block: writes, and reads that must see the latest writes."""
+    return _setting(_read_only, False)
+
+
+def replica_ok():
+    return _read_only.get()
+
+
+def nodes():
+    """Node names, home (None) first; [None] for a single database."""
+    return get_backend().nodes()
+
+
+def shard_of(showtime_id):
+    """Name of the node holding a showtime's bookings (None: home or unsharded)."""
+    return get_backend().shard_of(showtime_id)
+
+
+def unit_of_work(dictionary=False, buffered=True):
+    return get_backend().unit_of_work(dictionary=dictionary, buffered=buffered)
+
+
+def transaction(fn, dictionary=False, retries=3, backoff=0.02):
+    """
+    Run fn(cur) in its own unit of work and return its result, retrying the
+    whole transaction with jittered backoff when it loses a deadlock.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with unit_of_work(dictionary=dictionary) as cur:
+                return fn(cur)
+        except DeadlockError:
+            if attempt == retries:
+                raise
+            get_backend().pool.stats.incr("retries")
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def stats():
+    return get_backend().stats()
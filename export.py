@@ -0,0 +1,68 @@
+"""
+Streaming booking export to CSV or JSON Lines.
+
+Rows are read through an unbuffered cursor in fetchmany() batches and
+written straight out, so memory stays flat however many bookings exist.
+"""
+import csv
+import json
+
+import db
+
+# Hot and archived bookings (see archive.py)
+EXPORT_BOOKINGS = """
+    SELECT b.id AS booking_id, u.username, m.title, sc.name AS screen_name,
+           s.start_time, b.total_amount, b.booked_at,
+           (SELECT COUNT(*) FROM booking_seats bs WHERE bs.booking_id = b.id) AS seats
+    FROM bookings b
+    JOIN users u ON b.user_id = u.id
+    JOIN showtimes s ON b.showtime_id = s.id
+    JOIN movies m ON s.movie_id = m.id
+    JOIN screens sc ON s.screen_id = sc.id
+    UNION ALL
+    SELECT b.id, u.username, m.title, sc.name, s.start_time, b.total_amount, b.booked_at,
+           (SELECT COUNT(*) FROM booking_seats_archive bs WHERE bs.booking_id = b.id)
+    FROM bookings_archive b
+    JOIN users u ON b.user_id = u.id
+    JOIN showtimes_archive s ON b.showtime_id = s.id
+    JOIN movies m ON s.movie_id = m.id
+    JOIN screens sc ON s.screen_id = sc.id
+    ORDER BY booking_id
+"""
+
+FORMATS = ("csv", "jsonl")
+
+
+def _rows(batch_size):
+    # buffered=False: the MySQL driver pulls rows off the socket as they are
+    # fetched instead of loading the whole result first. Sharded, every node
+    # is read in turn (ordered by booking id within each); replicas may serve it.
+    with db.fan_out(), db.read_only(), db.unit_of_work(dictionary=True, buffered=False) as cur:
+        cur.execute(EXPORT_BOOKINGS)
+        columns = [d[0] for d in cur.description]
+        yield columns
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            yield from batch
+
+
+def export_bookings(out, fmt="csv", batch_size=1000):
+    """Write every booking to the open text file `out`; returns the row count."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    rows = _rows(batch_size)
+    columns = next(rows)
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+            count += 1
+    return count
@@ -0,0 +1,279 @@
+"""
+Bulk CSV import for movies, screens and showtime schedules.
+
+Files are streamed with csv.DictReader and handled CHUNK_SIZE rows at a
+time: each chunk is validated, then checked for overlaps in one sweep and
+inserted with a single executemany() in one transaction. A bad or
+clashing row is reported with its line number and skipped; it never aborts
+the rest of the load.
+
+Expected columns (a header row is required, extra columns are ignored):
+
+    movies      title, description, duration_min, rating
+    screens     name, total_rows, total_cols
+    showtimes   movie_id or movie (title), screen_id or screen (name),
+                start_time (YYYY-MM-DD HH:MM[:SS]), price
+
+Showtimes that would overlap another show on the same screen -- an existing
+one or an earlier line of the same file, counting the movie's duration and
+the cleaning buffer (see scheduling.py) -- are reported as conflicts.
+
+    python importer.py showtimes week42.csv
+"""
+import csv
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import catalog
+import core
+import db
+import reportcache
+import scheduling
+
+CHUNK_SIZE = 1000
+KINDS = ("movies", "screens", "showtimes")
+
+
+class RowError(ValueError):
+    """A CSV row that cannot be imported."""
+
+
+def _chunks(rows, size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _required(row, name):
+    value = (row.get(name) or "").strip()
+    if not value:
+        raise RowError(f"missing {name}")
+    return value
+
+
+def _positive_int(value, name):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{name} must be a whole number, got {value!r}") from None
+    if number <= 0:
+        raise RowError(f"{name} must be positive")
+    return number
+
+
+def _timestamp(value):
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    raise RowError(f"start_time must be YYYY-MM-DD HH:MM[:SS], got {value!r}")
+
+
+# =====================
+# Row parsers: CSV dict -> tuple of column values
+# =====================
+def _movie(row, refs):
+    duration = (row.get("duration_min") or "").strip()
+    return (_required(row, "title"), (row.get("description") or "").strip() or None,
+            _positive_int(duration, "duration_min") if duration else None,
+            (row.get("rating") or "").strip() or None)
+
+
+def _screen(row, refs):
+    return (_required(row, "name"), _positive_int(_required(row, "total_rows"), "total_rows"),
+            _positive_int(_required(row, "total_cols"), "total_cols"))
+
+
+def _resolve(row, refs, kind, id_col, name_col):
+    ids, by_name = refs[kind]
+    raw_id = (row.get(id_col) or "").strip()
+    if raw_id:
+        ref = _positive_int(raw_id, id_col)
+        if ref not in ids:
+            raise RowError(f"no {kind[:-1]} with id {ref}")
+        return ref
+    name = _required(row, name_col).lower()
+    matches = by_name.get(name, [])
+    if len(matches) != 1:
+        raise RowError(f"{'no' if not matches else 'more than one'} {kind[:-1]} named {row[name_col]!r}"
+                       + (f"; use {id_col}" if matches else ""))
+    return matches[0]
+
+
+def _showtime(row, refs):
+    try:
+        price = Decimal(_required(row, "price"))
+    except InvalidOperation:
+        raise RowError(f"price must be a number, got {row['price']!r}") from None
+    if price < 0:
+        raise RowError("price must not be negative")
+    return (_resolve(row, refs, "movies", "movie_id", "movie"),
+            _resolve(row, refs, "screens", "screen_id", "screen"),
+            _timestamp(_required(row, "start_time")), price)
+
+
+def _references():
+    """Known movie/screen ids and lower-cased names -> ids, for showtime rows."""
+    refs = {}
+    for kind, label, listing in (("movies", "title", catalog.movies),
+                                 ("screens", "name", catalog.screens)):
+        by_name = {}
+        rows = core.run(listing())
+        for r in rows:
+            by_name.setdefault(r[label].lower(), []).append(r["id"])
+        refs[kind] = ({r["id"] for r in rows}, by_name)
+        if kind == "movies":
+            refs["durations"] = {r["id"]: r["duration_min"] for r in rows}
+    return refs
+
+
+INSERTS = {
+    "movies": (_movie, "INSERT INTO movies (title, description, duration_min, rating) "
+                       "VALUES (%s, %s, %s, %s)"),
+    "screens": (_screen, "INSERT INTO screens (name, total_rows, total_cols) VALUES (%s, %s, %s)"),
+    "showtimes": (_showtime, "INSERT INTO showtimes (movie_id, screen_id, start_time, price) "
+                             "VALUES (%s, %s, %s, %s)"),
+}
+
+
+# =====================
+# Showtime clashes
+# =====================
+def _drop_clashes(cur, chunk, refs):
+    """
+    (kept, conflicts): showtimes of chunk free to insert in cur's transaction,
+    and those overlapping an existing show or an earlier line.
+    """
+    durations = refs["durations"]
+    rows = [(line, values[1], values[2]) for line, values in chunk]
+    # Also locks the screens, so no clashing show can be added before we commit
+    clashes = scheduling.check_batch(cur, rows, {line: durations[values[0]]
+                                                 for line, values in chunk})
+    kept, conflicts = [], []
+    for line, values in chunk:
+        other = clashes.get(line)
+        if other is None:
+            kept.append((line, values))
+        elif isinstance(other, int):
+            conflicts.append((line, f"screen {values[1]} at {values[2]} overlaps line {other}"))
+        else:
+            conflicts.append((line, f"screen {values[1]} at {values[2]} overlaps {other}"))
+    return kept, conflicts
+
+
+# =====================
+# Import
+# =====================
+def _changed(cur, kind, rows):
+    """Record the edit for the caches, in the inserting transaction."""
+    catalog.bump(cur)
+    if kind == "showtimes":
+        reportcache.touch(cur, [values[2] for values in rows])
+
+
+def _insert(kind, chunk, result, refs=None):
+    sql = INSERTS[kind][1]
+
+    def write(cur, rows):
+        """Insert rows (after the clash check, for showtimes); returns (inserted, conflicts)."""
+        conflicts = []
+        if kind == "showtimes":
+            rows, conflicts = _drop_clashes(cur, rows, refs)
+        if rows:
+            cur.executemany(sql, [values for _, values in rows])
+        return rows, conflicts
+
+    def write_chunk(cur):
+        rows, conflicts = write(cur, chunk)
+        if rows and cur.rowcount:
+            _changed(cur, kind, [values for _, values in rows])
+        return rows, conflicts
+
+    try:
+        rows, conflicts = db.transaction(write_chunk)
+        result["inserted"] += len(rows)
+        result["conflicts"] += conflicts
+        return
+    except db.IntegrityError:
+        pass
+    # A key vanished (or a duplicate slipped in): find the offending rows one
+    # at a time and keep the rest
+    inserted = []
+    for line, values in chunk:
+        try:
+            rows, conflicts = db.transaction(lambda cur: write(cur, [(line, values)]))
+        except db.IntegrityError as e:
+            result["conflicts"].append((line, f"rejected by the database: {e}"))
+            continue
+        result["inserted"] += len(rows)
+        result["conflicts"] += conflicts
+        inserted += [values for _, values in rows]
+    # Nothing inserted, nothing for the caches (and shard catalog copies) to reload
+    if inserted:
+        with db.unit_of_work() as cur:
+            _changed(cur, kind, inserted)
+
+
+def import_csv(kind, f, chunk_size=CHUNK_SIZE):
+    """
+    Import rows of `kind` from the open text file f. Returns
+    {"rows", "inserted", "conflicts": [(line, reason)], "errors": [(line, reason)], "elapsed_s"}.
+    """
+    if kind not in INSERTS:
+        raise ValueError(f"unknown import kind: {kind} (expected one of {', '.join(KINDS)})")
+    parse = INSERTS[kind][0]
+    started = time.perf_counter()
+    result = {"kind": kind, "rows": 0, "inserted": 0, "conflicts": [], "errors": []}
+    refs = _references() if kind == "showtimes" else None
+
+    reader = csv.DictReader(f)
+    numbered = ((reader.line_num, row) for row in reader)
+    for rows in _chunks(numbered, chunk_size):
+        chunk = []
+        for line, row in rows:
+            result["rows"] += 1
+            try:
+                chunk.append((line, parse(row, refs)))
+            except RowError as e:
+                result["errors"].append((line, str(e)))
+        if chunk:
+            _insert(kind, chunk, result, refs)
+
+    result["elapsed_s"] = time.perf_counter() - started
+    return result
+
+
+def import_file(kind, path, chunk_size=CHUNK_SIZE):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return import_csv(kind, f, chunk_size)
+
+
+def print_report(result, limit=20):
+    print(f"✅ Imported {result['inserted']} of {result['rows']} {result['kind']} rows "
+          f"in {result['elapsed_s']:.2f}s")
+    for label, items in (("⚠️ Conflicts", result["conflicts"]), ("❌ Errors", result["errors"])):
+        if not items:
+            continue
+        print(f"{label}: {len(items)}")
+        for line, reason in sorted(items)[:limit]:
+            print(f"    line {line}: {reason}")
+        if len(items) > limit:
+            print(f"    ... and {len(items) - limit} more")
+
+
+if __name__ == "__main__":
+    import main
+
+    if len(sys.argv) != 3 or sys.argv[1] not in KINDS:
+        sys.exit(f"usage: python importer.py {{{'|'.join(KINDS)}}} FILE.csv")
+    db.configure(main.make_backend())
+    main.init_db()
+    print_report(import_file(sys.argv[1], sys.argv[2]))
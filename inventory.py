@@ -0,0 +1,168 @@
+"""
+Per-showtime seat inventory kept as a bitmap.
+
+Seat (row r, col c) of a screen with `cols` columns maps to bit r * cols + (c - 1)
+of a Python int, so an availability check is one shift-and-mask, occupancy
+is a popcount and a whole row renders from a single binary string. Inventories
+are cached per showtime in an LRU and dropped again whenever a booking for
+that showtime commits. Bookings made by other processes are not seen that
+way, so a cached inventory is also only served for MAX_AGE seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import db
+import queries
+
+_TO_MAP = str.maketrans("01", "OX")
+MAX_AGE = 2.0  # seconds a cached inventory may miss other processes' bookings
+
+
+def row_label(r):
+    """0 → A, 1 → B, ... (same labelling as the seat map)."""
+    return chr(65 + r)
+
+
+class SeatInventory:
+    def __init__(self, showtime_id, rows, cols, bits=0):
+        self.showtime_id = showtime_id
+        self.rows = rows
+        self.cols = cols
+        self.bits = bits
+        self._row_mask = (1 << cols) - 1
+
+    @property
+    def capacity(self):
+        return self.rows * self.cols
+
+    def is_valid(self, label, col):
+        return (len(label) == 1 and 0 <= ord(label) - 65 < self.rows
+                and 1 <= col <= self.cols)
+
+    def index(self, label, col):
+        if not self.is_valid(label, col):
+            raise ValueError(f"seat {label}{col} is not on this screen")
+        return (ord(label) - 65) * self.cols + (col - 1)
+
+    def is_booked(self, label, col):
+        return (self.bits >> self.index(label, col)) & 1 == 1
+
+    def mark(self, seats):
+        for label, col in seats:
+            self.bits |= 1 << self.index(label, col)
+
+    def booked_count(self):
+        return self.bits.bit_count()
+
+    def available_count(self):
+        return self.capacity - self.booked_count()
+
+    def occupancy(self):
+        return self.booked_count() / self.capacity * 100 if self.capacity else 0.0
+
+    def row_bits(self, r):
+        return (self.bits >> (r * self.cols)) & self._row_mask
+
+    def render(self):
+        """Seat map lines, e.g. 'A: O O X O'."""
+        lines = []
+        for r in range(self.rows):
+            # format() puts col 1 (the lowest bit) last, so reverse the string
+            cells = format(self.row_bits(r), f"0{self.cols}b")[::-1].translate(_TO_MAP)
+            lines.append(f"{row_label(r)}: {' '.join(cells)}")
+        return lines
+
+
+class InventoryCache:
+    """A small thread-safe LRU of SeatInventory objects keyed by showtime id."""
+
+    def __init__(self, maxsize=256, max_age=MAX_AGE):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()    # showtime_id -> (inventory, stored at)
+        self._lock = threading.Lock()
+
+    def peek(self, showtime_id):
+        """The cached inventory or None, counting the hit or miss."""
+        with self._lock:
+            inv, stored = self._items.get(showtime_id, (None, 0.0))
+            if inv is None or time.monotonic() - stored > self.max_age:
+                self.misses += 1
+                return None
+            self._items.move_to_end(showtime_id)
+            self.hits += 1
+            return inv
+
+    def put(self, inv):
+        with self._lock:
+            self._items[inv.showtime_id] = (inv, time.monotonic())
+            self._items.move_to_end(inv.showtime_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get(self, showtime_id, loader):
+        inv = self.peek(showtime_id)
+        if inv is None:
+            inv = loader(showtime_id)
+            if inv is not None:
+                self.put(inv)
+        return inv
+
+    def invalidate(self, showtime_id):
+        with self._lock:
+            self._items.pop(showtime_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def load_inventory(showtime_id):
+    """Build a SeatInventory from screens + booking_seats, or None if no such showtime."""
+    # Plain tuple rows: a big screen's booked seats are one row each
+    with db.for_showtime(showtime_id), db.unit_of_work() as cur:
+        cur.execute(queries.SHOWTIME_SCREEN, (showtime_id,))
+        screen = cur.fetchone()
+        if not screen:
+            return None
+
+        cur.execute(queries.BOOKED_SEATS, (showtime_id,))
+        booked = cur.fetchall()
+
+    inv = SeatInventory(showtime_id, *screen)
+    inv.mark(seat for seat in booked if inv.is_valid(*seat))
+    return inv
+
+
+def from_rows(showtime_id, screen, booked):
+    """SeatInventory from a SHOWTIME_SCREEN row and BOOKED_SEATS rows."""
+    inv = SeatInventory(showtime_id, screen["total_rows"], screen["total_cols"])
+    inv.mark((b["seat_row"], b["seat_col"]) for b in booked
+             if inv.is_valid(b["seat_row"], b["seat_col"]))
+    return inv
+
+
+_cache = InventoryCache()
+
+
+def get(showtime_id):
+    return _cache.get(showtime_id, load_inventory)
+
+
+def cached(showtime_id):
+    return _cache.peek(showtime_id)
+
+
+def store(inv):
+    _cache.put(inv)
+
+
+def invalidate(showtime_id):
+    _cache.invalidate(showtime_id)
+
+
+def clear():
+    _cache.clear()
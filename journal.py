@@ -0,0 +1,430 @@
+"""
+Append-only booking journal with group-commit flushing.
+
+Normally every confirmed booking is its own database transaction (booking,
+seats, hold cleanup, rollups) and its own COMMIT, so a big on-sale runs at
+the database's fsync rate. With the journal started, reservations.confirm()
+instead
+
+    1. takes the booking id (reservations.IdBlocks) and claims the hold for
+       it if the hold is still live and unclaimed, extending it by
+       JOURNAL_HOLD,
+    2. appends the booking as one JSON line to the journal file and fsyncs it
+       -- concurrent confirmations share one fsync --
+    3. returns the booking, and the customer is done.
+
+A background writer drains confirmed bookings in batches of up to
+BATCH_SIZE and applies each batch in one transaction (one per node when
+sharded, see shards.py): multi-row INSERTs, one DELETE of the holds, one
+rollup update per showtime. Once everything journaled has been applied the
+file is truncated.
+
+The seats stay protected while a booking waits in the journal: its seat
+holds are extended to JOURNAL_HOLD in the transaction that claims them, and
+only deleted by the transaction that writes the booking. A claimed hold
+(seat_holds.booking_id, migration 10) cannot be confirmed again, by this
+process or any other. Replay extends whatever holds of the pending bookings
+are still there.
+
+One process owns a journal file at a time: start() takes an exclusive lock
+on <journal>.lock and raises JournalBusy if another process holds it; that
+process then confirms bookings directly.
+
+On start() any bookings left in the file by a crash are replayed before
+new ones. Application is idempotent by booking id -- a booking already in
+the database is skipped -- so replaying a batch that had committed just
+before the crash is harmless. A booking the database rejects (its hold
+expired while the writer was failing for longer than JOURNAL_HOLD, and the
+seat was sold again) is written to <journal>.rejected, logged and counted.
+
+stop() waits up to STOP_TIMEOUT seconds for the writer to drain; whatever
+it could not apply by then (the database is down) stays in the file for the
+next start().
+
+    journal.start("bookings.journal")   # or set CINEMA_BOOKING_JOURNAL for main.py/service.py
+    ...
+    journal.stop()                      # drains the queue; also run at exit
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import db
+import inventory
+import reservations
+import rollups
+import seatfeed
+
+BATCH_SIZE = 500        # bookings per database transaction
+JOURNAL_HOLD = 3600     # seconds a journaled booking's holds are extended to
+RETRY_DELAY = 1.0       # seconds between attempts while the database is unavailable
+STOP_TIMEOUT = 10.0     # seconds stop() waits for the writer before leaving the rest for replay
+
+log = logging.getLogger(__name__)
+
+CLAIM_HOLD = db.prepared("""
+    UPDATE seat_holds SET expires_at = %s, booking_id = %s
+    WHERE hold_token = %s AND expires_at > %s AND booking_id IS NULL
+""")
+
+CLAIMED_HOLD = db.prepared("""
+    SELECT h.user_id, h.showtime_id, h.seat_row, h.seat_col,
+           s.price, s.movie_id, s.start_time
+    FROM seat_holds h
+    JOIN showtimes s ON h.showtime_id = s.id
+    WHERE h.hold_token = %s AND h.booking_id = %s
+""")
+
+
+class JournalBusy(Exception):
+    """Another process owns this journal file."""
+
+
+class _Abandoned(Exception):
+    """stop() gave up waiting for the database."""
+
+
+def _lock(f):
+    """Exclusive, non-blocking lock on an open file; raises OSError if taken."""
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _stamp(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Journal:
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.appended = 0
+        self.applied = 0        # written to the database by the writer
+        self.skipped = 0        # already in the database (replay)
+        self.rejected = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self._synced = 0        # appended records known to be on disk
+        self._done = 0          # applied + skipped + rejected
+        self._queue = queue.Queue()
+        self._append_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._abandon = threading.Event()
+        self._lock_file = None
+        self._file = None
+        self._thread = None
+
+    # ---------------------
+    # File
+    # ---------------------
+    def _recover(self):
+        """Records left in the file, dropping a torn last line."""
+        records = []
+        good = 0
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    good += len(line)
+        except FileNotFoundError:
+            return []
+        with open(self.path, "r+b") as f:
+            f.truncate(good)
+        return records
+
+    def _append(self, record):
+        """Write one record and return once it is on disk."""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self._append_lock:
+            self._file.write(line)
+            self._file.flush()
+            self.appended += 1
+            seq = self.appended
+        # Group commit: whoever gets here first fsyncs for everybody written so far
+        with self._sync_lock:
+            if self._synced < seq:
+                with self._append_lock:
+                    target = self.appended
+                os.fsync(self._file.fileno())
+                self.fsyncs += 1
+                self._synced = target
+        self._queue.put(record)
+
+    def _truncate_if_drained(self):
+        with self._append_lock:
+            if self._done == self.appended and self._file.tell():
+                self._file.truncate(0)
+                self._file.seek(0)
+                os.fsync(self._file.fileno())
+
+    # ---------------------
+    # Confirming
+    # ---------------------
+    def confirm(self, token):
+        """Journal the booking of a live hold; returns the booking dict."""
+        now = datetime.now().replace(microsecond=0)
+        booking_id = reservations.next_booking_id()
+        with reservations.for_hold(token), db.unit_of_work(dictionary=True) as cur:
+            # The seats must outlive the writer's stalls, and nobody may confirm them again
+            cur.execute(CLAIM_HOLD, (_stamp(now + timedelta(seconds=JOURNAL_HOLD)), booking_id,
+                                     token, _stamp(now)))
+            cur.execute(CLAIMED_HOLD, (token, booking_id))
+            held = cur.fetchall()
+        if not held:
+            raise reservations.HoldExpired(token)
+
+        first = held[0]
+        seats = [(h["seat_row"], h["seat_col"]) for h in held]
+        total_amount = first["price"] * len(seats)
+        record = {
+            "booking_id": booking_id,
+            "token": token,
+            "user_id": first["user_id"],
+            "showtime_id": first["showtime_id"],
+            "movie_id": first["movie_id"],
+            "start_time": str(first["start_time"]),
+            "seats": seats,
+            "total_amount": str(total_amount),
+            "booked_at": _stamp(now),
+        }
+        self._append(record)
+        return {"booking_id": record["booking_id"], "showtime_id": record["showtime_id"],
+                "seats": seats, "total_amount": total_amount}
+
+    # ---------------------
+    # Applying
+    # ---------------------
+    def _write(self, cur, batch):
+        """Insert the bookings of batch not yet in the database; returns them."""
+        ids = [r["booking_id"] for r in batch]
+        marks = ", ".join(["%s"] * len(ids))
+        cur.execute(f"SELECT id FROM bookings WHERE id IN ({marks}) "
+                    f"UNION ALL SELECT id FROM bookings_archive WHERE id IN ({marks})", ids * 2)
+        existing = {row[0] for row in cur.fetchall()}
+        new = [r for r in batch if r["booking_id"] not in existing]
+        if not new:
+            return new
+
+        cur.executemany("INSERT INTO bookings (id, user_id, showtime_id, total_amount, booked_at) "
+                        "VALUES (%s, %s, %s, %s, %s)",
+                        [(r["booking_id"], r["user_id"], r["showtime_id"],
+                          Decimal(r["total_amount"]), r["booked_at"]) for r in new])
+        cur.executemany("INSERT INTO booking_seats (booking_id, showtime_id, seat_row, seat_col) "
+                        "VALUES (%s, %s, %s, %s)",
+                        [(r["booking_id"], r["showtime_id"], row, col)
+                         for r in new for row, col in r["seats"]])
+        tokens = [r["token"] for r in new]
+        cur.execute(f"DELETE FROM seat_holds WHERE hold_token IN ({', '.join(['%s'] * len(tokens))})",
+                    tokens)
+
+        by_show = {}
+        for r in new:
+            show = by_show.setdefault(r["showtime_id"], [r, 0, 0, Decimal(0)])
+            show[1] += 1
+            show[2] += len(r["seats"])
+            show[3] += Decimal(r["total_amount"])
+        for showtime_id, (r, count, seats, amount) in by_show.items():
+            rollups.record_booking(cur, showtime_id, r["movie_id"], r["start_time"],
+                                   seats, amount, bookings=count)
+        return new
+
+    def _reject(self, record, reason):
+        with open(f"{self.path}.rejected", "a", encoding="utf-8") as out:
+            out.write(json.dumps({**record, "reason": reason}) + "\n")
+        log.warning("journaled booking #%s rejected by the database: %s", record["booking_id"], reason)
+
+    def _wait_retry(self):
+        """Sleep before the next attempt; raises _Abandoned once stop() gives up."""
+        if self._abandon.wait(RETRY_DELAY):
+            raise _Abandoned()
+
+    def _by_node(self, batch):
+        """The batch split per node holding its showtimes (one group unless sharded)."""
+        while True:
+            try:
+                groups = {}
+                for r in batch:
+                    groups.setdefault(db.shard_of(r["showtime_id"]), []).append(r)
+                return groups
+            except Exception as e:  # database unavailable, or a screen being moved
+                log.warning("booking journal cannot route its batch yet (%s); retrying", e)
+                self._wait_retry()
+
+    def _commit(self, batch):
+        """Write the batch on the node routed to; returns (written, rejected)."""
+        while True:
+            try:
+                return db.transaction(lambda cur: self._write(cur, batch)), []
+            except db.IntegrityError:
+                # One bad booking must not hold up the rest: apply them one by one
+                written, rejected = [], []
+                for record in batch:
+                    try:
+                        written += db.transaction(lambda cur: self._write(cur, [record]))
+                    except db.IntegrityError as e:
+                        self._reject(record, str(e))
+                        rejected.append(record)
+                return written, rejected
+            except Exception as e:  # database unavailable: the batch is safe on disk
+                log.warning("booking journal cannot reach the database (%s); retrying", e)
+                self._wait_retry()
+
+    def _apply(self, batch):
+        written, rejected = [], []
+        for node, group in self._by_node(batch).items():
+            with db.on_node(node):
+                done, failed = self._commit(group)
+            written += done
+            rejected += failed
+
+        for showtime_id in {r["showtime_id"] for r in batch}:
+            inventory.invalidate(showtime_id)
+        booked = {}
+        for r in written:
+            booked.setdefault(r["showtime_id"], []).extend(r["seats"])
+        for showtime_id, seats in booked.items():
+            seatfeed.publish(showtime_id, seats)
+        with self._append_lock:
+            self.batches += 1
+            self.applied += len(written)
+            self.rejected += len(rejected)
+            self.skipped += len(batch) - len(written) - len(rejected)
+            self._done += len(batch)
+        self._truncate_if_drained()
+
+    def _run(self):
+        stopping = False
+        while not stopping and not self._abandon.is_set():
+            record = self._queue.get()
+            batch = []
+            # Take everything queued meanwhile: the busier, the bigger the batch
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if record is None:
+                stopping = True
+            if batch:
+                try:
+                    self._apply(batch)
+                except _Abandoned:
+                    return  # left in the file for the next start()
+
+    # ---------------------
+    # Lifecycle
+    # ---------------------
+    def _extend_pending(self, pending):
+        """Extend the holds replayed bookings still have (their seats were never resold)."""
+        until = _stamp(datetime.now() + timedelta(seconds=JOURNAL_HOLD))
+        by_show = {}
+        for r in pending:
+            by_show.setdefault(r["showtime_id"], []).append(r["token"])
+        for showtime_id, tokens in by_show.items():
+            try:
+                with db.for_showtime(showtime_id), db.unit_of_work() as cur:
+                    cur.execute(f"UPDATE seat_holds SET expires_at = %s "
+                                f"WHERE hold_token IN ({', '.join(['%s'] * len(tokens))})",
+                                [until, *tokens])
+            except Exception as e:  # the writer retries anyway; the holds just stay as they were
+                log.warning("booking journal could not extend replayed holds (%s)", e)
+
+    def start(self):
+        self._lock_file = open(f"{self.path}.lock", "a+b")
+        try:
+            _lock(self._lock_file)
+        except OSError:
+            self._lock_file.close()
+            raise JournalBusy(f"{self.path} is in use by another process") from None
+        pending = self._recover()
+        self._extend_pending(pending)
+        self._file = open(self.path, "ab")
+        self.appended = self._synced = len(pending)
+        for record in pending:
+            self._queue.put(record)
+        self._thread = threading.Thread(target=self._run, name="booking-journal", daemon=True)
+        self._thread.start()
+        return len(pending)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Apply everything journaled so far (waiting up to timeout seconds for
+        the database) and close the file; returns the bookings left in it.
+        """
+        if self._thread is None:
+            return 0
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._abandon.set()
+            self._thread.join()
+        self._thread = None
+        self._file.close()
+        self._lock_file.close()  # releases the lock
+        left = self.appended - self._done
+        if left:
+            log.warning("%d journaled bookings left in %s for the next start", left, self.path)
+        return left
+
+    def snapshot(self):
+        with self._append_lock:
+            return {
+                "appended": self.appended,
+                "applied": self.applied,
+                "skipped": self.skipped,
+                "rejected": self.rejected,
+                "pending": self.appended - self._done,
+                "batches": self.batches,
+                "avg_batch": self._done / self.batches if self.batches else 0.0,
+                "fsyncs": self.fsyncs,
+            }
+
+
+_journal = None
+
+
+def start(path, batch_size=BATCH_SIZE):
+    """Replay what the journal at path still holds and route confirmations through it."""
+    global _journal
+    stop()
+    journal = Journal(path, batch_size)
+    replayed = journal.start()  # raises JournalBusy
+    _journal = reservations._journal = journal
+    if replayed:
+        print(f"🔁 Replaying {replayed} journaled bookings from {path}")
+    return _journal
+
+
+def stop():
+    global _journal
+    if _journal is None:
+        return
+    reservations._journal = None
+    _journal.stop()
+    _journal = None
+
+
+def stats():
+    return _journal.snapshot() if _journal is not None else None
+
+
+atexit.register(stop)
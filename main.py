@@ -1,8 +1,27 @@
-import mysql.connector
-import bcrypt
 import sys
 import os
-from datetime import datetime
+import json
+from datetime import date
+
+import allocator
+import archive
+import auth
+import backends
+import catalog
+import core
+import db
+import export
+import importer
+import inventory
+import journal
+import queries
+import replicas
+import reportcache
+import reservations
+import rollups
+import scheduling
+import shards
+import tracing
 
 # =====================
 # Database Config
@@ -15,115 +34,127 @@ DB_CONFIG = {
     "database": "cinema_cli"
 }
 
+# Connection pool settings (see db.POOL_DEFAULTS)
+POOL_CONFIG = {
+    "pool_size": 5,
+    "borrow_timeout": 5.0,
+    "return_timeout": 30.0,
+    "health_check_idle": 30.0,
+}
+
+# MySQL driver mode (see db.ConnectionPool): use_pure=False for the C extension,
+# True for pure Python, None for the driver's default; prepared=True runs the
+# per-booking statements registered with db.prepared() as prepared statements
+MYSQL_DRIVER = {
+    "use_pure": {"1": True, "0": False}.get(os.environ.get("CINEMA_MYSQL_PURE")),
+    "prepared": os.environ.get("CINEMA_MYSQL_PREPARED") == "1",
+}
+
+# Storage backend: "mysql" uses DB_CONFIG, "sqlite" an embedded file at SQLITE_PATH
+DB_BACKEND = os.environ.get("CINEMA_DB_BACKEND", "mysql")
+SQLITE_PATH = os.environ.get("CINEMA_SQLITE_PATH", "cinema.db")
+
+def _pairs(spec):
+    """[(name, value), ...] from "name=value,name=value"."""
+    return [tuple(item.split("=", 1)) for item in spec.split(",") if "=" in item]
+
+# Booking shards (see shards.py): node name -> database holding the bookings of
+# the screens mapped to it. The database above stays home to the catalog and
+# users. MySQL nodes override DB_CONFIG keys, e.g. {"east": {"host": "db-east"}};
+# SQLite nodes come from CINEMA_SQLITE_SHARDS="east=east.db,west=west.db".
+SHARDS = {}
+SQLITE_SHARDS = dict(_pairs(os.environ.get("CINEMA_SQLITE_SHARDS", "")))
+
+# Read replicas (see replicas.py) per node ("home" = the database above): reports
+# and the admin listings read from them. MySQL: {"home": [{"host": "db-replica-1"}]};
+# SQLite: CINEMA_SQLITE_REPLICAS="home=replica1.db,home=replica2.db,east=east-r.db".
+REPLICAS = {}
+SQLITE_REPLICAS = _pairs(os.environ.get("CINEMA_SQLITE_REPLICAS", ""))
+MAX_REPLICA_LAG = float(os.environ.get("CINEMA_MAX_REPLICA_LAG", replicas.MAX_LAG))
+
+# Booking journal (see journal.py); empty = every booking commits on its own
+JOURNAL_PATH = os.environ.get("CINEMA_BOOKING_JOURNAL", "")
+
+# Scripted commands skip the schema check while this file records the latest
+# migration for the configured databases (see ensure_schema())
+SCHEMA_STAMP = os.environ.get("CINEMA_SCHEMA_STAMP", ".cinema_schema")
+
+# SQL tracing (also switched on by running with --trace)
+TRACE_CONFIG = {
+    "enabled": os.environ.get("CINEMA_TRACE") == "1",
+    "slow_ms": 100.0,
+    "slow_log": "slow_queries.log",
+}
+
 # =====================
 # Database Initialization
 # =====================
-def get_connection(dbname=True):
-    cfg = DB_CONFIG.copy()
-    if not dbname:
-        cfg.pop("database", None)
-    return mysql.connector.connect(**cfg)
-
-def init_db():
-    # First connect without database to create it
-    conn = get_connection(dbname=False)
-    cur = conn.cursor()
-    cur.execute("CREATE DATABASE IF NOT EXISTS cinema_cli CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;")
-    conn.commit()
-    cur.close()
-    conn.close()
-
-    # Now connect with the DB and create tables
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # Users
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(100) UNIQUE NOT NULL,
-            password_hash VARBINARY(60) NOT NULL,
-            role ENUM('user','admin','staff') DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        ) ENGINE=InnoDB;
-    """)
-
-    # Movies
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS movies (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            title VARCHAR(255) NOT NULL,
-            description TEXT,
-            duration_min INT,
-            rating VARCHAR(20),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        ) ENGINE=InnoDB;
-    """)
-
-    # Screens
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS screens (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            total_rows INT NOT NULL,
-            total_cols INT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        ) ENGINE=InnoDB;
-    """)
-
-    # Showtimes
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS showtimes (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            movie_id INT NOT NULL,
-            screen_id INT NOT NULL,
-            start_time DATETIME NOT NULL,
-            price DECIMAL(10,2) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(screen_id, start_time),
-            FOREIGN KEY(movie_id) REFERENCES movies(id) ON DELETE CASCADE,
-            FOREIGN KEY(screen_id) REFERENCES screens(id) ON DELETE CASCADE
-        ) ENGINE=InnoDB;
-    """)
-
-    # Bookings (transaction-level)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            showtime_id INT NOT NULL,
-            total_amount DECIMAL(10,2) NOT NULL,
-            booked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY(showtime_id) REFERENCES showtimes(id) ON DELETE CASCADE
-        ) ENGINE=InnoDB;
-    """)
-
-    # Booking Seats (individual seats inside a booking)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS booking_seats (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            booking_id INT NOT NULL,
-            seat_row VARCHAR(5) NOT NULL,
-            seat_col INT NOT NULL,
-            UNIQUE(booking_id, seat_row, seat_col),
-            FOREIGN KEY(booking_id) REFERENCES bookings(id) ON DELETE CASCADE
-        ) ENGINE=InnoDB;
-    """)
-
-    conn.commit()
-    cur.close()
-    conn.close()
+def _database(name, target):
+    """Backend for one node: an SQLite path or MySQL DB_CONFIG overrides, plus its replicas."""
+    if DB_BACKEND == "sqlite":
+        primary = backends.SQLiteBackend(target, **POOL_CONFIG)
+        copies = {path: backends.SQLiteBackend(path, **POOL_CONFIG)
+                  for node, path in SQLITE_REPLICAS if node == name}
+    else:
+        primary = backends.MySQLBackend({**DB_CONFIG, **target}, **POOL_CONFIG, **MYSQL_DRIVER)
+        copies = {config.get("host", f"replica{i}"): backends.MySQLBackend({**DB_CONFIG, **target, **config},
+                                                                          **POOL_CONFIG, **MYSQL_DRIVER)
+                  for i, config in enumerate(REPLICAS.get(name, []), 1)}
+    return replicas.ReplicatedBackend(primary, copies, MAX_REPLICA_LAG) if copies else primary
+
+def make_backend():
+    if DB_BACKEND == "sqlite":
+        home = _database("home", SQLITE_PATH)
+        nodes = {name: _database(name, path) for name, path in SQLITE_SHARDS.items()}
+    else:
+        home = _database("home", {})
+        nodes = {name: _database(name, config) for name, config in SHARDS.items()}
+    return shards.ShardedBackend(home, nodes) if nodes else home
+
+def init_db(out=None):
+    # Creates the database (where the backend needs one) and applies pending migrations
+    import migrations
+
+    applied = db.get_backend().init_schema()
+    if applied:
+        print(f"🛠 Applied schema migrations: {', '.join(map(str, applied))}", file=out)
+    _write_schema_stamp(migrations.latest_version())
+
+def _schema_key():
+    """Identifies the configured databases, so a stamp never vouches for other ones."""
+    if DB_BACKEND == "sqlite":
+        nodes = {name: os.path.abspath(path) for name, path in [("home", SQLITE_PATH), *SQLITE_SHARDS.items()]}
+    else:
+        nodes = {name: {**DB_CONFIG, **config, "password": None}
+                 for name, config in [("home", {}), *SHARDS.items()]}
+    return json.dumps([DB_BACKEND, nodes], sort_keys=True)
+
+def _write_schema_stamp(version):
+    try:
+        with open(SCHEMA_STAMP, "w", encoding="utf-8") as f:
+            json.dump({"databases": _schema_key(), "version": version}, f)
+    except OSError:
+        pass  # only costs the next script a schema check
+
+def ensure_schema(out=None):
+    """init_db(), unless the stamp says these databases are already at the latest migration."""
+    import migrations
+
+    try:
+        with open(SCHEMA_STAMP, encoding="utf-8") as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        stamp = None
+    # A deleted SQLite file would otherwise be recreated empty and never migrated
+    files = [SQLITE_PATH, *SQLITE_SHARDS.values()] if DB_BACKEND == "sqlite" else []
+    if (stamp == {"databases": _schema_key(), "version": migrations.latest_version()}
+            and all(os.path.exists(path) for path in files)):
+        return
+    init_db(out)
 
 # =====================
 # Authentication
 # =====================
-def hash_password(password):
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-
-def verify_password(password, hashed):
-    return bcrypt.checkpw(password.encode(), hashed)
-
 def register_user():
     print("\n=== User Registration ===")
     username = input("Enter username: ").strip()
@@ -135,40 +166,23 @@ def register_user():
         print("❌ Invalid role. Defaulting to 'user'.")
         role = "user"
 
-    conn = get_connection()
-    cur = conn.cursor()
-
     try:
-        password_hash = hash_password(password)
-        cur.execute(
-            "INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s)",
-            (username, password_hash, role),
-        )
-        conn.commit()
+        auth.register(username, password, role)
         print(f"✅ User '{username}' registered successfully as '{role}'.")
-    except mysql.connector.IntegrityError:
+    except db.IntegrityError:
         print("❌ Username already exists.")
-    finally:
-        cur.close()
-        conn.close()
 
 
 
 def login_user():
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-
     print("\n=== User Login ===")
     username = input("Enter username: ").strip()
     password = input("Enter password: ").strip()
 
-    cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-    user = cur.fetchone()
-
-    cur.close()
-    conn.close()
-
-    if user and verify_password(password, user["password_hash"]):
+    # bcrypt runs in auth's process pool; a stale cost is upgraded here
+    session = auth.login(username, password)
+    if session:
+        user = session["user"]
         print(f"✅ Login successful! Welcome {user['username']} ({user['role']})")
         return user
     else:
@@ -178,105 +192,169 @@ def login_user():
 # =====================
 # Admin Functions
 # =====================
+def show_paged(template, filters, print_row, id_key):
+    """Print a keyset-paged listing one page at a time; returns the rows shown."""
+    after = None
+    shown = 0
+    while True:
+        with db.fan_out():
+            rows = core.run(core.bookings_page(template, filters, after))
+        for r in rows:
+            print_row(r)
+        shown += len(rows)
+        if len(rows) < queries.PAGE_SIZE:
+            return shown
+        if input("Press Enter for more, or q to go back: ").strip().lower() == "q":
+            return shown
+        after = (rows[-1]["start_time"], rows[-1][id_key])
+
+def print_showtime(s):
+    left = f"{s['remaining']} seats left" if s['remaining'] > 0 else "SOLD OUT"
+    print(f"{s['id']}. {s['title']} @ {s['screen_name']} on {s['start_time']} (₹{s['price']}) - {left}")
+
+def ask_showtime_filters():
+    """Optional browse filters typed by the user; Enter skips each one."""
+    filters = {}
+    title = input("Movie title contains (Enter for any): ").strip()
+    if title:
+        filters["title"] = title
+    day_from = input("From date (YYYY-MM-DD, Enter for today): ").strip()
+    if day_from:
+        filters["date_from"] = day_from
+    day_to = input("To date (YYYY-MM-DD, Enter for any): ").strip()
+    if day_to:
+        filters["date_to"] = day_to
+    max_price = input("Max ticket price (Enter for any): ").strip()
+    if max_price:
+        filters["max_price"] = float(max_price)
+    filters["hide_sold_out"] = input("Hide sold-out shows? (y/N): ").strip().lower() == "y"
+    return filters
+
+def browse_showtimes(filters):
+    """Print upcoming showtimes one page at a time; returns the number shown."""
+    after = None
+    shown = 0
+    while True:
+        # Seat counts may lag a replica by a few seconds; the seat map is exact
+        with db.fan_out(), db.read_only():
+            rows = core.run(core.browse_showtimes(after=after, **filters))
+        for s in rows:
+            print_showtime(s)
+        shown += len(rows)
+        if len(rows) < queries.PAGE_SIZE:
+            return shown
+        if input("Press Enter for more, or q to stop: ").strip().lower() == "q":
+            return shown
+        after = (rows[-1]["start_time"], rows[-1]["id"])
+
 def view_all_bookings():
     print("\n📖 All Bookings:")
 
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
+    def print_row(b):
+        print(f"Booking ID: {b['id']} | User: {b['username']} | Movie: {b['title']} | Showtime: {b['start_time']} | Amount: ₹{b['total_amount']:.2f}")
 
-    cur.execute("""
-        SELECT b.id, u.username, m.title, s.start_time, b.total_amount
-        FROM bookings b
-        JOIN users u ON b.user_id = u.id
-        JOIN showtimes s ON b.showtime_id = s.id
-        JOIN movies m ON s.movie_id = m.id
-        ORDER BY s.start_time DESC
-    """)
-    bookings = cur.fetchall()
-
-    if not bookings:
+    # The whole history: fine to read from a replica
+    with db.read_only():
+        found = show_paged(queries.ALL_BOOKINGS, [], print_row, "id")
+    if not found:
         print("❌ No bookings found.")
+
+def export_bookings():
+    fmt = input("Export format (csv/jsonl): ").strip().lower() or "csv"
+    if fmt not in export.FORMATS:
+        print("❌ Invalid format.")
+        return
+    path = input(f"Output file (default bookings.{fmt}): ").strip() or f"bookings.{fmt}"
+    with open(path, "w", newline="", encoding="utf-8") as out:
+        count = export.export_bookings(out, fmt)
+    print(f"✅ Exported {count} bookings to {path}")
+
+def bulk_import():
+    kind = input(f"Import what? ({'/'.join(importer.KINDS)}): ").strip().lower()
+    if kind not in importer.KINDS:
+        print("❌ Invalid choice.")
+        return
+    path = input("CSV file: ").strip()
+    try:
+        result = importer.import_file(kind, path)
+    except OSError as e:
+        print(f"❌ Cannot read {path}: {e}")
+        return
+    importer.print_report(result)
+
+def analytics_report():
+    try:
+        import analytics  # needs numpy
+    except ImportError:
+        print("❌ Analytics needs numpy (pip install numpy).")
+        return
+    start = input("From date (YYYY-MM-DD): ").strip()
+    end = input("To date (YYYY-MM-DD, default = from date): ").strip() or start
+    by = input(f"Group by ({'/'.join(analytics.GROUPS)}, default month): ").strip().lower() or "month"
+    yoy = input("Compare with the previous year? (y/N): ").strip().lower() == "y"
+    if by not in analytics.GROUPS:
+        print("❌ Invalid grouping.")
+        return
+    try:
+        snapshot = analytics.refresh()
+        if yoy:
+            result = snapshot.year_over_year(start, end, by)
+        else:
+            result = snapshot.report(start, end, by)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    if yoy:
+        analytics.print_report(result["current"])
+        change = result["revenue_change"]
+        print(f"Revenue vs last year: {'n/a' if change is None else f'{change:+.1f}%'}")
     else:
-        for b in bookings:
-            print(f"Booking ID: {b['id']} | User: {b['username']} | Movie: {b['title']} | Showtime: {b['start_time']} | Amount: ₹{b['total_amount']:.2f}")
+        analytics.print_report(result)
 
-    cur.close()
-    conn.close()
+def archive_old_months():
+    default = archive.cutoff()[:7]
+    before = input(f"Archive showtimes before month (YYYY-MM, default {default}): ").strip() or default
+    try:
+        result = archive.archive(before)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    archive.print_report(result)
 
 def admin_monthly_report():
     print("\n📊 Monthly Report (Last 30 Days)")
+    # Revenue & tickets per day, from the per-movie daily rollup
+    with db.fan_out(), db.read_only():
+        report = core.run(core.monthly_report(30))
 
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-
-    # Revenue & tickets per day
-    cur.execute("""
-        SELECT DATE(s.start_time) AS day,
-               SUM(b.total_amount) AS revenue,
-               COUNT(b.id) AS tickets_sold
-        FROM bookings b
-        JOIN showtimes s ON b.showtime_id = s.id
-        WHERE s.start_time >= CURDATE() - INTERVAL 30 DAY
-        GROUP BY day
-        ORDER BY day
-    """)
-    rows = cur.fetchall()
-
-    if not rows:
+    if not report["days"]:
         print("❌ No bookings in the last 30 days.")
-        cur.close()
-        conn.close()
         return
 
-    total_revenue = 0
-    total_tickets = 0
-
     print("\nDay-wise Summary:")
-    for r in rows:
+    for r in report["days"]:
         print(f"{r['day']} → Tickets: {r['tickets_sold']} | Revenue: ₹{r['revenue']:.2f}")
-        total_revenue += r["revenue"] or 0
-        total_tickets += r["tickets_sold"]
 
     print("\n📌 Totals:")
-    print(f"Total Tickets Sold: {total_tickets}")
-    print(f"Total Revenue: ₹{total_revenue:.2f}")
-
-    # Find top performing movie
-    cur.execute("""
-        SELECT m.title, SUM(b.total_amount) AS revenue
-        FROM bookings b
-        JOIN showtimes s ON b.showtime_id = s.id
-        JOIN movies m ON s.movie_id = m.id
-        WHERE s.start_time >= CURDATE() - INTERVAL 30 DAY
-        GROUP BY m.title
-        ORDER BY revenue DESC
-        LIMIT 1
-    """)
-    top = cur.fetchone()
+    print(f"Total Tickets Sold: {report['total_tickets']}")
+    print(f"Total Revenue: ₹{report['total_revenue']:.2f}")
 
+    top = report["top_movie"]
     if top:
         print(f"🏆 Top Performing Movie: {top['title']} (Revenue: ₹{top['revenue']:.2f})")
 
-    cur.close()
-    conn.close()
-
 
 def admin_daily_report():
     """
     Daily report for a given date (default = today).
     Shows per-showtime:
       - movie, screen, start_time
-      - seats sold (count of booking_seats)
-      - revenue (sum of bookings.total_amount)
+      - seats sold (from the showtime_sales rollup)
+      - revenue (sum of bookings.total_amount, counted once per booking)
       - capacity and occupancy %
       - average ticket price
     Also prints totals and top movie by revenue for that date.
     """
-    from datetime import date
-
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-
     # 1) Ask date (default today)
     date_str = input("Enter date for report (YYYY-MM-DD, leave empty for today): ").strip()
     if not date_str:
@@ -284,73 +362,83 @@ def admin_daily_report():
 
     print(f"\n📊 Daily Report for {date_str}\n")
 
-    # 2) Per-showtime aggregation (tickets count from booking_seats, revenue from bookings.total_amount)
-    cur.execute("""
-        SELECT
-            s.id AS show_id,
-            m.title AS movie_title,
-            sc.name AS screen_name,
-            s.start_time,
-            sc.total_rows, sc.total_cols,
-            COUNT(bs.id) AS tickets_sold,
-            COALESCE(SUM(b.total_amount), 0) AS revenue
-        FROM showtimes s
-        JOIN movies m ON s.movie_id = m.id
-        JOIN screens sc ON s.screen_id = sc.id
-        LEFT JOIN bookings b ON b.showtime_id = s.id
-        LEFT JOIN booking_seats bs ON bs.booking_id = b.id
-        WHERE DATE(s.start_time) = %s
-        GROUP BY s.id, m.title, sc.name, s.start_time, sc.total_rows, sc.total_cols
-        ORDER BY s.start_time;
-    """, (date_str,))
-    rows = cur.fetchall()
+    # 2) Per-showtime figures straight from the rollup, 3) top movie that day
+    with db.fan_out(), db.read_only():
+        report = core.run(core.daily_report(date_str))
 
-    if not rows:
+    if not report["showtimes"]:
         print("No showtimes found for this date.\n")
-        cur.close()
-        conn.close()
         return
 
-    total_revenue = 0.0
-    total_tickets = 0
     # Print per-showtime details
-    for r in rows:
-        capacity = (r["total_rows"] or 0) * (r["total_cols"] or 0)
-        tickets_sold = int(r["tickets_sold"] or 0)
-        revenue = float(r["revenue"] or 0.0)
-        avg_ticket = (revenue / tickets_sold) if tickets_sold > 0 else 0.0
-        occupancy = (tickets_sold / capacity * 100) if capacity > 0 else 0.0
-
+    for r in report["showtimes"]:
         print(f"🎬 {r['movie_title']} @ {r['screen_name']} on {r['start_time']}")
-        print(f"    Tickets sold: {tickets_sold} / {capacity}  |  Occupancy: {occupancy:.1f}%")
-        print(f"    Revenue: ₹{revenue:.2f}  |  Avg ticket: ₹{avg_ticket:.2f}\n")
-
-        total_revenue += revenue
-        total_tickets += tickets_sold
+        print(f"    Tickets sold: {r['tickets_sold']} / {r['capacity']}  |  Occupancy: {r['occupancy']:.1f}%")
+        print(f"    Revenue: ₹{r['revenue']:.2f}  |  Avg ticket: ₹{r['avg_ticket']:.2f}\n")
 
     print("----")
-    print(f"💰 Total revenue for {date_str}: ₹{total_revenue:.2f}")
-    print(f"🎟 Total tickets sold: {total_tickets}")
-
-    # 3) Top movie by revenue that day
-    cur.execute("""
-        SELECT m.title AS movie_title, COALESCE(SUM(b.total_amount),0) AS revenue
-        FROM showtimes s
-        JOIN movies m ON s.movie_id = m.id
-        LEFT JOIN bookings b ON b.showtime_id = s.id
-        WHERE DATE(s.start_time) = %s
-        GROUP BY m.title
-        ORDER BY revenue DESC
-        LIMIT 1;
-    """, (date_str,))
-    top = cur.fetchone()
-    if top and top["revenue"] and top["revenue"] > 0:
-        print(f"🏆 Top movie of the day: {top['movie_title']} (Revenue: ₹{top['revenue']:.2f})")
+    print(f"💰 Total revenue for {date_str}: ₹{report['total_revenue']:.2f}")
+    print(f"🎟 Total tickets sold: {report['total_tickets']}")
+
+    top = report["top_movie"]
+    if top and top["revenue"] > 0:
+        print(f"🏆 Top movie of the day: {top['title']} (Revenue: ₹{top['revenue']:.2f})")
     else:
         print("No revenue/bookings for this date.")
 
-    cur.close()
-    conn.close()
+
+def rebuild_rollups():
+    print("\n🔁 Rebuilding report rollups from bookings...")
+    count = 0
+    for node in db.nodes():
+        with db.on_node(node), db.unit_of_work() as cur:
+            count += rollups.rebuild(cur)
+    print(f"✅ Rollups rebuilt for {count} showtimes.")
+
+
+def pool_stats_report():
+    print("\n🔌 Connection Pool & Cache Stats")
+    s = db.stats()
+    print(f"Borrows: {s['borrows']} | In use: {s['in_use']} (peak {s['peak_in_use']})")
+    print(f"Wait: avg {s['avg_wait_ms']:.2f} ms, max {s['max_wait_ms']:.2f} ms | Timeouts: {s['timeouts']}")
+    print(f"Hold: avg {s['avg_hold_ms']:.2f} ms, max {s['max_hold_ms']:.2f} ms | Overdue: {s['overdue']}")
+    print(f"Health checks: {s['health_checks']} | Reconnects: {s['reconnects']} | "
+          f"Statements prepared: {s['prepares']}")
+    print(f"Connections: {s['connections_created']} opened, {s['connections_closed']} closed")
+    c = catalog.stats()
+    print(f"Catalog cache: {c['hits']} hits / {c['misses']} misses ({c['hit_rate']:.1f}%) | "
+          f"Stale reloads: {c['stale_reloads']} | Version: {c['version']}")
+    r = reportcache.stats()
+    print(f"Report cache: {r['hits']} hits / {r['misses']} misses ({r['hit_rate']:.1f}%) | "
+          f"Invalidated: {r['stale']} | Expired (today): {r['expired']} | Entries: {r['entries']}")
+    for node, r in replicas.stats().items():
+        routes = " | ".join(f"{name}: {s['calls']} calls, avg {s['avg_ms']:.2f} ms, max {s['max_ms']:.2f} ms"
+                            for name, s in r["routes"].items())
+        print(f"Replicas ({node}): " + ", ".join(
+            f"{x['name']} {'✅' if x['healthy'] else '❌'} lag {x['lag_s'] if x['lag_s'] is not None else '?'}s"
+            for x in r["replicas"]) + f" | Fallbacks to primary: {r['fallbacks']}")
+        if routes:
+            print(f"  Routes: {routes}")
+    j = journal.stats()
+    if j:
+        print(f"Booking journal: {j['appended']} journaled | {j['applied']} applied in {j['batches']} batches "
+              f"(avg {j['avg_batch']:.1f}) | Pending: {j['pending']} | Rejected: {j['rejected']} | "
+              f"fsyncs: {j['fsyncs']}")
+
+
+def query_stats_report(n=10, out=None):
+    print(f"\n🔍 Top {n} SQL Statements (by total time)", file=out)
+    if not tracing.tracer.enabled:
+        print("Tracing is off. Start with --trace or CINEMA_TRACE=1 to collect statement stats.", file=out)
+        return
+    rows = tracing.top(n)
+    if not rows:
+        print("No statements recorded yet.", file=out)
+    for r in rows:
+        print(f"{r['calls']:>6} calls | total {r['total_ms']:9.2f} ms | avg {r['avg_ms']:7.2f} ms | "
+              f"max {r['max_ms']:7.2f} ms | rows {r['rows']:>7} | {r['statement'][:100]}", file=out)
+    print(f"Slow statements (≥ {tracing.tracer.slow_ms:.0f} ms) are logged to {tracing.tracer.slow_log}",
+          file=out)
 
 
 def admin_menu(admin_user):
@@ -362,7 +450,14 @@ def admin_menu(admin_user):
         print("4. View All Bookings")
         print("5. Daily Report")
         print("6. Monthly Report")
-        print("7. Logout")
+        print("7. Connection Pool & Cache Stats")
+        print("8. Rebuild Report Rollups")
+        print("9. Export Bookings")
+        print("10. SQL Query Stats")
+        print("11. Bulk Import (CSV)")
+        print("12. Analytics (custom range)")
+        print("13. Archive Closed Months")
+        print("14. Logout")
 
         choice = input("Enter choice: ").strip()
 
@@ -379,6 +474,20 @@ def admin_menu(admin_user):
         elif choice == "6":
             admin_monthly_report()  # ✅ you can implement monthly aggregation
         elif choice == "7":
+            pool_stats_report()
+        elif choice == "8":
+            rebuild_rollups()
+        elif choice == "9":
+            export_bookings()
+        elif choice == "10":
+            query_stats_report()
+        elif choice == "11":
+            bulk_import()
+        elif choice == "12":
+            analytics_report()
+        elif choice == "13":
+            archive_old_months()
+        elif choice == "14":
             print("👋 Logging out of Admin Panel...")
             break
         else:
@@ -411,52 +520,43 @@ def add_movie():
     duration = input("Enter duration in minutes: ")
     rating = input("Enter rating (e.g. PG, R, etc.): ")
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO movies (title, description, duration_min, rating) VALUES (%s, %s, %s, %s)",
-        (title, description, duration, rating)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db.unit_of_work() as cur:
+        cur.execute(
+            "INSERT INTO movies (title, description, duration_min, rating) VALUES (%s, %s, %s, %s)",
+            (title, description, duration, rating)
+        )
+        catalog.bump(cur)
     print(f"✅ Movie '{title}' added successfully!")
 
 
 def view_movies():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, duration_min, rating FROM movies;")
-    movies = cur.fetchall()
+    movies = core.run(core.movies())
     if not movies:
         print("No movies found.")
     else:
         print("\nMovies:")
         for m in movies:
-            print(f"{m[0]} - {m[1]} ({m[2]}min, {m[3]})")  # show ID so you can delete
-    cur.close()
-    conn.close()
+            print(f"{m['id']} - {m['title']} ({m['duration_min']}min, {m['rating']})")  # show ID so you can delete
 
 def delete_movie(movie_id):
-    conn = get_connection()
-    cur = conn.cursor()
-
     # check if movie exists
-    cur.execute("SELECT title FROM movies WHERE id=%s", (movie_id,))
-    row = cur.fetchone()
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT title FROM movies WHERE id=%s", (movie_id,))
+        row = cur.fetchone()
     if not row:
         print("⚠️ Movie not found.")
-    else:
-        confirm = input(f"Are you sure you want to delete '{row[0]}'? (y/n): ")
-        if confirm.lower() == "y":
-            cur.execute("DELETE FROM movies WHERE id=%s", (movie_id,))
-            conn.commit()
-            print(f"✅ Movie '{row[0]}' deleted successfully!")
-        else:
-            print("❌ Deletion cancelled.")
+        return
 
-    cur.close()
-    conn.close()
+    confirm = input(f"Are you sure you want to delete '{row[0]}'? (y/n): ")
+    if confirm.lower() == "y":
+        with db.unit_of_work() as cur:
+            reportcache.touch_movie(cur, movie_id)
+            cur.execute("DELETE FROM movies WHERE id=%s", (movie_id,))
+            catalog.bump(cur)
+        inventory.clear()  # cascaded showtimes/bookings are gone
+        print(f"✅ Movie '{row[0]}' deleted successfully!")
+    else:
+        print("❌ Deletion cancelled.")
 
 
 def manage_screens():
@@ -467,21 +567,19 @@ def manage_screens():
         print("3. Back")
 
         choice = input("Enter choice: ").strip()
-        conn = get_connection()
-        cur = conn.cursor(dictionary=True)
 
         if choice == "1":
             name = input("Enter screen name: ").strip()
             rows = int(input("Enter number of seat rows: "))
             cols = int(input("Enter number of seat cols: "))
-            cur.execute("INSERT INTO screens (name, total_rows, total_cols) VALUES (%s, %s, %s)",
-                        (name, rows, cols))
-            conn.commit()
+            with db.unit_of_work() as cur:
+                cur.execute("INSERT INTO screens (name, total_rows, total_cols) VALUES (%s, %s, %s)",
+                            (name, rows, cols))
+                catalog.bump(cur)
             print("✅ Screen added.")
 
         elif choice == "2":
-            cur.execute("SELECT * FROM screens")
-            rows = cur.fetchall()
+            rows = core.run(catalog.screens())
             print("\nScreens:")
             for r in rows:
                 print(f"{r['id']}. {r['name']} ({r['total_rows']}x{r['total_cols']})")
@@ -491,9 +589,6 @@ def manage_screens():
         else:
             print("❌ Invalid choice.")
 
-        cur.close()
-        conn.close()
-
 
 # ---------------------
 # Showtimes Management
@@ -506,40 +601,47 @@ def manage_showtimes():
         print("3. Back")
 
         choice = input("Enter choice: ").strip()
-        conn = get_connection()
-        cur = conn.cursor(dictionary=True)
 
         if choice == "1":
+            movies = core.run(catalog.movies())
+            screens = core.run(catalog.screens())
+
             # list movies
-            cur.execute("SELECT * FROM movies")
-            movies = cur.fetchall()
             print("Available Movies:")
             for m in movies:
                 print(f"{m['id']}. {m['title']}")
             movie_id = int(input("Enter Movie ID: "))
 
             # list screens
-            cur.execute("SELECT * FROM screens")
-            screens = cur.fetchall()
             print("Available Screens:")
             for s in screens:
                 print(f"{s['id']}. {s['name']} ({s['total_rows']}x{s['total_cols']})")
             screen_id = int(input("Enter Screen ID: "))
 
             start_time = input("Enter start time (YYYY-MM-DD HH:MM:SS): ").strip()
+            try:
+                scheduling.to_datetime(start_time)
+            except ValueError:
+                print("❌ Invalid start time.")
+                continue
             price = float(input("Enter ticket price: "))
-
-            cur.execute("INSERT INTO showtimes (movie_id, screen_id, start_time, price) VALUES (%s, %s, %s, %s)",
-                        (movie_id, screen_id, start_time, price))
-            conn.commit()
-            print("✅ Showtime added.")
+            duration = next((m["duration_min"] for m in movies if m["id"] == movie_id), None)
+
+            with db.unit_of_work() as cur:
+                # Reject shows that overlap another one on this screen (duration + cleaning buffer)
+                clash = scheduling.check(cur, duration, screen_id, start_time)
+                if clash is None:
+                    cur.execute("INSERT INTO showtimes (movie_id, screen_id, start_time, price) VALUES (%s, %s, %s, %s)",
+                                (movie_id, screen_id, start_time, price))
+                    catalog.bump(cur)
+                    reportcache.touch(cur, [start_time])
+            if clash:
+                print(f"❌ That screen is busy then: it overlaps {clash}.")
+            else:
+                print("✅ Showtime added.")
 
         elif choice == "2":
-            cur.execute("""SELECT showtimes.id, movies.title, screens.name, start_time, price 
-                           FROM showtimes 
-                           JOIN movies ON showtimes.movie_id=movies.id 
-                           JOIN screens ON showtimes.screen_id=screens.id""")
-            rows = cur.fetchall()
+            rows = core.run(core.showtimes())
             print("\nShowtimes:")
             for r in rows:
                 print(f"{r['id']}. {r['title']} @ {r['name']} on {r['start_time']} (₹{r['price']})")
@@ -549,134 +651,106 @@ def manage_showtimes():
         else:
             print("❌ Invalid choice.")
 
-        cur.close()
-        conn.close()
-
 
 # =====================
 # User Functions
 # =====================
 def user_book_tickets(user):
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-
-    # Step 1: Show available showtimes
-    cur.execute("""SELECT showtimes.id, movies.title, screens.name, start_time, price 
-                   FROM showtimes 
-                   JOIN movies ON showtimes.movie_id = movies.id 
-                   JOIN screens ON showtimes.screen_id = screens.id""")
-    shows = cur.fetchall()
-
+    # Step 1: Show upcoming showtimes with seats left
     print("\n📅 Available Showtimes:")
-    for s in shows:
-        print(f"{s['id']}. {s['title']} @ {s['name']} on {s['start_time']} (₹{s['price']})")
+    if not browse_showtimes({"hide_sold_out": True}):
+        print("❌ No upcoming shows with seats left.")
+        return
 
     show_id = int(input("Enter showtime ID to book: ").strip())
 
-    # Step 2: Fetch screen info for seat layout
-    cur.execute("""SELECT screens.id, screens.total_rows, screens.total_cols 
-                   FROM showtimes 
-                   JOIN screens ON showtimes.screen_id = screens.id 
-                   WHERE showtimes.id=%s""", (show_id,))
-    screen = cur.fetchone()
-    rows, cols = screen["total_rows"], screen["total_cols"]
+    # Steps 2-3: Seat layout and booked seats come from the cached bitmap
+    try:
+        with db.for_showtime(show_id):
+            inv = core.run(core.seat_map(show_id))
+    except db.Rebalancing:
+        print("❌ Bookings for this show are being moved to another server. Please try again shortly.")
+        return
+    if inv is None:
+        print("Showtime not found.")
+        return
 
-    # Step 3: Fetch already booked seats
-    cur.execute("""SELECT seat_row, seat_col FROM booking_seats 
-                   WHERE showtime_id=%s""", (show_id,))
-    booked = {(b["seat_row"], b["seat_col"]) for b in cur.fetchall()}
+    with db.unit_of_work(dictionary=True) as cur:
+        # Price for calculating total_amount
+        cur.execute(queries.SHOWTIME_PRICE, (show_id,))
+        price = cur.fetchone()["price"]
 
     # Step 4: Display seat map
     print("\nSeat Map (O = Available, X = Booked):")
-    for r in range(rows):
-        row_label = chr(65 + r)  # A, B, C...
-        row_seats = []
-        for c in range(1, cols + 1):
-            if (row_label, c) in booked:
-                row_seats.append("X")
-            else:
-                row_seats.append("O")
-        print(f"{row_label}: {' '.join(row_seats)}")
+    print("\n".join(inv.render()))
 
     # Step 5: Ask number of tickets
     num_tickets = int(input("Enter number of tickets to book: ").strip())
 
-    # ✅ Step 6: Get price and calculate total_amount
-    cur.execute("SELECT price FROM showtimes WHERE id=%s", (show_id,))
-    price = cur.fetchone()["price"]
-    total_amount = price * num_tickets
-
-    # ✅ Step 7: Insert into bookings with total_amount
-    cur.execute(
-        "INSERT INTO bookings (user_id, showtime_id, total_amount) VALUES (%s, %s, %s)",
-        (user["id"], show_id, total_amount)
-    )
-    booking_id = cur.lastrowid
-
-    # Step 8: Select seats
-    selected_seats = []
-    for i in range(num_tickets):
-        seat = input(f"Enter seat {i+1} (e.g., A5): ").strip().upper()
-        row_label, col = seat[0], int(seat[1:])
-        if (row_label, col) in booked or (row_label, col) in selected_seats:
-            print("❌ Seat already booked. Choose another.")
-            continue
-        cur.execute("""INSERT INTO booking_seats 
-                       (booking_id, showtime_id, seat_row, seat_col) 
-                       VALUES (%s, %s, %s, %s)""", 
-                    (booking_id, show_id, row_label, col))
-        selected_seats.append((row_label, col))
-
-    conn.commit()
-    print(f"\n✅ Booking confirmed! Total amount: ₹{total_amount}")
-    print("Your seats:", ", ".join(f"{r}{c}" for r, c in selected_seats))
-
-    cur.close()
-    conn.close()
-
-def display_seat_map(show_id):
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-
-    # 1. Get screen layout for this showtime
-    cur.execute("""
-        SELECT s.total_rows, s.total_cols
-        FROM showtimes st
-        JOIN screens s ON st.screen_id = s.id
-        WHERE st.id = %s
-    """, (show_id,))
-    screen = cur.fetchone()
-    if not screen:
-        print("Showtime not found.")
-        cur.close()
-        conn.close()
+    auto = input("Pick the best available seats for you? (y/n): ").strip().lower() == "y"
+    if auto:
+        # Step 6-7: Let the allocator choose and hold adjacent seats
+        held = allocator.auto_hold(user["id"], show_id, num_tickets)
+        if held is None:
+            print("❌ Not enough seats left for your group.")
+            return
+        token, selected_seats = held
+    else:
+        # Step 6: Select seats (no connection is held while the user types)
+        selected_seats = []
+        while len(selected_seats) < num_tickets:
+            seat = input(f"Enter seat {len(selected_seats)+1} (e.g., A5): ")
+            try:
+                row_label, col = core.parse_seat(seat)
+            except ValueError:
+                print("❌ Enter a seat like A5.")
+                continue
+            if not inv.is_valid(row_label, col):
+                print("❌ No such seat on this screen.")
+                continue
+            if inv.is_booked(row_label, col) or (row_label, col) in selected_seats:
+                print("❌ Seat already booked. Choose another.")
+                continue
+            selected_seats.append((row_label, col))
+
+        # Step 7: Hold the seats while the user confirms
+        try:
+            token = reservations.hold_seats(user["id"], show_id, selected_seats)
+        except reservations.SeatUnavailable as e:
+            inventory.invalidate(show_id)
+            allocator.invalidate(show_id)
+            print(f"❌ Sorry, {e}. Please try again.")
+            return
+
+    total_amount = price * len(selected_seats)
+    print(f"\nSeats held for {reservations.HOLD_TTL // 60} minutes: "
+          + ", ".join(f"{r}{c}" for r, c in selected_seats))
+    confirm = input(f"Confirm booking for ₹{total_amount}? (y/n): ").strip().lower()
+    if confirm != "y":
+        reservations.release(token)
+        print("❌ Booking cancelled.")
         return
 
-    total_rows, total_cols = screen["total_rows"], screen["total_cols"]
+    # ✅ Step 8: Insert booking with total_amount and its seats in one transaction
+    try:
+        booking = reservations.confirm(token)
+    except reservations.HoldExpired:
+        print("❌ Your seat hold expired. Please start again.")
+        return
 
-    # 2. Get booked seats for this showtime
-    cur.execute("""
-        SELECT bs.seat_row, bs.seat_col
-        FROM booking_seats bs
-        JOIN bookings b ON bs.booking_id = b.id
-        WHERE b.showtime_id = %s
-    """, (show_id,))
-    booked = {(row["seat_row"], row["seat_col"]) for row in cur.fetchall()}
+    print(f"\n✅ Booking #{booking['booking_id']} confirmed! Total amount: ₹{booking['total_amount']}")
+    print("Your seats:", ", ".join(f"{r}{c}" for r, c in booking["seats"]))
 
-    cur.close()
-    conn.close()
+def display_seat_map(show_id):
+    with db.for_showtime(show_id):
+        inv = core.run(core.seat_map(show_id))
+    if inv is None:
+        print("Showtime not found.")
+        return
 
-    # 3. Print seat map
     print("\nSeat Map (O = Available, X = Booked):")
-    for r in range(1, total_rows + 1):
-        row_label = chr(64 + r)   # 1→A, 2→B...
-        row_display = []
-        for c in range(1, total_cols + 1):
-            if (row_label, c) in booked:
-                row_display.append("X")
-            else:
-                row_display.append("O")
-        print(f"{row_label}: {' '.join(row_display)}")
+    print("\n".join(inv.render()))
+    print(f"Available: {inv.available_count()} / {inv.capacity}  |  Occupancy: {inv.occupancy():.1f}%")
 
 
 def user_menu(user):
@@ -689,50 +763,34 @@ def user_menu(user):
         print("5. Logout")
 
         choice = input("Enter choice: ").strip()
-        conn = get_connection()
-        cur = conn.cursor(dictionary=True)
 
         if choice == "1":
-            cur.execute("SELECT * FROM movies")
-            movies = cur.fetchall()
+            movies = core.run(core.movies())
             print("\n🎬 Movies:")
             for m in movies:
                 print(f"{m['id']}. {m['title']} ({m['duration_min']} min)")
 
         elif choice == "2":
-            cur.execute("""SELECT showtimes.id, movies.title, screens.name, start_time, price 
-                           FROM showtimes 
-                           JOIN movies ON showtimes.movie_id=movies.id 
-                           JOIN screens ON showtimes.screen_id=screens.id""")
-            shows = cur.fetchall()
-            print("\n📅 Showtimes:")
-            for s in shows:
-                print(f"{s['id']}. {s['title']} @ {s['name']} on {s['start_time']} (₹{s['price']})")
+            try:
+                filters = ask_showtime_filters()
+                print("\n📅 Showtimes:")
+                if not browse_showtimes(filters):
+                    print("❌ No showtimes match.")
+            except ValueError:
+                print("❌ Invalid date or price.")
 
         elif choice == "3":
             user_book_tickets(user)   # ✅ call booking function we built
 
         elif choice == "4":
-            # show past bookings
-            cur.execute("""
-                SELECT b.id AS booking_id, m.title, s.start_time, sc.name AS screen_name, COUNT(bs.id) AS tickets
-                FROM bookings b
-                JOIN showtimes s ON b.showtime_id = s.id
-                JOIN movies m ON s.movie_id = m.id
-                JOIN screens sc ON s.screen_id = sc.id
-                JOIN booking_seats bs ON b.id = bs.booking_id
-                WHERE b.user_id = %s
-                GROUP BY b.id, m.title, s.start_time, sc.name
-                ORDER BY s.start_time DESC
-            """, (user['id'],))
-            bookings = cur.fetchall()
-
+            # show past bookings, a page at a time
             print("\n🎟️ My Bookings:")
-            if not bookings:
+
+            def print_row(b):
+                print(f"Booking #{b['booking_id']} - {b['title']} @ {b['screen_name']} on {b['start_time']} | Tickets: {b['tickets']}")
+
+            if not show_paged(queries.MY_BOOKINGS, [("b.user_id = %s", user['id'])], print_row, "booking_id"):
                 print("No bookings yet.")
-            else:
-                for b in bookings:
-                    print(f"Booking #{b['booking_id']} - {b['title']} @ {b['screen_name']} on {b['start_time']} | Tickets: {b['tickets']}")
 
         elif choice == "5":
             print("👋 Logging out...")
@@ -740,14 +798,127 @@ def user_menu(user):
         else:
             print("❌ Invalid choice.")
 
-        cur.close()
-        conn.close()
+
+# =====================
+# Scripted Commands
+# =====================
+# python main.py report daily --date 2025-01-31 --format csv
+# Results go to stdout as JSON (or CSV), messages to stderr; exit status 1 on failure.
+def _write_rows(rows, fmt):
+    if fmt == "csv":
+        import csv
+        if rows:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        json.dump(rows, sys.stdout, default=str, ensure_ascii=False)
+        print()
+
+def cmd_report(args):
+    with db.fan_out(), db.read_only():
+        if args.kind == "daily":
+            report = core.run(core.daily_report(args.date.isoformat()))
+        else:
+            report = core.run(core.monthly_report(args.days))
+    if args.format == "csv":
+        _write_rows(report["showtimes"] if args.kind == "daily" else report["days"], "csv")
+    else:
+        _write_rows(report, "json")
+
+def cmd_import(args):
+    result = importer.import_file(args.kind, args.file)
+    _write_rows(result, "json")
+    return 1 if result["errors"] else 0
+
+def cmd_book(args):
+    user = core.run(auth.find_user(args.user))
+    if user is None:
+        raise ValueError(f"no such user: {args.user}")
+    seats = [core.parse_seat(code) for code in args.seats.split(",")] if args.seats else None
+    try:
+        with db.for_showtime(args.showtime, user["id"]):
+            booking = core.book(user["id"], args.showtime, seats=seats, count=args.count)
+    except reservations.SeatUnavailable as e:
+        raise ValueError(str(e) if e.seats else "not enough seats left") from None
+    booking["seats"] = [f"{r}{c}" for r, c in booking["seats"]]
+    _write_rows(booking, "json")
+
+def cmd_export(args):
+    if args.output == "-":
+        count = export.export_bookings(sys.stdout, args.format)
+    else:
+        with open(args.output, "w", newline="", encoding="utf-8") as out:
+            count = export.export_bookings(out, args.format)
+    print(f"✅ Exported {count} bookings.", file=sys.stderr)
+
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="main.py", description="Cinema booking CLI. "
+                                     "Without a command, starts the interactive menu.")
+    parser.add_argument("--trace", action="store_true", help="collect SQL statement stats")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    report = commands.add_parser("report", help="daily or monthly sales report")
+    kinds = report.add_subparsers(dest="kind", metavar="KIND", required=True)
+    daily = kinds.add_parser("daily", help="per-showtime sales for one day")
+    daily.add_argument("--date", type=date.fromisoformat, default=date.today(),
+                       help="YYYY-MM-DD (default today)")
+    monthly = kinds.add_parser("monthly", help="sales per day")
+    monthly.add_argument("--days", type=int, default=30, help="days back from today (default 30)")
+    for sub in (daily, monthly):
+        sub.add_argument("--format", choices=("json", "csv"), default="json")
+        sub.set_defaults(run=cmd_report)
+
+    imp = commands.add_parser("import", help="bulk-load a CSV file (see importer.py)")
+    imp.add_argument("kind", choices=importer.KINDS)
+    imp.add_argument("file")
+    imp.set_defaults(run=cmd_import)
+
+    book = commands.add_parser("book", help="book seats for a user")
+    book.add_argument("--user", required=True, help="username to book for")
+    book.add_argument("--showtime", type=int, required=True)
+    wanted = book.add_mutually_exclusive_group(required=True)
+    wanted.add_argument("--seats", help="comma-separated seats, e.g. A5,A6")
+    wanted.add_argument("--count", type=int, help="let the allocator pick this many adjacent seats")
+    book.set_defaults(run=cmd_book)
+
+    exp = commands.add_parser("export", help="stream data out")
+    what = exp.add_subparsers(dest="what", metavar="WHAT", required=True)
+    bookings = what.add_parser("bookings", help="every booking, archived ones included")
+    bookings.add_argument("--format", choices=export.FORMATS, default="csv")
+    bookings.add_argument("--output", default="-", help="file to write (default stdout)")
+    bookings.set_defaults(run=cmd_export)
+    return parser
+
+def run_command(args):
+    db.configure(make_backend())
+    ensure_schema(out=sys.stderr)
+    try:
+        return args.run(args) or 0
+    except (ValueError, OSError, db.IntegrityError, db.Rebalancing, reservations.HoldExpired) as e:
+        print(f"❌ {str(e) or type(e).__doc__}", file=sys.stderr)
+        return 1
 
 
 # =====================
 # Main App
 # =====================
-def main():
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    tracing.configure(**{**TRACE_CONFIG, "enabled": TRACE_CONFIG["enabled"] or "--trace" in argv})
+    if any(arg != "--trace" for arg in argv):
+        return run_command(build_parser().parse_args(argv))
+
+    db.configure(make_backend())
+    init_db()
+    replicas.stamp_heartbeats()
+    if JOURNAL_PATH:
+        try:
+            journal.start(JOURNAL_PATH)
+        except journal.JournalBusy as e:
+            print(f"⚠️ {e}; bookings are confirmed directly.")
     print("=== Cinema Booking CLI ===")
     while True:
         print("\n1. Register")
@@ -776,4 +947,10 @@ def main():
             print("❌ Invalid choice.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        sys.exit(main())
+    finally:
+        if "--trace" in sys.argv:
+            # Keep a scripted command's stdout (JSON, CSV) clean for pipes
+            scripted = any(arg != "--trace" for arg in sys.argv[1:])
+            query_stats_report(out=sys.stderr if scripted else None)
@@ -0,0 +1,345 @@
+"""
+Versioned schema migrations.
+
+Applied versions are recorded in schema_version; migrate() runs every newer
+up-step in order, one transaction per step, and records it. To change the
+schema, append a new (version, description, function) to MIGRATIONS -- never
+edit a step that has already shipped.
+
+Note that MySQL commits implicitly around DDL, so a step that fails halfway
+there has to be written so it can simply be re-run.
+
+    python migrations.py           # bring the configured database up to date
+    python migrations.py --check   # ... then EXPLAIN the hot queries
+"""
+import re
+import secrets
+import sys
+
+import db
+import queries
+import schema
+
+VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def _columns(cur, dialect, table):
+    if dialect == "mysql":
+        cur.execute("SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+    else:
+        cur.execute(f"SELECT name FROM pragma_table_info('{table}')")
+    return {row[0] for row in cur.fetchall()}
+
+
+def _create_index(cur, dialect, name, table, columns):
+    """CREATE INDEX unless it exists, so a step that failed halfway on MySQL can be re-run."""
+    if dialect == "mysql":
+        cur.execute("SELECT COUNT(*) FROM information_schema.statistics "
+                    "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                    (table, name))
+        if cur.fetchone()[0]:
+            return
+        cur.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    else:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+# =====================
+# Up-steps
+# =====================
+def _baseline(cur, dialect):
+    """All tables; upgrades pre-migration booking_seats and backfills rollups."""
+    for ddl in schema.render(dialect):
+        cur.execute(ddl)
+
+    # Deployments created before booking_seats carried showtime_id
+    if "showtime_id" not in _columns(cur, dialect, "booking_seats"):
+        cur.execute("ALTER TABLE booking_seats ADD COLUMN showtime_id INT NULL AFTER booking_id")
+        cur.execute("""
+            UPDATE booking_seats bs
+            JOIN bookings b ON bs.booking_id = b.id
+            SET bs.showtime_id = b.showtime_id
+        """)
+        cur.execute("""
+            ALTER TABLE booking_seats
+                MODIFY showtime_id INT NOT NULL,
+                ADD UNIQUE KEY uq_booking_seats_seat (showtime_id, seat_row, seat_col),
+                ADD FOREIGN KEY (showtime_id) REFERENCES showtimes(id) ON DELETE CASCADE
+        """)
+
+    # Backfill the rollups (rollups.rebuild() as of this step; it has no archive yet)
+    cur.execute("DELETE FROM movie_daily_sales")
+    cur.execute("DELETE FROM showtime_sales")
+    cur.execute("""
+        INSERT INTO showtime_sales (showtime_id, bookings, seats_sold, revenue)
+        SELECT b.showtime_id, COUNT(*), COALESCE(SUM(bs.seats), 0), SUM(b.total_amount)
+        FROM bookings b
+        LEFT JOIN (SELECT booking_id, COUNT(*) AS seats
+                   FROM booking_seats GROUP BY booking_id) bs
+               ON bs.booking_id = b.id
+        GROUP BY b.showtime_id
+    """)
+    cur.execute("""
+        INSERT INTO movie_daily_sales (day, movie_id, bookings, seats_sold, revenue)
+        SELECT DATE(s.start_time), s.movie_id,
+               SUM(ss.bookings), SUM(ss.seats_sold), SUM(ss.revenue)
+        FROM showtime_sales ss
+        JOIN showtimes s ON ss.showtime_id = s.id
+        GROUP BY DATE(s.start_time), s.movie_id
+    """)
+
+
+def _hot_query_indexes(cur, dialect):
+    """Indexes behind the report, listing and My Bookings queries."""
+    _create_index(cur, dialect, "idx_showtimes_start", "showtimes", "start_time, movie_id, screen_id")
+    _create_index(cur, dialect, "idx_bookings_user_show", "bookings", "user_id, showtime_id")
+    _create_index(cur, dialect, "idx_bookings_booked_at", "bookings", "booked_at")
+    _create_index(cur, dialect, "idx_booking_seats_booking", "booking_seats", "booking_id")
+    _create_index(cur, dialect, "idx_seat_holds_token", "seat_holds", "hold_token")
+
+
+def _listing_indexes(cur, dialect):
+    """Lets the keyset-paged listings walk showtimes by time and join bookings by index."""
+    _create_index(cur, dialect, "idx_bookings_showtime", "bookings", "showtime_id, id")
+
+
+def _catalog_version(cur, dialect):
+    """Single-row version stamp bumped on every catalog edit (see catalog.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INT PRIMARY KEY,
+            version BIGINT NOT NULL
+        ){engine}
+    """.format(**schema.DIALECTS[dialect]))
+    cur.execute("SELECT COUNT(*) FROM catalog_version")
+    if not cur.fetchone()[0]:
+        cur.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0)")
+
+
+def _report_day_versions(cur, dialect):
+    """Per show-day change counters behind the report cache (see reportcache.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS report_day_versions (
+            day VARCHAR(10) PRIMARY KEY,
+            version BIGINT NOT NULL
+        ){engine}
+    """.format(**schema.DIALECTS[dialect]))
+
+
+def _archive_tables(cur, dialect):
+    """Cold copies of showtimes and their bookings, filled by archive.py."""
+    tokens = schema.DIALECTS[dialect]
+    for ddl in ("""
+        CREATE TABLE IF NOT EXISTS showtimes_archive (
+            id INT PRIMARY KEY,
+            movie_id INT NOT NULL,
+            screen_id INT NOT NULL,
+            start_time DATETIME NOT NULL,
+            price DECIMAL(10,2) NOT NULL,
+            created_at TIMESTAMP NULL,
+            FOREIGN KEY(movie_id) REFERENCES movies(id) ON DELETE CASCADE,
+            FOREIGN KEY(screen_id) REFERENCES screens(id) ON DELETE CASCADE
+        ){engine}
+    """, """
+        CREATE TABLE IF NOT EXISTS bookings_archive (
+            id INT PRIMARY KEY,
+            user_id INT NOT NULL,
+            showtime_id INT NOT NULL,
+            total_amount DECIMAL(10,2) NOT NULL,
+            booked_at TIMESTAMP NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(showtime_id) REFERENCES showtimes_archive(id) ON DELETE CASCADE
+        ){engine}
+    """, """
+        CREATE TABLE IF NOT EXISTS booking_seats_archive (
+            id INT PRIMARY KEY,
+            booking_id INT NOT NULL,
+            showtime_id INT NOT NULL,
+            seat_row VARCHAR(5) NOT NULL,
+            seat_col INT NOT NULL,
+            FOREIGN KEY(booking_id) REFERENCES bookings_archive(id) ON DELETE CASCADE
+        ){engine}
+    """, """
+        CREATE TABLE IF NOT EXISTS showtime_sales_archive (
+            showtime_id INT PRIMARY KEY,
+            bookings INT NOT NULL DEFAULT 0,
+            seats_sold INT NOT NULL DEFAULT 0,
+            revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+            FOREIGN KEY(showtime_id) REFERENCES showtimes_archive(id) ON DELETE CASCADE
+        ){engine}
+    """):
+        cur.execute(ddl.format(**tokens))
+    _create_index(cur, dialect, "idx_showtimes_archive_start", "showtimes_archive",
+                  "start_time, movie_id, screen_id")
+    _create_index(cur, dialect, "idx_bookings_archive_showtime", "bookings_archive", "showtime_id, id")
+    _create_index(cur, dialect, "idx_bookings_archive_user", "bookings_archive", "user_id")
+    _create_index(cur, dialect, "idx_booking_seats_archive_booking", "booking_seats_archive", "booking_id")
+
+
+def _id_sequences(cur, dialect):
+    """Block-allocated booking ids, known before the INSERT (see reservations.IdBlocks)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name VARCHAR(50) PRIMARY KEY,
+            next_id BIGINT NOT NULL
+        ){engine}
+    """.format(**schema.DIALECTS[dialect]))
+    cur.execute("SELECT COUNT(*) FROM id_sequences WHERE name = 'bookings'")
+    if not cur.fetchone()[0]:
+        cur.execute("""
+            INSERT INTO id_sequences (name, next_id)
+            SELECT 'bookings', GREATEST(
+                (SELECT COALESCE(MAX(id), 0) FROM bookings),
+                (SELECT COALESCE(MAX(id), 0) FROM bookings_archive)) + 1
+        """.replace("GREATEST", "GREATEST" if dialect == "mysql" else "MAX"))
+
+
+def _shard_map(cur, dialect):
+    """Which shard node holds each screen's bookings (see shards.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS shard_map (
+            screen_id INT PRIMARY KEY,
+            node VARCHAR(50) NOT NULL,
+            moving_to VARCHAR(50) NULL
+        ){engine}
+    """.format(**schema.DIALECTS[dialect]))
+
+
+def _replica_heartbeat(cur, dialect):
+    """Heartbeat stamped on the primary to measure replica lag (see replicas.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS replica_heartbeat (
+            id INT PRIMARY KEY,
+            beat_ms BIGINT NOT NULL
+        ){engine}
+    """.format(**schema.DIALECTS[dialect]))
+    cur.execute("SELECT COUNT(*) FROM replica_heartbeat")
+    if not cur.fetchone()[0]:
+        cur.execute("INSERT INTO replica_heartbeat (id, beat_ms) VALUES (1, 0)")
+
+
+def _hold_claims(cur, dialect):
+    """The journaled booking a hold was confirmed as (see journal.py)."""
+    if "booking_id" not in _columns(cur, dialect, "seat_holds"):
+        cur.execute("ALTER TABLE seat_holds ADD COLUMN booking_id INT NULL")
+
+
+def _report_cache_identity(cur, dialect):
+    """A random identity per database, so cached reports never outlive it (see reportcache.py)."""
+    cur.execute("DELETE FROM report_day_versions WHERE day = '#db'")
+    cur.execute("INSERT INTO report_day_versions (day, version) VALUES ('#db', %s)",
+                (secrets.randbits(62),))
+
+
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "indexes for hot queries", _hot_query_indexes),
+    (3, "indexes for paged booking listings", _listing_indexes),
+    (4, "catalog version stamp", _catalog_version),
+    (5, "report cache day versions", _report_day_versions),
+    (6, "archive tables for closed months", _archive_tables),
+    (7, "booking id sequence", _id_sequences),
+    (8, "shard map", _shard_map),
+    (9, "replica heartbeat", _replica_heartbeat),
+    (10, "journal hold claims", _hold_claims),
+    (11, "report cache database identity", _report_cache_identity),
+]
+
+
+# =====================
+# Runner
+# =====================
+def current_version(backend):
+    with backend.unit_of_work() as cur:
+        cur.execute(VERSION_TABLE)
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cur.fetchone()[0]
+
+
+def migrate(backend):
+    """Apply pending migrations; returns the list of versions applied."""
+    applied = []
+    version = current_version(backend)
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        with backend.unit_of_work() as cur:
+            step(cur, backend.dialect)
+            cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (number, description))
+        applied.append(number)
+    return applied
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+# =====================
+# Index check
+# =====================
+_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|GROUP\b|ORDER\b)(\w+))?",
+                    re.IGNORECASE)
+
+
+def _aliases(sql):
+    """Map every table alias (and bare table name) in sql to its table."""
+    found = {}
+    for table, alias in _ALIAS.findall(sql):
+        found[table] = table
+        if alias:
+            found[alias] = table
+    return found
+
+
+def _full_scans(cur, dialect, sql, params):
+    """Names of the tables the plan reads without an index."""
+    aliases = _aliases(sql)
+    if dialect == "mysql":
+        cur.execute("EXPLAIN " + sql, params)
+        return {aliases.get(row["table"], row["table"])
+                for row in cur.fetchall() if row["type"] == "ALL"}
+    cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+    scans = set()
+    for row in cur.fetchall():
+        detail = row["detail"]
+        if detail.startswith("SCAN ") and "INDEX" not in detail:
+            name = detail.split()[1]
+            scans.add(aliases.get(name, name))
+    return scans
+
+
+def check_indexes(backend):
+    """
+    EXPLAIN every query in queries.HOT_QUERIES. Returns {name: tables scanned
+    without an index}, limited to the tables each query must not scan.
+    """
+    problems = {}
+    with backend.unit_of_work(dictionary=True) as cur:
+        for name, (sql, params, must_use_index) in queries.HOT_QUERIES.items():
+            scanned = _full_scans(cur, backend.dialect, sql, params) & set(must_use_index)
+            if scanned:
+                problems[name] = sorted(scanned)
+    return problems
+
+
+if __name__ == "__main__":
+    import main
+
+    backend = main.make_backend()
+    db.configure(backend)
+    applied = backend.init_schema()
+    print(f"Applied migrations: {applied or 'none'} (now at {current_version(backend)})")
+    if "--check" in sys.argv:
+        problems = check_indexes(backend)
+        for name in queries.HOT_QUERIES:
+            print(f"{'❌' if name in problems else '✅'} {name}"
+                  + (f": full scan of {', '.join(problems[name])}" if name in problems else ""))
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,210 @@
+"""
+Hot read queries shared by the CLI, the HTTP service and the index check in
+migrations.py.
+
+Date filters are half-open ranges on the raw column (start_time >= day AND
+start_time < next day) rather than DATE(start_time) = day, so they can use
+idx_showtimes_start instead of evaluating DATE() on every row.
+
+The per-booking lookups are registered with db.prepared().
+"""
+from datetime import date, timedelta
+
+import db
+
+# Showtime listing
+LIST_SHOWTIMES = """
+    SELECT showtimes.id, movies.title, screens.name, start_time, price
+    FROM showtimes
+    JOIN movies ON showtimes.movie_id = movies.id
+    JOIN screens ON showtimes.screen_id = screens.id
+"""
+
+LIST_MOVIES = "SELECT id, title, duration_min, rating FROM movies"
+
+LIST_SCREENS = "SELECT id, name, total_rows, total_cols FROM screens"
+
+# Seat layout of a showtime's screen; params: (showtime_id,)
+SHOWTIME_SCREEN = db.prepared("""
+    SELECT s.total_rows, s.total_cols
+    FROM showtimes st
+    JOIN screens s ON st.screen_id = s.id
+    WHERE st.id = %s
+""")
+
+# Seats already sold for a showtime; params: (showtime_id,)
+BOOKED_SEATS = db.prepared("""
+    SELECT seat_row, seat_col
+    FROM booking_seats
+    WHERE showtime_id = %s
+""")
+
+# Ticket price of a showtime; params: (showtime_id,)
+SHOWTIME_PRICE = db.prepared("SELECT price FROM showtimes WHERE id = %s")
+
+# Seats sold for a showtime per the rollup (0 before its first booking); params: (showtime_id,)
+SEATS_SOLD = db.prepared("""
+    SELECT COALESCE(SUM(seats_sold), 0) AS sold
+    FROM showtime_sales
+    WHERE showtime_id = %s
+""")
+
+# Per-showtime figures for one day, from the hot and the archive tables
+# (see archive.py); params: day_bounds(day) * 2
+DAILY_SHOWTIMES = """
+    SELECT
+        s.id AS show_id,
+        m.title AS movie_title,
+        sc.name AS screen_name,
+        s.start_time,
+        sc.total_rows, sc.total_cols,
+        COALESCE(ss.seats_sold, 0) AS tickets_sold,
+        COALESCE(ss.revenue, 0) AS revenue
+    FROM showtimes s
+    JOIN movies m ON s.movie_id = m.id
+    JOIN screens sc ON s.screen_id = sc.id
+    LEFT JOIN showtime_sales ss ON ss.showtime_id = s.id
+    WHERE s.start_time >= %s AND s.start_time < %s
+    UNION ALL
+    SELECT sa.id, ma.title, sca.name, sa.start_time, sca.total_rows, sca.total_cols,
+           COALESCE(ssa.seats_sold, 0), COALESCE(ssa.revenue, 0)
+    FROM showtimes_archive sa
+    JOIN movies ma ON sa.movie_id = ma.id
+    JOIN screens sca ON sa.screen_id = sca.id
+    LEFT JOIN showtime_sales_archive ssa ON ssa.showtime_id = sa.id
+    WHERE sa.start_time >= %s AND sa.start_time < %s
+    ORDER BY start_time
+"""
+
+# Revenue & tickets per day since a date; params: (since,)
+MONTHLY_BY_DAY = """
+    SELECT day,
+           SUM(revenue) AS revenue,
+           SUM(seats_sold) AS tickets_sold
+    FROM movie_daily_sales
+    WHERE day >= %s
+    GROUP BY day
+    ORDER BY day
+"""
+
+# Revenue per movie since a date (the top one is picked after merging the
+# rows of every node, see shards.py); params: (since,)
+MONTHLY_BY_MOVIE = """
+    SELECT m.title, SUM(r.revenue) AS revenue
+    FROM movie_daily_sales r
+    JOIN movies m ON r.movie_id = m.id
+    WHERE r.day >= %s
+    GROUP BY m.title
+"""
+
+# Listings are paged with keyset_page(); {where} receives the filters and the
+# (start_time, booking id) cursor, newest show first.
+PAGE_SIZE = 20
+
+# Upcoming showtimes with seats left, for browsing (see showtime_filters());
+# earliest first, paged with keyset_page(..., newest_first=False). Seats sold
+# come from the showtime_sales rollup, kept by every booking transaction.
+BROWSE_SHOWTIMES = """
+    SELECT s.id, m.title, sc.name AS screen_name, s.start_time, s.price,
+           sc.total_rows * sc.total_cols AS capacity,
+           COALESCE(ss.seats_sold, 0) AS seats_sold
+    FROM showtimes s
+    JOIN movies m ON s.movie_id = m.id
+    JOIN screens sc ON s.screen_id = sc.id
+    LEFT JOIN showtime_sales ss ON ss.showtime_id = s.id
+    {where}
+    ORDER BY s.start_time, s.id
+    LIMIT %s
+"""
+
+# Every booking (admin listing)
+ALL_BOOKINGS = """
+    SELECT b.id, u.username, m.title, s.start_time, b.total_amount
+    FROM bookings b
+    JOIN users u ON b.user_id = u.id
+    JOIN showtimes s ON b.showtime_id = s.id
+    JOIN movies m ON s.movie_id = m.id
+    {where}
+    ORDER BY s.start_time DESC, b.id DESC
+    LIMIT %s
+"""
+
+# A user's bookings; filter with ("b.user_id = %s", user_id)
+MY_BOOKINGS = """
+    SELECT b.id AS booking_id, m.title, s.start_time, sc.name AS screen_name,
+           (SELECT COUNT(*) FROM booking_seats bs WHERE bs.booking_id = b.id) AS tickets
+    FROM bookings b
+    JOIN showtimes s ON b.showtime_id = s.id
+    JOIN movies m ON s.movie_id = m.id
+    JOIN screens sc ON s.screen_id = sc.id
+    {where}
+    ORDER BY s.start_time DESC, b.id DESC
+    LIMIT %s
+"""
+
+# Same as (s.start_time, b.id) < (cursor), spelt so the start_time bound is a plain range
+_AFTER = "s.start_time <= %s AND (s.start_time < %s OR b.id < %s)"
+# ... and (s.start_time, s.id) > (cursor) for lists in ascending order
+_AFTER_ASC = "s.start_time >= %s AND (s.start_time > %s OR s.id > %s)"
+
+
+def keyset_page(template, filters=(), after=None, limit=PAGE_SIZE, newest_first=True):
+    """
+    (sql, params) for one page of a listing template. filters is a list of
+    (condition, value) pairs; after is the (start_time, id) of the last row
+    already shown, or None for the first page.
+    """
+    clauses = [cond for cond, _ in filters]
+    params = [value for _, value in filters]
+    if after is not None:
+        clauses.append(_AFTER if newest_first else _AFTER_ASC)
+        params += [after[0], after[0], after[1]]
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    return template.format(where=where), params + [limit]
+
+
+def showtime_filters(starts_after, movie_id=None, title=None, screen_id=None,
+                     date_from=None, date_to=None, min_price=None, max_price=None):
+    """
+    keyset_page() filters for BROWSE_SHOWTIMES: shows starting after
+    starts_after ('YYYY-MM-DD HH:MM:SS') and within the optional date range
+    ('YYYY-MM-DD', both ends included), movie, title text, screen and price.
+    """
+    start = max(starts_after, day_bounds(date_from)[0]) if date_from else starts_after
+    filters = [("s.start_time >= %s", start)]
+    if date_to:
+        filters.append(("s.start_time < %s", day_bounds(date_to)[1]))
+    if movie_id is not None:
+        filters.append(("s.movie_id = %s", movie_id))
+    if title:
+        filters.append(("m.title LIKE %s", f"%{title}%"))
+    if screen_id is not None:
+        filters.append(("s.screen_id = %s", screen_id))
+    if min_price is not None:
+        filters.append(("s.price >= %s", min_price))
+    if max_price is not None:
+        filters.append(("s.price <= %s", max_price))
+    return filters
+
+
+def day_bounds(day):
+    """('YYYY-MM-DD 00:00:00', next day 00:00:00) for a 'YYYY-MM-DD' string or date."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return f"{day} 00:00:00", f"{day + timedelta(days=1)} 00:00:00"
+
+
+# name -> (sql, sample params, tables that must be read through an index),
+# checked with EXPLAIN by migrations.check_indexes()
+HOT_QUERIES = {
+    "daily_showtimes": (DAILY_SHOWTIMES, day_bounds("2000-01-01") * 2,
+                        ("showtimes", "showtimes_archive")),
+    "monthly_by_day": (MONTHLY_BY_DAY, ("2000-01-01",), ("movie_daily_sales",)),
+    "monthly_by_movie": (MONTHLY_BY_MOVIE, ("2000-01-01",), ("movie_daily_sales",)),
+    "my_bookings": (*keyset_page(MY_BOOKINGS, [("b.user_id = %s", 0)]), ("bookings", "booking_seats")),
+    "all_bookings_page": (*keyset_page(ALL_BOOKINGS, after=("2000-01-01 00:00:00", 0)),
+                          ("showtimes", "bookings")),
+    "browse_showtimes": (*keyset_page(BROWSE_SHOWTIMES, showtime_filters("2000-01-01 00:00:00"),
+                                      ("2000-01-01 00:00:00", 0), newest_first=False),
+                         ("showtimes", "showtime_sales")),
+}
@@ -0,0 +1,213 @@
+"""
+Read/write splitting onto read replicas.
+
+A ReplicatedBackend wraps a primary backend and a list of replicas of it.
+Units of work inside db.read_only() -- the admin listings, reports, export
+and analytics -- go to a healthy replica that is less than MAX_LAG seconds
+behind; everything else goes to the primary: every write, and the reads
+that must see the latest writes, like the seat map right before booking
+or My Bookings right after.
+
+    with db.read_only():
+        report = core.run(core.daily_report(day))
+
+Replication itself is the database's job (MySQL replication, or copies of
+an SQLite file for local testing). A background thread measures it every
+HEARTBEAT_INTERVAL seconds by reading the time stamped into
+replica_heartbeat (migration 9) back from each replica, so a replica's lag
+is how old the newest stamp it has is. Only long-running processes (the
+service, the interactive CLI) stamp the primary, after calling
+stamp_heartbeats(); one-shot scripts just read the lag, and with nothing
+stamping it grows until reads fall back to the primary. A replica that
+cannot be reached is marked down; when none is usable, read-only work falls
+back to the primary and is counted as a fallback.
+
+Every unit of work is timed per route (primary or replica name); stats()
+returns those latencies with each replica's health and lag.
+
+In main.py, set REPLICAS (MySQL) or CINEMA_SQLITE_REPLICAS, per node when
+sharded (see shards.py).
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import backends
+import db
+import shards
+
+HEARTBEAT_INTERVAL = 1.0   # seconds between heartbeat stamps and lag checks
+MAX_LAG = 5.0              # seconds a replica may be behind and still serve reads
+
+STAMP_SQL = "UPDATE replica_heartbeat SET beat_ms = %s WHERE id = 1"
+READ_SQL = "SELECT beat_ms FROM replica_heartbeat WHERE id = 1"
+
+
+class Replica:
+    def __init__(self, name, backend):
+        self.name = name
+        self.backend = backend
+        self.healthy = False      # unknown until the first check
+        self.lag = None           # seconds
+        self.error = None
+        self.checked_at = None
+
+
+class RouteStats:
+    """Thread-safe unit-of-work counts and latencies per route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}   # name -> [calls, errors, total seconds, max seconds]
+        self.fallbacks = 0
+
+    def record(self, name, elapsed, failed):
+        with self._lock:
+            route = self._routes.setdefault(name, [0, 0, 0.0, 0.0])
+            route[0] += 1
+            route[1] += failed
+            route[2] += elapsed
+            route[3] = max(route[3], elapsed)
+
+    def fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {"calls": calls, "errors": errors,
+                           "avg_ms": total / calls * 1000 if calls else 0.0,
+                           "max_ms": longest * 1000}
+                    for name, (calls, errors, total, longest) in self._routes.items()}
+
+
+class ReplicatedBackend(backends.Backend):
+    def __init__(self, primary, replicas, max_lag=MAX_LAG, interval=HEARTBEAT_INTERVAL):
+        if not replicas:
+            raise ValueError("a replicated backend needs at least one replica")
+        if any(r.dialect != primary.dialect for r in replicas.values()):
+            raise ValueError("replicas must use the same kind of database as the primary")
+        self.dialect = primary.dialect
+        self.primary = primary
+        self.replicas = [Replica(name, backend) for name, backend in replicas.items()]
+        self.max_lag = max_lag
+        self.interval = interval
+        self.stamping = False     # see stamp_heartbeats()
+        self.routes = RouteStats()
+        self._turn = itertools.count()
+        self._checker = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        return self.primary.pool
+
+    def init_schema(self):
+        # Replicas receive the schema through replication
+        return self.primary.init_schema()
+
+    def stats(self):
+        return self.primary.stats()
+
+    # ---------------------
+    # Routing
+    # ---------------------
+    def unit_of_work(self, dictionary=False, buffered=True):
+        if db.replica_ok():
+            replica = self._pick()
+            if replica is not None:
+                return self._timed(replica.name, replica.backend, dictionary, buffered)
+            self.routes.fallback()
+        return self._timed("primary", self.primary, dictionary, buffered)
+
+    @contextmanager
+    def _timed(self, name, backend, dictionary, buffered):
+        started = time.perf_counter()
+        failed = True
+        try:
+            with backend.unit_of_work(dictionary=dictionary, buffered=buffered) as cur:
+                yield cur
+            failed = False
+        finally:
+            self.routes.record(name, time.perf_counter() - started, failed)
+
+    def _pick(self):
+        """A healthy replica within max_lag (round robin), or None."""
+        self._start()
+        usable = [r for r in self.replicas
+                  if r.healthy and r.lag is not None and r.lag <= self.max_lag]
+        if not usable:
+            return None
+        return usable[next(self._turn) % len(usable)]
+
+    # ---------------------
+    # Health checks
+    # ---------------------
+    def check(self):
+        """Stamp a heartbeat on the primary (if stamping) and measure every replica's lag."""
+        if self.stamping:
+            try:
+                with self.primary.unit_of_work() as cur:
+                    cur.execute(STAMP_SQL, (int(time.time() * 1000),))
+            except Exception:
+                pass  # the replicas' lag keeps growing, which is the truth
+        for replica in self.replicas:
+            try:
+                with replica.backend.unit_of_work() as cur:
+                    cur.execute(READ_SQL)
+                    row = cur.fetchone()
+                replica.lag = max(0.0, time.time() - row[0] / 1000) if row else None
+                replica.healthy = row is not None
+                replica.error = None if row else "no heartbeat row"
+            except Exception as e:
+                replica.healthy = False
+                replica.error = f"{type(e).__name__}: {e}"
+            replica.checked_at = time.time()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def _start(self):
+        if self._checker is not None:
+            return
+        with self._lock:
+            if self._checker is None:
+                self.check()   # know the replicas before routing the first read
+                self._checker = threading.Thread(target=self._run, name="replica-health", daemon=True)
+                self._checker.start()
+
+    def close(self):
+        self._stop.set()
+
+    def snapshot(self):
+        return {
+            "routes": self.routes.snapshot(),
+            "fallbacks": self.routes.fallbacks,
+            "replicas": [{"name": r.name, "healthy": r.healthy,
+                          "lag_s": None if r.lag is None else round(r.lag, 3), "error": r.error}
+                         for r in self.replicas],
+        }
+
+
+def _replicated():
+    """{node name ("home" when not sharded): backend} for every replicated database."""
+    backend = db.get_backend()
+    if isinstance(backend, shards.ShardedBackend):
+        nodes = {"home": backend.home, **backend.shards}
+    else:
+        nodes = {"home": backend}
+    return {name: node for name, node in nodes.items() if isinstance(node, ReplicatedBackend)}
+
+
+def stamp_heartbeats():
+    """Make this (long-running) process stamp the heartbeat on every replicated primary."""
+    for node in _replicated().values():
+        node.stamping = True
+        node._start()
+
+
+def stats():
+    return {name: node.snapshot() for name, node in _replicated().items()}
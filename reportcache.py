@@ -0,0 +1,199 @@
+"""
+Memoized report results.
+
+Reports for past dates almost never change, so their results are kept --
+in memory and in a JSON file (CACHE_PATH) that survives restarts -- keyed
+by report type and date range.
+
+Every write that can change a report for a show day records it in the
+report_day_versions table, in the writer's own transaction:
+
+    touch(cur, days)   a booking, a new or deleted showtime on those days
+    touch_all(cur)     rollups rebuilt (rollups.rebuild()); every report may differ
+
+A cached entry remembers a hash of the versions of its days, of the "*" row
+bumped by touch_all and of the DATABASE_ID row (a random number migration 11
+puts in every database) when it was computed, and is served again only
+while that stamp is unchanged: one indexed range read instead of the
+report's aggregations, another process's bookings are seen at once, and a
+recreated or different database never matches entries from the old one.
+Ranges that include today change with every booking, so they are not
+stamp-checked at all but recomputed once they are TODAY_TTL seconds old.
+
+    report = core.run(core.daily_report("2025-03-01"))   # cached transparently
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date
+
+import db
+
+CACHE_PATH = os.environ.get("CINEMA_REPORT_CACHE", "report_cache.json")
+TODAY_TTL = 30.0     # seconds a report covering today is served before recomputing
+MAX_ENTRIES = 1000
+ALL_DAYS = "*"       # version row bumped by touch_all()
+DATABASE_ID = "#db"  # version row holding the database's random identity (migration 11)
+OPEN_END = "9999-12-31"
+
+STAMP_SQL = """
+    SELECT day, version
+    FROM report_day_versions
+    WHERE day IN (%s, %s) OR (day >= %s AND day <= %s)
+"""
+
+
+def _stamp(rows):
+    """Hash of the (day, version) rows; unlike a sum, no other versions give the same stamp."""
+    versions = sorted((row["day"], int(row["version"])) for row in rows)
+    return hashlib.sha1(json.dumps(versions).encode()).hexdigest()
+
+
+class ReportCache:
+    def __init__(self, path=CACHE_PATH, today_ttl=TODAY_TTL, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.today_ttl = today_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0          # recomputed because a touched day changed the stamp
+        self.expired = 0        # recomputed because a report covering today aged out
+        self._entries = None    # key -> {"stamp", "computed_at", "result"}; loaded lazily
+        self._lock = threading.Lock()
+
+    # ---------------------
+    # Persistence
+    # ---------------------
+    def _load(self):
+        if self._entries is not None:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        # Write-and-rename so a crash or a concurrent reader never sees half a file
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as out:
+                json.dump(self._entries, out)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # the in-memory cache still works
+
+    # ---------------------
+    # Lookup
+    # ---------------------
+    def get(self, kind, first_day, last_day, compute):
+        """
+        Operation returning the report for [first_day, last_day] ('YYYY-MM-DD';
+        last_day None for an open end), running the operation compute() on a miss.
+        """
+        last_day = last_day or OPEN_END
+        key = f"{kind}:{first_day}:{last_day}"
+        today = date.today().isoformat()
+        covers_today = first_day <= today <= last_day
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is not None and covers_today:
+                if time.time() - entry["computed_at"] <= self.today_ttl:
+                    self.hits += 1
+                    return entry["result"]
+                self.expired += 1
+                entry = None
+
+        stamp = None
+        if not covers_today:
+            # Read the stamp first: a report computed after it is at least as new.
+            # One row per node under db.fan_out() (see shards.py).
+            rows = yield "all", STAMP_SQL, (ALL_DAYS, DATABASE_ID, first_day, last_day)
+            stamp = _stamp(rows)
+            with self._lock:
+                if entry is not None:
+                    if entry["stamp"] == stamp:
+                        self.hits += 1
+                        return entry["result"]
+                    self.stale += 1
+
+        result = yield from compute()
+        # Same shape whether served fresh or from the file (dates become text)
+        result = json.loads(json.dumps(result, default=str))
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = {"stamp": stamp, "computed_at": time.time(), "result": result}
+            if len(self._entries) > self.max_entries:
+                oldest = sorted(self._entries, key=lambda k: self._entries[k]["computed_at"])
+                for old in oldest[:len(self._entries) - self.max_entries]:
+                    del self._entries[old]
+            self._save()
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._save()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups * 100 if lookups else 0.0,
+                "stale": self.stale,
+                "expired": self.expired,
+                "entries": len(self._entries or {}),
+            }
+
+
+_cache = ReportCache()
+
+
+def cached(kind, first_day, last_day, compute):
+    return (yield from _cache.get(kind, first_day, last_day, compute))
+
+
+# =====================
+# Change tracking (call inside the writing transaction)
+# =====================
+def touch(cur, days):
+    """Record that reports for these show days ('YYYY-MM-DD' or datetimes) changed."""
+    days = sorted({str(d)[:10] for d in days})
+    if not days:
+        return
+    if db.get_backend().dialect == "mysql":
+        sql = ("INSERT INTO report_day_versions (day, version) VALUES (%s, 1) "
+               "ON DUPLICATE KEY UPDATE version = version + 1")
+    else:
+        sql = ("INSERT INTO report_day_versions (day, version) VALUES (%s, 1) "
+               "ON CONFLICT(day) DO UPDATE SET version = version + 1")
+    cur.executemany(sql, [(d,) for d in days])
+
+
+def touch_movie(cur, movie_id):
+    """touch() every day the movie has showtimes on, archived ones included, e.g. before deleting it."""
+    cur.execute("SELECT DATE(start_time) FROM showtimes WHERE movie_id = %s "
+                "UNION SELECT DATE(start_time) FROM showtimes_archive WHERE movie_id = %s",
+                (movie_id, movie_id))
+    touch(cur, [next(iter(_values(row))) for row in cur.fetchall()])
+
+
+def touch_all(cur):
+    touch(cur, [ALL_DAYS])
+
+
+def clear():
+    _cache.clear()
+
+
+def stats():
+    return _cache.snapshot()
+
+
+def _values(row):
+    return row.values() if isinstance(row, dict) else row
@@ -0,0 +1,223 @@
+"""
+Seat reservations: hold first, confirm in one short transaction.
+
+    token = hold_seats(user_id, show_id, [("A", 5), ("A", 6)])
+    ...                               # show total, ask the customer
+    booking = confirm(token)          # or release(token)
+
+A hold is a row per seat in seat_holds that expires after HOLD_TTL seconds.
+Both seat_holds and booking_seats are UNIQUE on (showtime_id, seat_row,
+seat_col), so two customers can never hold or book the same seat no matter
+how their requests interleave. Every step is a single db.transaction() and
+is retried if it loses a deadlock; no transaction stays open while a
+customer is deciding.
+
+Booking ids come from the id_sequences table in blocks of ID_BLOCK per
+process, so a booking's id is known before it is written (journal.py relies
+on that). When a booking journal is running, confirm() hands live holds to
+it instead of writing the booking itself.
+
+With a sharded backend (shards.py) holds and bookings are written on the
+showtime's node. Hold tokens start with the showtime id in hex and a "g",
+so release() and confirm() know where to go from the token alone.
+"""
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+import db
+import inventory
+import rollups
+import seatfeed
+
+HOLD_TTL = 300  # seconds a held seat stays reserved without confirmation
+ID_BLOCK = 50   # booking ids reserved per id_sequences round-trip
+
+_journal = None  # set by journal.start()
+
+# Statements of every hold and booking, run prepared where the pool supports it
+NEXT_IDS = db.prepared("UPDATE id_sequences SET next_id = next_id + %s WHERE name = %s")
+LAST_ID = db.prepared("SELECT next_id FROM id_sequences WHERE name = %s")
+CLEAR_EXPIRED = db.prepared("DELETE FROM seat_holds WHERE showtime_id = %s AND expires_at <= %s")
+DROP_HOLD = db.prepared("DELETE FROM seat_holds WHERE hold_token = %s")
+LIVE_HOLD = db.prepared("""
+    SELECT h.user_id, h.showtime_id, h.seat_row, h.seat_col,
+           s.price, s.movie_id, s.start_time
+    FROM seat_holds h
+    JOIN showtimes s ON h.showtime_id = s.id
+    WHERE h.hold_token = %s AND h.expires_at > %s AND h.booking_id IS NULL
+""")
+INSERT_BOOKING = db.prepared("INSERT INTO bookings (id, user_id, showtime_id, total_amount) "
+                             "VALUES (%s, %s, %s, %s)")
+
+
+class SeatUnavailable(Exception):
+    """Some of the requested seats are already booked or held by someone else."""
+
+    def __init__(self, seats):
+        self.seats = list(seats)
+        super().__init__("seat(s) unavailable: " + ", ".join(f"{r}{c}" for r, c in self.seats))
+
+
+class HoldExpired(Exception):
+    """The hold no longer exists (it expired, was released or already confirmed)."""
+
+
+class IdBlocks:
+    """Thread-safe ids from a named id_sequences row, reserved `block` at a time."""
+
+    def __init__(self, name, block=ID_BLOCK):
+        self.name = name
+        self.block = block
+        self._next = self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, cur):
+        cur.execute(NEXT_IDS, (self.block, self.name))
+        cur.execute(LAST_ID, (self.name,))
+        end = cur.fetchone()[0]
+        return end - self.block, end
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._end:
+                # Its own transaction: a rolled-back booking must not give ids back.
+                # Always on the home node, so ids are unique across shards.
+                with db.on_node(None):
+                    self._next, self._end = db.transaction(self._reserve)
+            self._next += 1
+            return self._next - 1
+
+
+_booking_ids = IdBlocks("bookings")
+
+
+def next_booking_id():
+    return _booking_ids.next()
+
+
+def _now():
+    return datetime.now().replace(microsecond=0)
+
+
+def _stamp(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def new_token(showtime_id):
+    """A 32-character hold token naming its showtime, e.g. '1f4g9c0e...'."""
+    prefix = f"{showtime_id:x}g"
+    return prefix + secrets.token_hex(16)[len(prefix):]
+
+
+def showtime_of(token):
+    """The showtime id a hold token was issued for, or None for an old-style token."""
+    prefix, sep, _ = token.partition("g")
+    try:
+        return int(prefix, 16) if sep else None
+    except ValueError:
+        return None
+
+
+def for_hold(token):
+    """db route for the node holding the token's seats (see shards.py)."""
+    return db.for_showtime(showtime_of(token))
+
+
+def _seat_filter(seats):
+    """WHERE fragment + params matching any of the given (row, col) seats."""
+    clause = " OR ".join(["(seat_row = %s AND seat_col = %s)"] * len(seats))
+    params = [v for seat in seats for v in seat]
+    return f"({clause})", params
+
+
+def hold_seats(user_id, showtime_id, seats, ttl=HOLD_TTL):
+    """Reserve seats for ttl seconds and return the hold token."""
+    seats = list(dict.fromkeys(seats))
+    if not seats:
+        raise ValueError("no seats requested")
+    token = new_token(showtime_id)
+    now = _now()
+    expires = _stamp(now + timedelta(seconds=ttl))
+
+    def take(cur):
+        # Expired holds no longer count; clear them before claiming seats
+        cur.execute(CLEAR_EXPIRED, (showtime_id, _stamp(now)))
+
+        where, params = _seat_filter(seats)
+        cur.execute(f"SELECT seat_row, seat_col FROM booking_seats "
+                    f"WHERE showtime_id = %s AND {where}", [showtime_id] + params)
+        taken = cur.fetchall()
+        if taken:
+            raise SeatUnavailable(taken)
+
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(seats))
+        params = [v for r, c in seats for v in (token, user_id, showtime_id, r, c, expires)]
+        cur.execute("INSERT INTO seat_holds "
+                    "(hold_token, user_id, showtime_id, seat_row, seat_col, expires_at) "
+                    f"VALUES {values}", params)
+
+    try:
+        with db.for_showtime(showtime_id, user_id):
+            db.transaction(take)
+    except db.IntegrityError:
+        raise SeatUnavailable(seats) from None
+    return token
+
+
+def release(token):
+    import allocator  # imports this module
+
+    showtime_id = showtime_of(token)
+    with db.for_showtime(showtime_id), db.unit_of_work() as cur:
+        cur.execute(DROP_HOLD, (token,))
+    allocator.invalidate(showtime_id)
+
+
+def confirm(token):
+    """
+    Turn a live hold into a booking. Returns a dict with booking_id,
+    showtime_id, seats and total_amount; raises HoldExpired if the hold is gone.
+    """
+    if _journal is not None:
+        return _journal.confirm(token)
+
+    booking_id = next_booking_id()
+
+    def book(cur):
+        cur.execute(LIVE_HOLD, (token, _stamp(_now())))
+        held = db.named_rows(cur, cur.fetchall())
+        if not held:
+            raise HoldExpired(token)
+
+        first = held[0]
+        user_id, showtime_id, price = first.user_id, first.showtime_id, first.price
+        seats = [(h.seat_row, h.seat_col) for h in held]
+        total_amount = price * len(seats)
+
+        cur.execute(INSERT_BOOKING, (booking_id, user_id, showtime_id, total_amount))
+
+        values = ", ".join(["(%s, %s, %s, %s)"] * len(seats))
+        params = [v for r, c in seats for v in (booking_id, showtime_id, r, c)]
+        cur.execute("INSERT INTO booking_seats (booking_id, showtime_id, seat_row, seat_col) "
+                    f"VALUES {values}", params)
+        cur.execute(DROP_HOLD, (token,))
+        rollups.record_booking(cur, showtime_id, first.movie_id, first.start_time,
+                               len(seats), total_amount)
+        return {"booking_id": booking_id, "showtime_id": showtime_id,
+                "seats": seats, "total_amount": total_amount}
+
+    try:
+        with for_hold(token):
+            booking = db.transaction(book)
+    except db.IntegrityError:
+        # Only possible if the hold expired and someone else booked the seat
+        raise HoldExpired(token) from None
+    inventory.invalidate(booking["showtime_id"])
+    seatfeed.publish(booking["showtime_id"], booking["seats"])
+    return booking
+
+
+def book_seats(user_id, showtime_id, seats):
+    """Hold and immediately confirm, for callers with nothing to ask in between."""
+    return confirm(hold_seats(user_id, showtime_id, seats))
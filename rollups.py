@@ -0,0 +1,98 @@
+"""
+Report rollups maintained alongside bookings.
+
+    showtime_sales     -- bookings, seats sold and revenue per showtime
+    movie_daily_sales  -- the same per (show day, movie); a day's totals are
+                          the sum over its movies
+
+record_booking() runs inside the booking transaction, so the rollups commit
+or roll back together with the booking itself; it also marks the show day
+changed for the report cache (reportcache.touch). rebuild() recomputes both
+tables from bookings/booking_seats, for backfilling an existing database or
+repairing drift, and invalidates every cached report (reportcache.touch_all).
+"""
+from functools import lru_cache
+
+import db
+import reportcache
+
+_INCREMENTS = ("bookings", "seats_sold", "revenue")
+
+
+@lru_cache(maxsize=None)
+def _upsert_sql(dialect, table, keys):
+    cols = list(keys) + list(_INCREMENTS)
+    placeholders = ", ".join(["%s"] * len(cols))
+    if dialect == "mysql":
+        update = ", ".join(f"{c} = {c} + VALUES({c})" for c in _INCREMENTS)
+        sql = (f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({placeholders}) "
+               f"ON DUPLICATE KEY UPDATE {update}")
+    else:
+        update = ", ".join(f"{c} = {c} + excluded.{c}" for c in _INCREMENTS)
+        sql = (f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({placeholders}) "
+               f"ON CONFLICT({', '.join(keys)}) DO UPDATE SET {update}")
+    return db.prepared(sql)
+
+
+def _upsert(cur, table, keys, values):
+    """Insert a rollup row or add `values` to the existing one."""
+    sql = _upsert_sql(db.get_backend().dialect, table, tuple(keys))
+    cur.execute(sql, list(keys.values()) + list(values))
+
+
+def show_day(start_time):
+    """'YYYY-MM-DD' for a showtime start, whether the driver gave a datetime or text."""
+    return str(start_time)[:10]
+
+
+def record_booking(cur, showtime_id, movie_id, start_time, seats, amount, bookings=1):
+    """Add confirmed booking(s) of one showtime to the rollups, using the caller's transaction."""
+    values = (bookings, seats, amount)
+    _upsert(cur, "showtime_sales", {"showtime_id": showtime_id}, values)
+    _upsert(cur, "movie_daily_sales",
+            {"day": show_day(start_time), "movie_id": movie_id}, values)
+    reportcache.touch(cur, [start_time])
+
+
+def rebuild(cur=None):
+    """
+    Recompute every rollup row from the raw booking tables, in the caller's
+    transaction if a cursor is given. Returns the number of showtimes with sales.
+    """
+    if cur is None:
+        with db.unit_of_work() as cur:
+            return rebuild(cur)
+
+    cur.execute("DELETE FROM movie_daily_sales")
+    cur.execute("DELETE FROM showtime_sales")
+    # Count seats per booking first so a booking's total_amount is added
+    # once, not once per seat.
+    cur.execute("""
+        INSERT INTO showtime_sales (showtime_id, bookings, seats_sold, revenue)
+        SELECT b.showtime_id, COUNT(*), COALESCE(SUM(bs.seats), 0), SUM(b.total_amount)
+        FROM bookings b
+        LEFT JOIN (SELECT booking_id, COUNT(*) AS seats
+                   FROM booking_seats GROUP BY booking_id) bs
+               ON bs.booking_id = b.id
+        GROUP BY b.showtime_id
+    """)
+    # Archived showtimes keep their (final) sales in showtime_sales_archive
+    cur.execute("""
+        INSERT INTO movie_daily_sales (day, movie_id, bookings, seats_sold, revenue)
+        SELECT DATE(x.start_time), x.movie_id,
+               SUM(x.bookings), SUM(x.seats_sold), SUM(x.revenue)
+        FROM (
+            SELECT s.start_time, s.movie_id, ss.bookings, ss.seats_sold, ss.revenue
+            FROM showtime_sales ss
+            JOIN showtimes s ON ss.showtime_id = s.id
+            UNION ALL
+            SELECT s.start_time, s.movie_id, ss.bookings, ss.seats_sold, ss.revenue
+            FROM showtime_sales_archive ss
+            JOIN showtimes_archive s ON ss.showtime_id = s.id
+        ) x
+        GROUP BY DATE(x.start_time), x.movie_id
+    """)
+    reportcache.touch_all(cur)
+    cur.execute("SELECT COUNT(*) FROM showtime_sales")
+    return cur.fetchone()[0]
+
@@ -0,0 +1,184 @@
+"""
+Showtime overlap checks.
+
+A show occupies its screen from start_time until start_time + the movie's
+duration_min + CLEANING_BUFFER_MIN. Nothing is cached between checks: each
+one loads only the shows that could reach the new start (one range query
+on the screen's start times) into a ScreenSchedule, which keeps them
+sorted by start with the running maximum of their ends, so "does
+[start, end) overlap anything?" is a bisect plus one comparison even if
+older data already overlaps.
+
+check() and check_batch() first lock the screens involved until the
+caller's transaction ends, so run the insert in that same transaction;
+two admins scheduling the same screen then wait for each other instead of
+both passing the check:
+
+    with db.unit_of_work(dictionary=True) as cur:
+        clash = scheduling.check(cur, duration, screen_id, start)
+        if clash is None:
+            cur.execute("INSERT INTO showtimes ...")
+
+A bulk schedule is checked with check_batch(): one query loads the existing
+shows of every screen involved, then each screen's candidates are walked
+in start order alongside its existing shows (a single sorted sweep), with
+no per-row round-trips.
+"""
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import db
+
+CLEANING_BUFFER_MIN = 15    # minutes between the end of one show and the next start
+DEFAULT_DURATION_MIN = 180  # assumed when a movie has no duration_min
+
+
+def to_datetime(value):
+    """datetime from a DATETIME column (MySQL) or its text form (SQLite/CSV)."""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value)[:19])
+
+
+def end_of(start, duration_min):
+    """When the screen is free again after a show starting at start."""
+    return start + timedelta(minutes=(duration_min or DEFAULT_DURATION_MIN) + CLEANING_BUFFER_MIN)
+
+
+class ScreenSchedule:
+    def __init__(self, intervals=()):
+        # (start, end, label) sorted by start; label names the show in messages
+        self.intervals = sorted(intervals, key=lambda iv: iv[0])
+        self._starts = [iv[0] for iv in self.intervals]
+        self._max_end = []
+        self._reindex(0)
+
+    def _reindex(self, i):
+        del self._max_end[i:]
+        running = self._max_end[i - 1] if i else None
+        for _, end, _ in self.intervals[i:]:
+            running = end if running is None or end > running else running
+            self._max_end.append(running)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def conflict(self, start, end):
+        """Label of a show overlapping [start, end), or None."""
+        i = bisect_left(self._starts, end)  # shows starting before `end`
+        if i == 0 or self._max_end[i - 1] <= start:
+            return None
+        for s, e, label in reversed(self.intervals[:i]):
+            if e > start:
+                return label
+        return None
+
+    def sweep(self, candidates):
+        """
+        Check [(start, end, label), ...] against this schedule and each other
+        in one pass; returns [(label, clashing label or None)] in start order.
+        The schedule itself is left unchanged.
+        """
+        results = []
+        existing = self.intervals
+        j = 0
+        busy_until, busy_label = None, None
+        for start, end, label in sorted(candidates, key=lambda iv: iv[0]):
+            while j < len(existing) and existing[j][0] < start:
+                if busy_until is None or existing[j][1] > busy_until:
+                    busy_until, busy_label = existing[j][1], existing[j][2]
+                j += 1
+            if busy_until is not None and busy_until > start:
+                results.append((label, busy_label))
+            elif j < len(existing) and existing[j][0] < end:
+                results.append((label, existing[j][2]))
+            else:
+                results.append((label, None))
+                if busy_until is None or end > busy_until:
+                    busy_until, busy_label = end, label
+        return results
+
+
+def lock_screens(cur, screen_ids):
+    """Hold the screens' rows until the transaction ends; showtime checks on them queue up."""
+    screen_ids = sorted(set(screen_ids))
+    if not screen_ids:
+        return
+    marks = ", ".join(["%s"] * len(screen_ids))
+    if db.get_backend().dialect == "mysql":
+        cur.execute(f"SELECT id FROM screens WHERE id IN ({marks}) ORDER BY id FOR UPDATE",
+                    screen_ids)
+        cur.fetchall()
+    else:
+        # SQLite has no row locks: a no-op write takes the database's write lock up front
+        cur.execute(f"UPDATE screens SET name = name WHERE id IN ({marks})", screen_ids)
+
+
+def load(cur, screen_ids, first_start, last_start):
+    """
+    {screen_id: ScreenSchedule} of the shows that could overlap anything
+    starting between first_start and last_start.
+    """
+    screen_ids = sorted(set(screen_ids))
+    if not screen_ids:
+        return {}
+    # No show runs longer than the longest movie, so nothing starting earlier can overlap
+    cur.execute("SELECT MAX(duration_min) FROM movies")
+    longest = next(iter(_values(cur.fetchone()))) or 0
+    reach = timedelta(minutes=max(longest, DEFAULT_DURATION_MIN) + CLEANING_BUFFER_MIN)
+    marks = ", ".join(["%s"] * len(screen_ids))
+    cur.execute(f"""
+        SELECT s.id, s.screen_id, s.start_time, m.duration_min
+        FROM showtimes s
+        JOIN movies m ON s.movie_id = m.id
+        WHERE s.screen_id IN ({marks}) AND s.start_time >= %s AND s.start_time < %s
+        ORDER BY s.screen_id, s.start_time
+    """, (*screen_ids, _stamp(first_start - reach), _stamp(last_start + reach)))
+    by_screen = {screen_id: [] for screen_id in screen_ids}
+    for show_id, screen_id, start, duration in map(_values, cur.fetchall()):
+        start = to_datetime(start)
+        by_screen[screen_id].append((start, end_of(start, duration), f"showtime #{show_id}"))
+    return {screen_id: ScreenSchedule(ivs) for screen_id, ivs in by_screen.items()}
+
+
+def check(cur, movie_duration, screen_id, start):
+    """
+    Label of the show a new one on screen_id at start would overlap, or None.
+    Locks the screen (lock_screens) for the rest of the caller's transaction.
+    """
+    start = to_datetime(start)
+    lock_screens(cur, [screen_id])
+    schedule = load(cur, [screen_id], start, start)[screen_id]
+    return schedule.conflict(start, end_of(start, movie_duration))
+
+
+def check_batch(cur, rows, durations):
+    """
+    rows are (key, screen_id, start) for new shows, durations maps key ->
+    duration_min. Returns {key: clash} for every row that overlaps an existing
+    show (clash is its "showtime #id" label) or an earlier-starting row of the
+    batch (clash is that row's key); other rows are free to insert together
+    in the same transaction, which keeps the screens locked (lock_screens).
+    """
+    if not rows:
+        return {}
+    starts = [to_datetime(start) for _, _, start in rows]
+    lock_screens(cur, [screen_id for _, screen_id, _ in rows])
+    schedules = load(cur, [screen_id for _, screen_id, _ in rows], min(starts), max(starts))
+    candidates = {}
+    for (key, screen_id, _), start in zip(rows, starts):
+        candidates.setdefault(screen_id, []).append((start, end_of(start, durations[key]), key))
+    clashes = {}
+    for screen_id, items in candidates.items():
+        for key, other in schedules[screen_id].sweep(items):
+            if other is not None:
+                clashes[key] = other
+    return clashes
+
+
+def _values(row):
+    return row.values() if isinstance(row, dict) else row
+
+
+def _stamp(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,140 @@
+"""
+Table definitions shared by every storage backend.
+
+The DDL is written once with a few dialect placeholders ({pk}, {engine}, ...)
+which each backend fills in from DIALECTS, so MySQL and SQLite always carry
+the same tables, columns and constraints.
+"""
+
+DIALECTS = {
+    "mysql": {
+        "pk": "INT AUTO_INCREMENT PRIMARY KEY",
+        "engine": " ENGINE=InnoDB",
+        "binary": "VARBINARY(60)",
+        "role": "ENUM('user','admin','staff')",
+    },
+    "sqlite": {
+        "pk": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "engine": "",
+        "binary": "BLOB",
+        "role": "VARCHAR(10) CHECK (role IN ('user','admin','staff'))",
+    },
+}
+
+TABLES = [
+    # Users
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id {pk},
+        username VARCHAR(100) UNIQUE NOT NULL,
+        password_hash {binary} NOT NULL,
+        role {role} DEFAULT 'user',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ){engine}
+    """,
+    # Movies
+    """
+    CREATE TABLE IF NOT EXISTS movies (
+        id {pk},
+        title VARCHAR(255) NOT NULL,
+        description TEXT,
+        duration_min INT,
+        rating VARCHAR(20),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ){engine}
+    """,
+    # Screens
+    """
+    CREATE TABLE IF NOT EXISTS screens (
+        id {pk},
+        name VARCHAR(100) NOT NULL,
+        total_rows INT NOT NULL,
+        total_cols INT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ){engine}
+    """,
+    # Showtimes
+    """
+    CREATE TABLE IF NOT EXISTS showtimes (
+        id {pk},
+        movie_id INT NOT NULL,
+        screen_id INT NOT NULL,
+        start_time DATETIME NOT NULL,
+        price DECIMAL(10,2) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(screen_id, start_time),
+        FOREIGN KEY(movie_id) REFERENCES movies(id) ON DELETE CASCADE,
+        FOREIGN KEY(screen_id) REFERENCES screens(id) ON DELETE CASCADE
+    ){engine}
+    """,
+    # Bookings (transaction-level)
+    """
+    CREATE TABLE IF NOT EXISTS bookings (
+        id {pk},
+        user_id INT NOT NULL,
+        showtime_id INT NOT NULL,
+        total_amount DECIMAL(10,2) NOT NULL,
+        booked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(showtime_id) REFERENCES showtimes(id) ON DELETE CASCADE
+    ){engine}
+    """,
+    # Booking Seats (individual seats inside a booking). The showtime is
+    # repeated here so the database itself rejects a second booking of a seat.
+    """
+    CREATE TABLE IF NOT EXISTS booking_seats (
+        id {pk},
+        booking_id INT NOT NULL,
+        showtime_id INT NOT NULL,
+        seat_row VARCHAR(5) NOT NULL,
+        seat_col INT NOT NULL,
+        UNIQUE(showtime_id, seat_row, seat_col),
+        FOREIGN KEY(booking_id) REFERENCES bookings(id) ON DELETE CASCADE,
+        FOREIGN KEY(showtime_id) REFERENCES showtimes(id) ON DELETE CASCADE
+    ){engine}
+    """,
+    # Seat Holds (short-lived reservations taken before a booking is confirmed)
+    """
+    CREATE TABLE IF NOT EXISTS seat_holds (
+        id {pk},
+        hold_token CHAR(32) NOT NULL,
+        user_id INT NOT NULL,
+        showtime_id INT NOT NULL,
+        seat_row VARCHAR(5) NOT NULL,
+        seat_col INT NOT NULL,
+        expires_at DATETIME NOT NULL,
+        UNIQUE(showtime_id, seat_row, seat_col),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(showtime_id) REFERENCES showtimes(id) ON DELETE CASCADE
+    ){engine}
+    """,
+    # Showtime Sales (report rollup: one row per showtime with bookings)
+    """
+    CREATE TABLE IF NOT EXISTS showtime_sales (
+        showtime_id INT PRIMARY KEY,
+        bookings INT NOT NULL DEFAULT 0,
+        seats_sold INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+        FOREIGN KEY(showtime_id) REFERENCES showtimes(id) ON DELETE CASCADE
+    ){engine}
+    """,
+    # Movie Daily Sales (report rollup: per show day and movie; summing over
+    # movies gives the day's totals)
+    """
+    CREATE TABLE IF NOT EXISTS movie_daily_sales (
+        day DATE NOT NULL,
+        movie_id INT NOT NULL,
+        bookings INT NOT NULL DEFAULT 0,
+        seats_sold INT NOT NULL DEFAULT 0,
+        revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, movie_id),
+        FOREIGN KEY(movie_id) REFERENCES movies(id) ON DELETE CASCADE
+    ){engine}
+    """,
+]
+
+
+def render(dialect):
+    """Return the CREATE TABLE statements for one dialect."""
+    tokens = DIALECTS[dialect]
+    return [ddl.format(**tokens) for ddl in TABLES]
@@ -0,0 +1,218 @@
+"""
+Per-showtime seat change feed.
+
+Every booking commit publishes the seats it took to its showtime's feed
+(reservations.confirm() and the journal writer call publish()), bumping
+the showtime's version. A client that has drawn the seat map at version V
+asks for what changed since V and gets only those seats -- or waits, as an
+asyncio coroutine, until a booking arrives -- so thousands of viewers of a
+hot show cost no queries at all between bookings.
+
+    delta = await seatfeed.changes(showtime_id, since=version, timeout=25)
+    # {"version": 1712..., "seats": [("A", 5), ...]}  or  {"version": ..., "resync": True}
+
+Versions start from the wall clock in milliseconds when a feed is created,
+so they keep increasing across restarts. Each feed keeps the last HISTORY
+changes; a client further behind than that (or whose version comes from an
+earlier process) is told to resync: fetch the full map and the version
+afresh.
+
+The feed itself is per process and only hears of bookings committed here.
+To catch the others it also tracks the showtime's seats sold: reconcile()
+takes the database's count (showtime_sales.seats_sold), read when a version
+is handed out and, at most every RECHECK_AFTER seconds, when a wait ends
+with nothing new (check_due()). A count that moved without a publish()
+bumps the version with no delta, so every client behind it resyncs.
+
+    if seatfeed.check_due(showtime_id):
+        seatfeed.reconcile(showtime_id, sold)
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+import inventory
+
+HISTORY = 512         # changes kept per showtime
+MAX_FEEDS = 4096      # showtimes with a feed; idle ones are dropped first
+WAIT_TIMEOUT = 25.0   # seconds a subscriber waits for a change
+RECHECK_AFTER = 5.0   # seconds between database checks of a showtime's seats sold
+
+
+class ShowFeed:
+    def __init__(self):
+        self.version = int(time.time() * 1000)
+        self.floor = self.version   # no deltas are kept for versions up to here
+        self.changes = deque()      # (version, seats)
+        self.waiters = set()        # asyncio futures of blocked subscribers
+        self.sold = None            # seats sold as of version, once reconcile() has run
+        self.checked_at = 0.0       # time.monotonic() of the last database check
+
+    def since(self, version):
+        """{"version", "seats"} changed after version, or {"version", "resync": True}."""
+        if version is None or version < self.floor or version > self.version:
+            return {"version": self.version, "resync": True}
+        seats = []
+        for v, changed in reversed(self.changes):
+            if v <= version:
+                break
+            seats[:0] = changed
+        return {"version": self.version, "seats": seats}
+
+
+class SeatFeed:
+    def __init__(self, history=HISTORY, max_feeds=MAX_FEEDS):
+        self.history = history
+        self.max_feeds = max_feeds
+        self.published = 0
+        self.delivered = 0
+        self.resyncs = 0
+        self.missed = 0               # changes found in the database, not published here
+        self._feeds = OrderedDict()   # showtime id -> ShowFeed
+        self._lock = threading.Lock()
+
+    def _feed(self, showtime_id):
+        feed = self._feeds.get(showtime_id)
+        if feed is None:
+            feed = self._feeds[showtime_id] = ShowFeed()
+            if len(self._feeds) > self.max_feeds:
+                idle = [s for s, f in self._feeds.items() if not f.waiters and s != showtime_id]
+                for s in idle[:len(self._feeds) - self.max_feeds]:
+                    del self._feeds[s]
+        self._feeds.move_to_end(showtime_id)
+        return feed
+
+    def publish(self, showtime_id, seats):
+        """Record booked seats; safe to call from any thread."""
+        seats = [tuple(seat) for seat in seats]
+        if not seats:
+            return
+        with self._lock:
+            feed = self._feed(showtime_id)
+            feed.version += 1
+            feed.changes.append((feed.version, seats))
+            while len(feed.changes) > self.history:
+                feed.floor = feed.changes.popleft()[0]
+            if feed.sold is not None:
+                feed.sold += len(seats)
+            waiters, feed.waiters = feed.waiters, set()
+            self.published += 1
+        _wake_all(waiters)
+
+    def check_due(self, showtime_id):
+        """
+        Whether the showtime's seats sold should be read and passed to
+        reconcile(); claims the check, so concurrent callers get False.
+        """
+        now = time.monotonic()
+        with self._lock:
+            feed = self._feed(showtime_id)
+            if now - feed.checked_at < RECHECK_AFTER:
+                return False
+            feed.checked_at = now
+            return True
+
+    def reconcile(self, showtime_id, sold):
+        """
+        Compare the database's seats sold with what this feed has seen; if
+        another process changed them, clients behind the returned version
+        must resync. Returns the current version.
+        """
+        with self._lock:
+            feed = self._feed(showtime_id)
+            feed.checked_at = time.monotonic()
+            missed = feed.sold is not None and feed.sold != sold
+            waiters = ()
+            if missed:
+                # No deltas for those seats: move the floor past every version handed out
+                feed.version += 1
+                feed.floor = feed.version
+                feed.changes.clear()
+                waiters, feed.waiters = feed.waiters, set()
+                self.missed += 1
+            feed.sold = sold
+            version = feed.version
+        if missed:
+            inventory.invalidate(showtime_id)  # the cached map missed them too
+            _wake_all(waiters)
+        return version
+
+    def version(self, showtime_id):
+        with self._lock:
+            return self._feed(showtime_id).version
+
+    async def changes(self, showtime_id, since, timeout=WAIT_TIMEOUT):
+        """Seats booked after version `since`, waiting up to timeout for the first."""
+        import asyncio  # only the service waits; bookings just publish
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            feed = self._feed(showtime_id)
+            result = feed.since(since)
+            if result.get("resync") or result["seats"] or timeout <= 0:
+                self._count(result)
+                return result
+            # Registered under the lock, so a publish can't slip in unseen
+            feed.waiters.add(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._lock:
+            feed.waiters.discard(future)
+            result = feed.since(since)
+            self._count(result)
+            return result
+
+    def _count(self, result):
+        if result.get("resync"):
+            self.resyncs += 1
+        elif result["seats"]:
+            self.delivered += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "feeds": len(self._feeds),
+                "subscribers": sum(len(f.waiters) for f in self._feeds.values()),
+                "published": self.published,
+                "delivered": self.delivered,
+                "resyncs": self.resyncs,
+                "missed": self.missed,
+            }
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _wake_all(waiters):
+    for future in waiters:
+        future.get_loop().call_soon_threadsafe(_wake, future)
+
+
+_feed = SeatFeed()
+
+
+def publish(showtime_id, seats):
+    _feed.publish(showtime_id, seats)
+
+
+def version(showtime_id):
+    return _feed.version(showtime_id)
+
+
+def check_due(showtime_id):
+    return _feed.check_due(showtime_id)
+
+
+def reconcile(showtime_id, sold):
+    return _feed.reconcile(showtime_id, sold)
+
+
+async def changes(showtime_id, since, timeout=WAIT_TIMEOUT):
+    return await _feed.changes(showtime_id, since, timeout)
+
+
+def stats():
+    return _feed.snapshot()
@@ -0,0 +1,434 @@
+"""
+Async HTTP/JSON booking service.
+
+One asyncio process serves many concurrent clients: reads go through an
+async connection pool (aiodb), so a slow query parks a coroutine rather than
+a thread, and keep-alive connections cost a few KB each. Bookings run the
+same reservations code as the CLI on worker threads, bounded by the
+blocking pool.
+
+    python service.py --host 0.0.0.0 --port 8080
+
+Endpoints (all JSON; * needs "Authorization: Bearer <token>" from POST /sessions):
+
+    POST   /users                  {"username", "password"}
+    POST   /sessions               {"username", "password"} -> {"token", "user", "expires"}
+    DELETE /sessions             *
+    GET    /movies
+    GET    /showtimes
+    GET    /showtimes/search       ?movie_id=&title=&screen_id=&from=&to=&min_price=&max_price=
+                                   &available=1 (hide sold out) -> upcoming, with seats remaining
+    GET    /showtimes/<id>/seats
+    GET    /showtimes/<id>/seats/changes   ?since=<version>&wait=25 -> seats booked since then
+    POST   /bookings             * {"showtime_id", "seats": ["A5", ...]} or {"showtime_id", "count": 3}
+    GET    /me/bookings          * ?after_time=...&after_id=... for the next page
+    GET    /reports/daily        * admin; ?date=YYYY-MM-DD
+    GET    /reports/monthly      * admin; ?days=30
+    GET    /health
+
+The HTTP layer is a small HTTP/1.1 reader on asyncio streams (Content-Length
+bodies, keep-alive), which is all a JSON API behind a proxy needs and keeps
+the service free of extra dependencies.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import traceback
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import parse_qsl, urlsplit
+
+import aiodb
+import auth
+import catalog
+import core
+import db
+import journal
+import queries
+import replicas
+import reservations
+import seatfeed
+
+MAX_HEADER = 16 * 1024
+MAX_BODY = 64 * 1024
+IDLE_TIMEOUT = 30.0  # seconds a keep-alive connection may sit idle
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized",
+           403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode()
+    raise TypeError(f"not JSON serializable: {type(value).__name__}")
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be an integer") from None
+
+
+def _number(value, name):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be a number") from None
+
+
+def _day(value, name):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be YYYY-MM-DD") from None
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = dict(parse_qsl(url.query))
+        self.headers = headers
+        self.body = body
+
+    @property
+    def token(self):
+        scheme, _, token = self.headers.get("authorization", "").partition(" ")
+        return token.strip() if scheme.lower() == "bearer" else None
+
+
+# =====================
+# Handlers
+# =====================
+class Service:
+    def __init__(self, pool):
+        self.pool = pool
+        self.routes = [
+            ("POST", re.compile(r"^/users$"), self.register),
+            ("POST", re.compile(r"^/sessions$"), self.login),
+            ("DELETE", re.compile(r"^/sessions$"), self.logout),
+            ("GET", re.compile(r"^/movies$"), self.movies),
+            ("GET", re.compile(r"^/showtimes$"), self.showtimes),
+            ("GET", re.compile(r"^/showtimes/search$"), self.search_showtimes),
+            ("GET", re.compile(r"^/showtimes/(\d+)/seats$"), self.seats),
+            ("GET", re.compile(r"^/showtimes/(\d+)/seats/changes$"), self.seat_changes),
+            ("POST", re.compile(r"^/bookings$"), self.book),
+            ("GET", re.compile(r"^/me/bookings$"), self.my_bookings),
+            ("GET", re.compile(r"^/reports/daily$"), self.daily_report),
+            ("GET", re.compile(r"^/reports/monthly$"), self.monthly_report),
+            ("GET", re.compile(r"^/health$"), self.health),
+        ]
+
+    async def _user(self, req, role=None):
+        """The session's user; 401 without a valid token, 403 without the role."""
+        user = await self.pool.run(auth.authenticate(req.token)) if req.token else None
+        if user is None:
+            raise HTTPError(401, "log in first (Authorization: Bearer <token>)")
+        if role and user["role"] != role:
+            raise HTTPError(403, f"{role} only")
+        return user
+
+    async def register(self, req):
+        username = str(req.body.get("username", "")).strip()
+        password = str(req.body.get("password", ""))
+        if not username or not password:
+            raise HTTPError(400, "username and password are required")
+        try:
+            await auth.aregister(self.pool, username, password)
+        except db.IntegrityError:
+            raise HTTPError(409, "username already exists") from None
+        return 201, {"username": username, "role": "user"}
+
+    async def login(self, req):
+        session = await auth.alogin(self.pool, str(req.body.get("username", "")),
+                                    str(req.body.get("password", "")))
+        if session is None:
+            raise HTTPError(401, "invalid username or password")
+        return 201, session
+
+    async def logout(self, req):
+        await self._user(req)
+        auth.logout(req.token)
+        return 200, {"status": "logged out"}
+
+    async def movies(self, req):
+        return 200, await self.pool.run(core.movies())
+
+    async def showtimes(self, req):
+        return 200, await self.pool.run(core.showtimes())
+
+    async def search_showtimes(self, req):
+        q = req.query
+        filters = {
+            "movie_id": _int(q["movie_id"], "movie_id") if "movie_id" in q else None,
+            "title": q.get("title") or None,
+            "screen_id": _int(q["screen_id"], "screen_id") if "screen_id" in q else None,
+            "date_from": _day(q["from"], "from") if "from" in q else None,
+            "date_to": _day(q["to"], "to") if "to" in q else None,
+            "min_price": _number(q["min_price"], "min_price") if "min_price" in q else None,
+            "max_price": _number(q["max_price"], "max_price") if "max_price" in q else None,
+            "hide_sold_out": q.get("available") == "1",
+        }
+        after = None
+        if "after_time" in q:
+            after = (q["after_time"], _int(q.get("after_id"), "after_id"))
+        # Seat counts a few seconds stale are fine for browsing; booking checks the seat map
+        with db.fan_out(), db.read_only():
+            rows = await self.pool.run(core.browse_showtimes(after=after, **filters))
+        page = {"showtimes": rows, "next": None}
+        if len(rows) == queries.PAGE_SIZE:
+            last = rows[-1]
+            page["next"] = {"after_time": str(last["start_time"]), "after_id": last["id"]}
+        return 200, page
+
+    async def seats(self, req, showtime_id):
+        with db.for_showtime(int(showtime_id)):
+            inv = await self.pool.run(core.seat_map(int(showtime_id)))
+        if inv is None:
+            raise HTTPError(404, "showtime not found")
+        return 200, core.describe_seats(inv)
+
+    async def seat_changes(self, req, showtime_id):
+        """
+        Long poll: seats booked after ?since=<version>, waiting up to ?wait
+        seconds for the first. Without since, or too far behind, the reply
+        is the full map ("resync": true) with the version to continue from.
+        """
+        showtime_id = int(showtime_id)
+        since = _int(req.query["since"], "since") if "since" in req.query else None
+        wait = min(max(_int(req.query.get("wait", seatfeed.WAIT_TIMEOUT), "wait"), 0),
+                   seatfeed.WAIT_TIMEOUT)
+        delta = await seatfeed.changes(showtime_id, since, wait) if since is not None else None
+        if delta is not None and not delta.get("resync"):
+            # Nothing booked here: now and then make sure no other process booked either
+            if delta["seats"] or not seatfeed.check_due(showtime_id) \
+                    or await self._reconcile(showtime_id) == delta["version"]:
+                return 200, {"version": delta["version"],
+                             "booked": [f"{r}{c}" for r, c in delta["seats"]]}
+        # Version first: anything booked while the map loads comes again as a delta
+        version = await self._reconcile(showtime_id)
+        with db.for_showtime(showtime_id):
+            inv = await self.pool.run(core.seat_map(showtime_id))
+        if inv is None:
+            raise HTTPError(404, "showtime not found")
+        return 200, {"version": version, "resync": True, **core.describe_seats(inv)}
+
+    async def _reconcile(self, showtime_id):
+        """The seat feed's version once its seats sold are checked against the database."""
+        with db.for_showtime(showtime_id):
+            sold = await self.pool.run(core.seats_sold(showtime_id))
+        return seatfeed.reconcile(showtime_id, sold)
+
+    async def book(self, req):
+        user = await self._user(req)
+        body = req.body
+        showtime_id = _int(body.get("showtime_id"), "showtime_id")
+        seats, count = None, None
+        if "seats" in body:
+            if not isinstance(body["seats"], list) or not body["seats"]:
+                raise HTTPError(400, "seats must be a non-empty list like [\"A5\", \"A6\"]")
+            try:
+                seats = [core.parse_seat(str(s)) for s in body["seats"]]
+            except ValueError as e:
+                raise HTTPError(400, str(e)) from None
+        else:
+            count = _int(body.get("count"), "count")
+            if count <= 0:
+                raise HTTPError(400, "count must be positive")
+        try:
+            booking = await asyncio.to_thread(core.book, user["id"], showtime_id, seats, count)
+        except ValueError as e:
+            raise HTTPError(400, str(e)) from None
+        except reservations.SeatUnavailable as e:
+            raise HTTPError(409, str(e) if e.seats else "not enough seats left") from None
+        except reservations.HoldExpired:
+            raise HTTPError(409, "seat hold expired") from None
+        except db.IntegrityError as e:
+            raise HTTPError(400, f"rejected by the database: {e}") from None
+        booking["seats"] = [f"{r}{c}" for r, c in booking["seats"]]
+        return 201, booking
+
+    async def my_bookings(self, req):
+        user = await self._user(req)
+        after = None
+        if "after_time" in req.query:
+            after = (req.query["after_time"], _int(req.query.get("after_id"), "after_id"))
+        with db.fan_out():
+            rows = await self.pool.run(core.my_bookings(user["id"], after))
+        page = {"bookings": rows, "next": None}
+        if len(rows) == queries.PAGE_SIZE:
+            last = rows[-1]
+            page["next"] = {"after_time": str(last["start_time"]), "after_id": last["booking_id"]}
+        return 200, page
+
+    async def daily_report(self, req):
+        await self._user(req, role="admin")
+        day = req.query.get("date")
+        if day:
+            try:
+                date.fromisoformat(day)
+            except ValueError:
+                raise HTTPError(400, "date must be YYYY-MM-DD") from None
+        with db.fan_out(), db.read_only():
+            return 200, await self.pool.run(core.daily_report(day))
+
+    async def monthly_report(self, req):
+        await self._user(req, role="admin")
+        days = _int(req.query.get("days", 30), "days")
+        with db.fan_out(), db.read_only():
+            return 200, await self.pool.run(core.monthly_report(days))
+
+    async def health(self, req):
+        return 200, {"status": "ok", "pool": self.pool.stats.snapshot(),
+                     "catalog": catalog.stats(), "sessions": auth.session_stats(),
+                     "journal": journal.stats(), "seat_feed": seatfeed.stats(),
+                     "replicas": replicas.stats()}
+
+    async def dispatch(self, req):
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(req.path)
+            if not match:
+                continue
+            if route_method != req.method:
+                allowed = True
+                continue
+            return await handler(req, *match.groups())
+        raise HTTPError(405 if allowed else 404,
+                        "method not allowed" if allowed else "not found")
+
+    # =====================
+    # HTTP/1.1
+    # =====================
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 413, {"error": "headers too large"}, False)
+                    return
+
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request line"}, False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and version == "HTTP/1.1")
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad Content-Length"}, False)
+                    return
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": "body too large"}, False)
+                    return
+                raw = await reader.readexactly(length) if length else b""
+
+                try:
+                    body = json.loads(raw) if raw else {}
+                    if not isinstance(body, dict):
+                        raise HTTPError(400, "body must be a JSON object")
+                    req = Request(method.upper(), target, headers, body)
+                    status, payload = await self.dispatch(req)
+                except json.JSONDecodeError:
+                    status, payload = 400, {"error": "invalid JSON body"}
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except db.PoolTimeout:
+                    status, payload = 503, {"error": "database busy, try again"}
+                except db.Rebalancing:
+                    status, payload = 503, {"error": "this show's bookings are being moved, try again shortly"}
+                except auth.AuthBusy:
+                    status, payload = 503, {"error": "too many logins in progress, try again"}
+                except Exception:
+                    # Details stay in the server log: driver errors can quote SQL and data
+                    print(f"⚠️ {method} {target} failed:", file=sys.stderr)
+                    traceback.print_exc()
+                    status, payload = 500, {"error": "internal error"}
+
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload, default=_json_default, ensure_ascii=False).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+
+async def serve(backend, host="127.0.0.1", port=8080):
+    pool = aiodb.for_backend(backend)
+    await pool.open()
+    service = Service(pool)
+    server = await asyncio.start_server(service.handle, host, port, limit=MAX_HEADER,
+                                        backlog=1024)
+    print(f"🌐 Serving on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await pool.close()
+
+
+def main():
+    import main as app
+
+    parser = argparse.ArgumentParser(description="Cinema booking HTTP/JSON service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    backend = app.make_backend()
+    db.configure(backend)
+    app.init_db()
+    replicas.stamp_heartbeats()
+    if app.JOURNAL_PATH:
+        try:
+            journal.start(app.JOURNAL_PATH)
+        except journal.JournalBusy as e:
+            print(f"⚠️ {e}; bookings are confirmed directly.")
+    try:
+        asyncio.run(serve(backend, args.host, args.port))
+    except KeyboardInterrupt:
+        print("👋 Service stopped.")
+
+
+if __name__ == "__main__":
+    main()
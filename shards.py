@@ -0,0 +1,615 @@
+"""
+Horizontal sharding of bookings across several databases.
+
+The home node -- the database main.py has always used -- keeps the catalog
+(movies, screens, showtimes), users, sessions and the id sequences. Every
+screen is mapped to one shard node in the shard_map table (migration 8), and
+the seat holds, bookings, booking seats and sales rollups of that screen's
+showtimes live there, so seat writes for different cinemas land on
+different primaries.
+
+Work is routed by context (see db.for_showtime() and friends):
+
+    with db.for_showtime(show_id):   # hold_seats(), confirm(), the seat inventory route themselves
+        ...
+    with db.fan_out():               # listings and reports: every node, rows concatenated
+        rows = core.run(core.bookings_page(queries.ALL_BOOKINGS))
+
+Shards carry a copy of the catalog so their bookings keep their foreign keys
+and joins. It is synced from home whenever the catalog version has moved
+(checked at most every SYNC_INTERVAL seconds, and at once after an edit in
+this process or a showtime not seen before), and a user is copied to a
+shard the first time they book there. Fanned-out reads return every node's
+rows; core.py merges them (sums per show or day, re-sorted pages).
+
+A screen without a mapping goes to the shard with the fewest screens the
+first time one of its shows is booked. Moving screens between nodes:
+
+    python shards.py status
+    python shards.py move 3 west       # screen 3's bookings -> node west
+    python shards.py rebalance         # plan moves that even out bookings
+    python shards.py rebalance --apply # ... and run them
+
+While a screen moves its bookings are refused with db.Rebalancing (other
+processes see the mark within MAP_TTL seconds). Its hot rows are copied to
+the new node, deleted from the old one, the rollups of both are rebuilt and
+the map flips. A move that was interrupted is finished by running it again.
+Archived bookings stay on the node that archived them: reports read every
+node anyway.
+
+Turning sharding on for a database that already has bookings moves them:
+before the first routed unit of work (and in init_schema()) each process
+checks home for hot bookings and seat holds, maps their screens and moves
+the rows to those screens' nodes like move() does.
+"""
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import backends
+import catalog
+import db
+import inventory
+import rollups
+
+SYNC_INTERVAL = 2.0   # seconds between catalog version checks
+MAP_TTL = 2.0         # seconds a process keeps using its copy of shard_map
+CHUNK_SIZE = 500      # showtime ids per statement when moving a screen
+
+CATALOG_TABLES = ("movies", "screens", "showtimes")   # parents first
+
+# Hot rows that follow a screen to its node, keyed by showtime_id; parents
+# first. booking_seats ids are node-local and are assigned afresh.
+MOVED_TABLES = [
+    ("bookings", ("id", "user_id", "showtime_id", "total_amount", "booked_at")),
+    ("booking_seats", ("booking_id", "showtime_id", "seat_row", "seat_col")),
+    ("seat_holds", ("hold_token", "user_id", "showtime_id", "seat_row", "seat_col", "expires_at",
+                    "booking_id")),
+    ("showtime_sales", ("showtime_id", "bookings", "seats_sold", "revenue")),
+]
+
+
+def _marks(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class FanOutCursor:
+    """Runs each statement on every node's cursor; fetches walk their results in node order."""
+
+    def __init__(self, cursors):
+        self._cursors = cursors
+        self._pending = []
+
+    def execute(self, sql, params=()):
+        for cur in self._cursors:
+            cur.execute(sql, params)
+        self._pending = list(self._cursors)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        for cur in self._cursors:
+            cur.executemany(sql, seq_of_params)
+        self._pending = []
+
+    def fetchone(self):
+        while self._pending:
+            row = self._pending[0].fetchone()
+            if row is not None:
+                return row
+            self._pending.pop(0)
+        return None
+
+    def fetchall(self):
+        rows = []
+        for cur in self._pending:
+            rows.extend(cur.fetchall())
+        self._pending = []
+        return rows
+
+    def fetchmany(self, size=1):
+        rows = []
+        while self._pending and len(rows) < size:
+            batch = self._pending[0].fetchmany(size - len(rows))
+            if not batch:
+                self._pending.pop(0)
+            rows.extend(batch)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    @property
+    def rowcount(self):
+        return sum(max(cur.rowcount, 0) for cur in self._cursors)
+
+    @property
+    def description(self):
+        return self._cursors[0].description
+
+    @property
+    def lastrowid(self):
+        return None
+
+
+class _Replica:
+    """What a shard is known to hold of the home node's catalog and users."""
+
+    def __init__(self):
+        self.version = None     # catalog version last synced by this process
+        self.users = set()      # user ids known to be there
+        self.lock = threading.Lock()
+
+
+class ShardedBackend(backends.Backend):
+    """
+    A home backend plus named shard backends (all of one dialect), routed
+    per unit of work by db.current_route().
+    """
+
+    def __init__(self, home, shards):
+        if not shards:
+            raise ValueError("a sharded backend needs at least one shard node")
+        if None in shards:
+            raise ValueError("shard nodes need names")
+        dialects = {home.dialect} | {node.dialect for node in shards.values()}
+        if len(dialects) > 1:
+            raise ValueError("all nodes must use the same kind of database")
+        self.dialect = home.dialect
+        self.home = home
+        self.shards = dict(shards)
+        self._replicas = {name: _Replica() for name in self.shards}
+        self._screens = {}          # showtime id -> screen id
+        self._map = {}              # screen id -> (node, moving_to)
+        self._map_loaded = 0.0
+        self._version = None        # home catalog version
+        self._checked_at = 0.0
+        self._invalidations = None
+        self._lock = threading.Lock()
+        self._adopted = False       # home checked for bookings from before sharding
+        self._adopt_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        return self.home.pool
+
+    def init_schema(self):
+        applied = self.home.init_schema()
+        for node in self.shards.values():
+            node.init_schema()
+        self._adopt_home()
+        return applied
+
+    def node(self, name):
+        """The backend of a node by name; None is home."""
+        return self.home if name is None else self.shards[name]
+
+    def _adopt_home(self):
+        """Move hot bookings left on home (from before sharding) to their screens' nodes."""
+        if self._adopted:
+            return
+        with self._adopt_lock:
+            if self._adopted:
+                return
+            with self.home.unit_of_work() as cur:
+                cur.execute("""
+                    SELECT DISTINCT s.screen_id FROM showtimes s
+                    WHERE s.id IN (SELECT showtime_id FROM bookings
+                                   UNION SELECT showtime_id FROM seat_holds)
+                """)
+                screens = [row[0] for row in cur.fetchall()]
+            targets = set()
+            for screen_id in screens:
+                target, _ = self.map_entry(screen_id)
+                with self.home.unit_of_work() as cur:
+                    cur.execute("SELECT id FROM showtimes WHERE screen_id = %s", (screen_id,))
+                    ids = [row[0] for row in cur.fetchall()]
+                _transfer(self, ids, None, target)
+                targets.add(target)
+            for name in ([None, *targets] if targets else []):
+                _rebuild_on(self.node(name))
+            if targets:
+                inventory.clear()
+            self._adopted = True
+
+    def nodes(self):
+        return [None, *self.shards]
+
+    def stats(self):
+        snaps = [self.home.stats()] + [node.stats() for node in self.shards.values()]
+        borrows = sum(s["borrows"] for s in snaps) or 1
+        total = {}
+        for key in snaps[0]:
+            values = [s[key] for s in snaps]
+            if key.startswith(("max_", "peak_")):
+                total[key] = max(values)
+            elif key.startswith("avg_"):
+                total[key] = sum(v * s["borrows"] for v, s in zip(values, snaps)) / borrows
+            else:
+                total[key] = sum(values)
+        return total
+
+    # ---------------------
+    # Routing
+    # ---------------------
+    def unit_of_work(self, dictionary=False, buffered=True):
+        route = db.current_route()
+        if route is None:
+            return self.home.unit_of_work(dictionary=dictionary, buffered=buffered)
+        if not self._adopted:
+            with db.primary():
+                self._adopt_home()
+        if route[0] == "all":
+            return self._fan_out(dictionary, buffered)
+        # The map and the catalog copy are read from (and written to) primaries,
+        # even inside db.read_only()
+        with db.primary():
+            if route[0] == "node":
+                name, user_id = route[1], None
+                if name is not None and name not in self.shards:
+                    raise ValueError(f"no such node: {name}")
+            else:
+                name, user_id = self.shard_of(route[1]), route[2]
+            if name is not None:
+                self._prepare(name, user_id)
+        if name is None:
+            return self.home.unit_of_work(dictionary=dictionary, buffered=buffered)
+        return self.shards[name].unit_of_work(dictionary=dictionary, buffered=buffered)
+
+    @contextmanager
+    def _fan_out(self, dictionary, buffered):
+        with db.primary():
+            for name in self.shards:
+                self._prepare(name)
+        with ExitStack() as stack:
+            cursors = [stack.enter_context(node.unit_of_work(dictionary=dictionary, buffered=buffered))
+                       for node in (self.home, *self.shards.values())]
+            yield FanOutCursor(cursors)
+
+    def shard_of(self, showtime_id):
+        screen_id = self._screen_of(showtime_id)
+        if screen_id is None:
+            return None   # no such (hot) showtime: home answers "not found"
+        node, moving_to = self.map_entry(screen_id)
+        if moving_to is not None:
+            raise db.Rebalancing(f"screen {screen_id} is moving to node {moving_to}")
+        return node
+
+    def _screen_of(self, showtime_id):
+        with self._lock:
+            screen_id = self._screens.get(showtime_id)
+        if screen_id is not None:
+            return screen_id
+        with self.home.unit_of_work() as cur:
+            cur.execute("SELECT screen_id FROM showtimes WHERE id = %s", (showtime_id,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            self._screens[showtime_id] = row[0]
+            # A show not seen before may be newer than the shards' catalog
+            self._checked_at = 0.0
+        return row[0]
+
+    def map_entry(self, screen_id):
+        """(node, moving_to) for a screen, assigning it a node if it has none."""
+        entry = self._shard_map().get(screen_id)
+        if entry is None:
+            entry = self._assign(screen_id)
+        if entry[0] not in self.shards:
+            raise ValueError(f"screen {screen_id} is mapped to unknown node {entry[0]!r}")
+        return entry
+
+    def _shard_map(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._map_loaded < MAP_TTL:
+                return self._map
+        with self.home.unit_of_work() as cur:
+            cur.execute("SELECT screen_id, node, moving_to FROM shard_map")
+            mapping = {screen_id: (node, moving_to) for screen_id, node, moving_to in cur.fetchall()}
+        with self._lock:
+            self._map, self._map_loaded = mapping, now
+        return mapping
+
+    def forget_map(self):
+        with self._lock:
+            self._map_loaded = 0.0
+
+    def _assign(self, screen_id):
+        """Map an unmapped screen to the shard with the fewest screens."""
+        counts = {name: 0 for name in self.shards}
+        for node, _ in self._shard_map().values():
+            if node in counts:
+                counts[node] += 1
+        node = min(counts, key=counts.get)
+        ignore = "INSERT IGNORE" if self.dialect == "mysql" else "INSERT OR IGNORE"
+        with self.home.unit_of_work() as cur:
+            cur.execute(f"{ignore} INTO shard_map (screen_id, node) VALUES (%s, %s)", (screen_id, node))
+        self.forget_map()
+        # Another process may have won the insert; its choice stands
+        return self._shard_map()[screen_id]
+
+    # ---------------------
+    # Replication
+    # ---------------------
+    def _catalog_version(self):
+        now = time.monotonic()
+        invalidations = catalog.stats()["invalidations"]
+        with self._lock:
+            if (self._version is not None and now - self._checked_at < SYNC_INTERVAL
+                    and invalidations == self._invalidations):
+                return self._version
+        with self.home.unit_of_work() as cur:
+            cur.execute(catalog.VERSION_SQL)
+            row = cur.fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            if version != self._version:
+                self._screens.clear()
+            self._version, self._checked_at, self._invalidations = version, now, invalidations
+        return version
+
+    def _prepare(self, name, user_id=None):
+        """Bring a shard's catalog copy up to date and make sure user_id exists there."""
+        replica = self._replicas[name]
+        version = self._catalog_version()
+        if replica.version != version:
+            with replica.lock:
+                if replica.version != version:
+                    self._sync_catalog(self.shards[name])
+                    replica.version = version
+        if user_id is not None and user_id not in replica.users:
+            self.copy_users(name, [user_id])
+
+    def _sync_catalog(self, node):
+        """Make node's movies, screens and showtimes equal to home's."""
+        with self.home.unit_of_work(dictionary=True) as cur:
+            wanted = {}
+            for table in CATALOG_TABLES:
+                cur.execute(f"SELECT * FROM {table}")
+                wanted[table] = {row["id"]: row for row in cur.fetchall()}
+        with node.unit_of_work(dictionary=True) as cur:
+            # Deletes first, children first: frees unique keys, cascades like home did
+            for table in reversed(CATALOG_TABLES):
+                cur.execute(f"SELECT id FROM {table}")
+                gone = [row["id"] for row in cur.fetchall() if row["id"] not in wanted[table]]
+                for chunk in _chunks(gone):
+                    cur.execute(f"DELETE FROM {table} WHERE id IN ({_marks(chunk)})", chunk)
+            for table in CATALOG_TABLES:
+                cur.execute(f"SELECT * FROM {table}")
+                have = {row["id"]: row for row in cur.fetchall()}
+                new = [row for key, row in wanted[table].items() if key not in have]
+                changed = [row for key, row in wanted[table].items()
+                           if key in have and have[key] != row]
+                if new:
+                    cols = list(new[0])
+                    cur.executemany(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({_marks(cols)})",
+                                    [[row[c] for c in cols] for row in new])
+                if changed:
+                    cols = [c for c in changed[0] if c != "id"]
+                    cur.executemany(f"UPDATE {table} SET {', '.join(c + ' = %s' for c in cols)} "
+                                    "WHERE id = %s",
+                                    [[row[c] for c in cols] + [row["id"]] for row in changed])
+
+    def copy_users(self, name, user_ids):
+        """Copy users from home to a shard unless already there."""
+        replica = self._replicas[name]
+        user_ids = [u for u in set(user_ids) if u not in replica.users]
+        if not user_ids:
+            return
+        with self.home.unit_of_work(dictionary=True) as cur:
+            cur.execute(f"SELECT * FROM users WHERE id IN ({_marks(user_ids)})", user_ids)
+            rows = cur.fetchall()
+        if rows:
+            cols = list(rows[0])
+            ignore = "INSERT IGNORE" if self.dialect == "mysql" else "INSERT OR IGNORE"
+            with self.shards[name].unit_of_work() as cur:
+                cur.executemany(f"{ignore} INTO users ({', '.join(cols)}) VALUES ({_marks(cols)})",
+                                [[row[c] for c in cols] for row in rows])
+        with replica.lock:
+            replica.users.update(row["id"] for row in rows)
+
+
+# =====================
+# Status and rebalancing
+# =====================
+def _backend():
+    backend = db.get_backend()
+    if not isinstance(backend, ShardedBackend):
+        raise ValueError("the configured database is not sharded (see CINEMA_SQLITE_SHARDS / SHARDS in main.py)")
+    return backend
+
+
+def _bookings_per_screen(node):
+    with db.on_node(node), db.unit_of_work() as cur:
+        cur.execute("""
+            SELECT s.screen_id, COUNT(*)
+            FROM bookings b
+            JOIN showtimes s ON b.showtime_id = s.id
+            GROUP BY s.screen_id
+        """)
+        return dict(cur.fetchall())
+
+
+def status():
+    """Per screen: node, pending move and hot bookings; per node: screens and bookings."""
+    backend = _backend()
+    backend.forget_map()
+    mapping = backend._shard_map()
+    screens = {}
+    for node in backend.shards:
+        for screen_id, count in _bookings_per_screen(node).items():
+            screens.setdefault(screen_id, {})[node] = count
+    rows = []
+    for screen_id in sorted(set(mapping) | set(screens)):
+        node, moving_to = mapping.get(screen_id, (None, None))
+        rows.append({"screen_id": screen_id, "node": node, "moving_to": moving_to,
+                     "bookings": screens.get(screen_id, {}).get(node, 0),
+                     "elsewhere": {n: c for n, c in screens.get(screen_id, {}).items() if n != node}})
+    nodes = {name: {"screens": sum(1 for r in rows if r["node"] == name),
+                    "bookings": sum(r["bookings"] for r in rows if r["node"] == name)}
+             for name in backend.shards}
+    return {"screens": rows, "nodes": nodes}
+
+
+def _read_rows(cur, table, columns, ids):
+    rows = []
+    for chunk in _chunks(ids):
+        cur.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE showtime_id IN ({_marks(chunk)})",
+                    chunk)
+        rows.extend(tuple(row) for row in cur.fetchall())
+    return rows
+
+
+def _delete_rows(cur, ids):
+    for table, _ in reversed(MOVED_TABLES):
+        for chunk in _chunks(ids):
+            cur.execute(f"DELETE FROM {table} WHERE showtime_id IN ({_marks(chunk)})", chunk)
+
+
+def _rebuild_on(node_backend):
+    with node_backend.unit_of_work() as cur:
+        rollups.rebuild(cur)
+
+
+def _transfer(backend, ids, source, target):
+    """
+    Copy the hot rows of showtimes ids from node source to node target, then
+    delete them from source; returns the rows per table. The target's rows
+    are replaced, so a copy that died halfway is simply redone.
+    """
+    with backend.node(source).unit_of_work() as cur:
+        rows = {table: _read_rows(cur, table, columns, ids) for table, columns in MOVED_TABLES}
+    if any(rows.values()):
+        backend._prepare(target)
+        backend.copy_users(target, [row[1] for table in ("bookings", "seat_holds") for row in rows[table]])
+        with backend.node(target).unit_of_work() as cur:
+            _delete_rows(cur, ids)
+            for table, columns in MOVED_TABLES:
+                if rows[table]:
+                    cur.executemany(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                    f"VALUES ({_marks(columns)})", rows[table])
+        # Only then drop them from the source
+        with backend.node(source).unit_of_work() as cur:
+            _delete_rows(cur, ids)
+    return {table: len(found) for table, found in rows.items()}
+
+
+def move(screen_id, target, settle=None):
+    """Move a screen's hot bookings to node target; returns the rows moved per table."""
+    backend = _backend()
+    if target not in backend.shards:
+        raise ValueError(f"no such node: {target}")
+    backend.forget_map()
+    source, moving_to = backend.map_entry(screen_id)
+    if moving_to not in (None, target):
+        raise ValueError(f"screen {screen_id} is still moving to {moving_to}; "
+                         f"finish that with: move {screen_id} {moving_to}")
+    if source == target:
+        return {table: 0 for table, _ in MOVED_TABLES}
+
+    # 1. Refuse new bookings, and let other processes notice before copying
+    with db.unit_of_work() as cur:
+        cur.execute("UPDATE shard_map SET moving_to = %s WHERE screen_id = %s", (target, screen_id))
+    time.sleep(MAP_TTL + 1.0 if settle is None else settle)
+
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT id FROM showtimes WHERE screen_id = %s", (screen_id,))
+        ids = [row[0] for row in cur.fetchall()]
+
+    # 2. Copy, 3. delete from the source. An empty source means the rows were
+    # already copied and deleted before an interruption.
+    moved = _transfer(backend, ids, source, target)
+
+    # 4. Rollups follow the rows; 5. flip the map
+    _rebuild_on(backend.node(source))
+    _rebuild_on(backend.node(target))
+    with db.unit_of_work() as cur:
+        cur.execute("UPDATE shard_map SET node = %s, moving_to = NULL WHERE screen_id = %s",
+                    (target, screen_id))
+    backend.forget_map()
+    inventory.clear()
+    return moved
+
+
+def plan():
+    """Screen moves [(screen_id, from, to, bookings)] that even out hot bookings per node."""
+    report = status()
+    load = {name: n["bookings"] for name, n in report["nodes"].items()}
+    screens = {r["screen_id"]: [r["node"], r["bookings"]] for r in report["screens"]
+               if r["node"] in load and not r["moving_to"]}
+    moves = []
+    for _ in range(len(screens)):
+        heavy = max(load, key=load.get)
+        light = min(load, key=load.get)
+        gap = load[heavy] - load[light]
+        # The screen whose move brings the two closest together, if any helps
+        candidates = [(abs(gap - 2 * count), screen_id) for screen_id, (node, count) in screens.items()
+                      if node == heavy and 0 < count < gap]
+        if not candidates:
+            break
+        _, screen_id = min(candidates)
+        count = screens[screen_id][1]
+        moves.append((screen_id, heavy, light, count))
+        screens[screen_id][0] = light
+        load[heavy] -= count
+        load[light] += count
+    return moves
+
+
+def rebalance(apply=False):
+    """plan(), and with apply=True carry the moves out; returns the plan."""
+    moves = plan()
+    if apply:
+        for screen_id, _, target, _ in moves:
+            move(screen_id, target)
+    return moves
+
+
+def print_status(report):
+    for name, n in report["nodes"].items():
+        print(f"🗄 {name}: {n['screens']} screens | {n['bookings']} bookings")
+    for r in report["screens"]:
+        line = f"   Screen {r['screen_id']} → {r['node'] or 'unassigned'} ({r['bookings']} bookings)"
+        if r["moving_to"]:
+            line += f" | ⏳ moving to {r['moving_to']}"
+        if r["elsewhere"]:
+            line += " | ⚠️ also on " + ", ".join(f"{n} ({c})" for n, c in r["elsewhere"].items())
+        print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import main
+
+    parser = argparse.ArgumentParser(description="Inspect and rebalance the booking shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="screens and bookings per node")
+    move_cmd = commands.add_parser("move", help="move one screen's bookings to another node")
+    move_cmd.add_argument("screen_id", type=int)
+    move_cmd.add_argument("node")
+    rebalance_cmd = commands.add_parser("rebalance", help="plan moves that even out bookings")
+    rebalance_cmd.add_argument("--apply", action="store_true", help="carry the moves out")
+    args = parser.parse_args()
+
+    db.configure(main.make_backend())
+    main.init_db()
+    if args.command == "status":
+        print_status(status())
+    elif args.command == "move":
+        moved = move(args.screen_id, args.node)
+        print(f"✅ Screen {args.screen_id} now on {args.node} "
+              f"({moved['bookings']} bookings, {moved['booking_seats']} seats moved)")
+    else:
+        moves = rebalance(args.apply)
+        if not moves:
+            print("✅ Bookings are as even as screen moves can make them.")
+        for screen_id, source, target, count in moves:
+            print(f"{'✅ Moved' if args.apply else '➡️ Would move'} screen {screen_id}: "
+                  f"{source} → {target} ({count} bookings)")
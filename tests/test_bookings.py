@@ -0,0 +1,212 @@
+import asyncio
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import allocator
+import core
+import db
+import journal
+import migrations
+import reservations
+import rollups
+import seatfeed
+
+
+def _sold(showtime_id):
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT seat_row, seat_col FROM booking_seats WHERE showtime_id = %s "
+                    "ORDER BY seat_row, seat_col", (showtime_id,))
+        return [tuple(row) for row in cur.fetchall()]
+
+
+def _rollup_rows():
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT showtime_id, bookings, seats_sold, revenue FROM showtime_sales "
+                    "ORDER BY showtime_id")
+        shows = [tuple(row) for row in cur.fetchall()]
+        cur.execute("SELECT day, movie_id, bookings, seats_sold, revenue FROM movie_daily_sales "
+                    "ORDER BY day, movie_id")
+        days = [tuple(row) for row in cur.fetchall()]
+    return shows, days
+
+
+def test_hot_queries_use_indexes(backend):
+    assert migrations.check_indexes(backend) == {}
+
+
+def test_seat_cannot_be_booked_twice(make_show, make_users):
+    show = make_show()
+    alice, bob = make_users(2)
+    reservations.book_seats(alice, show, [("A", 1), ("A", 2)])
+    with pytest.raises(reservations.SeatUnavailable) as caught:
+        reservations.book_seats(bob, show, [("A", 2), ("A", 3)])
+    assert caught.value.seats == [("A", 2)]
+    assert _sold(show) == [("A", 1), ("A", 2)]
+
+
+def test_held_seat_cannot_be_held_again(make_show, make_users):
+    show = make_show()
+    alice, bob = make_users(2)
+    reservations.hold_seats(alice, show, [("B", 4)])
+    with pytest.raises(reservations.SeatUnavailable):
+        reservations.hold_seats(bob, show, [("B", 4)])
+
+
+def test_threaded_booking_race(make_show, make_users):
+    rows, cols = 4, 8
+    show = make_show(rows, cols)
+    users = make_users(60)
+
+    def attempt(user_id):
+        # A random adjacent pair, the way booking_load.py's manual mode picks them
+        rng = random.Random(user_id)
+        r, c = chr(65 + rng.randrange(rows)), rng.randrange(1, cols)
+        try:
+            reservations.book_seats(user_id, show, [(r, c), (r, c + 1)])
+            return "booked"
+        except (reservations.SeatUnavailable, reservations.HoldExpired):
+            return "conflict"
+
+    with ThreadPoolExecutor(8) as pool:
+        outcomes = list(pool.map(attempt, users))
+
+    sold = _sold(show)
+    assert len(sold) == len(set(sold)), "a seat was sold twice"
+    assert len(sold) == 2 * outcomes.count("booked")
+    assert outcomes.count("booked") >= 1
+    shows, _ = _rollup_rows()
+    assert shows[0][2] == len(sold)
+
+
+def test_confirm_turns_a_hold_into_a_booking(make_show, make_users):
+    show = make_show(price=150)
+    (user,) = make_users(1)
+    token = reservations.hold_seats(user, show, [("C", 5), ("C", 6)])
+    booking = reservations.confirm(token)
+    assert booking["showtime_id"] == show
+    assert sorted(booking["seats"]) == [("C", 5), ("C", 6)]
+    assert booking["total_amount"] == 300
+    with pytest.raises(reservations.HoldExpired):
+        reservations.confirm(token)  # a hold is confirmed once
+
+
+def test_expired_hold_cannot_be_confirmed_and_frees_its_seats(make_show, make_users):
+    show = make_show()
+    alice, bob = make_users(2)
+    token = reservations.hold_seats(alice, show, [("A", 1)])
+    with db.unit_of_work() as cur:
+        cur.execute("UPDATE seat_holds SET expires_at = %s WHERE hold_token = %s",
+                    ("2000-01-01 00:00:00", token))
+    with pytest.raises(reservations.HoldExpired):
+        reservations.confirm(token)
+    reservations.book_seats(bob, show, [("A", 1)])
+    assert _sold(show) == [("A", 1)]
+
+
+def test_released_hold_cannot_be_confirmed(make_show, make_users):
+    show = make_show()
+    (user,) = make_users(1)
+    token = reservations.hold_seats(user, show, [("A", 1)])
+    reservations.release(token)
+    with pytest.raises(reservations.HoldExpired):
+        reservations.confirm(token)
+
+
+def test_rollups_match_a_rebuild(make_show, make_users):
+    shows = [make_show(price=100), make_show(price=250)]
+    users = make_users(3)
+    for i, user in enumerate(users):
+        for show in shows:
+            reservations.book_seats(user, show, [("A", i * 2 + 1), ("A", i * 2 + 2)])
+    incremental = _rollup_rows()
+    assert rollups.rebuild() == len(shows)
+    assert _rollup_rows() == incremental
+
+
+def test_allocator_picks_adjacent_central_seats():
+    idx = allocator.FreeRunIndex(3, 10)
+    assert idx.allocate(4) == [("B", 4), ("B", 5), ("B", 6), ("B", 7)]
+    assert idx.runs[1] == [(1, 3), (8, 10)]
+    assert idx.free_count() == 26
+
+
+def test_allocator_splits_only_when_allowed():
+    idx = allocator.FreeRunIndex(2, 4, taken=[("A", 3), ("B", 2)])
+    assert idx.allocate(3, allow_split=False) is None
+    seats = idx.allocate(3)
+    assert len(seats) == 3 and len(set(seats)) == 3
+    assert not {("A", 3), ("B", 2)} & set(seats)
+
+
+def test_auto_hold_fills_a_show_without_overlap(make_show, make_users):
+    show = make_show(2, 5)
+    users = make_users(4)
+    held = allocator.auto_hold_many(show, [(u, 3) for u in users])
+    seats = [seat for result in held if result for seat in result[1]]
+    assert len(seats) == len(set(seats)) == 9
+    assert held[-1] is None  # one seat left for a group of three
+    for token, _ in filter(None, held):
+        reservations.confirm(token)
+    assert len(_sold(show)) == 9
+
+
+def test_journal_replays_bookings_left_in_the_file(tmp_path, make_show, make_users):
+    path = str(tmp_path / "bookings.journal")
+    show = make_show()
+    (user,) = make_users(1)
+
+    j = journal.start(path)
+    j._apply = lambda batch: None  # the process dies before the writer gets to it
+    token = reservations.hold_seats(user, show, [("D", 2), ("D", 3)])
+    booking = reservations.confirm(token)
+    journal.stop()
+    assert j.snapshot()["pending"] == 1
+    assert _sold(show) == []
+
+    j = journal.start(path)
+    journal.stop()
+    assert j.snapshot()["pending"] == 0 and j.applied == 1
+    assert _sold(show) == [("D", 2), ("D", 3)]
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT id FROM bookings")
+        assert [row[0] for row in cur.fetchall()] == [booking["booking_id"]]
+        cur.execute("SELECT COUNT(*) FROM seat_holds")
+        assert cur.fetchone()[0] == 0
+    shows, _ = _rollup_rows()
+    assert shows[0][2] == 2
+
+    # Replaying the same records again must not book them twice
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"booking_id": booking["booking_id"], "token": token,
+                            "user_id": user, "showtime_id": show, "movie_id": 1,
+                            "start_time": "2030-01-01 18:00:00", "seats": [["D", 2]],
+                            "total_amount": "200", "booked_at": "2030-01-01 12:00:00"}) + "\n")
+    j = journal.start(path)
+    journal.stop()
+    assert j.skipped == 1 and j.applied == 0
+    assert _sold(show) == [("D", 2), ("D", 3)]
+
+
+def test_seat_feed_resyncs_after_bookings_it_did_not_publish(make_show, make_users):
+    show = make_show()
+    alice, bob = make_users(2)
+    version = seatfeed.reconcile(show, core.run(core.seats_sold(show)))
+
+    reservations.book_seats(alice, show, [("A", 1)])
+    delta = asyncio.run(seatfeed.changes(show, version, timeout=0))
+    assert delta["seats"] == [("A", 1)]
+    version = delta["version"]
+    assert seatfeed.reconcile(show, core.run(core.seats_sold(show))) == version
+
+    # Booked by another process: the database moves, the feed hears nothing
+    with db.unit_of_work() as cur:
+        cur.execute("UPDATE showtime_sales SET seats_sold = seats_sold + 2 WHERE showtime_id = %s",
+                    (show,))
+    assert asyncio.run(seatfeed.changes(show, version, timeout=0))["seats"] == []
+    newer = seatfeed.reconcile(show, core.run(core.seats_sold(show)))
+    assert newer > version
+    assert asyncio.run(seatfeed.changes(show, version, timeout=0))["resync"]
+    assert asyncio.run(seatfeed.changes(show, newer, timeout=0))["seats"] == []
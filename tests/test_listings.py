@@ -0,0 +1,186 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import core
+import db
+import importer
+import reservations
+import rollups
+import scheduling
+
+
+def _tomorrow(hour, minute=0):
+    return (datetime.now() + timedelta(days=1)).replace(hour=hour, minute=minute,
+                                                         second=0, microsecond=0)
+
+
+def _pages(page, limit):
+    """Every row of a keyset listing, fetched `limit` at a time."""
+    rows, after = [], None
+    while True:
+        batch = core.run(page(after, limit))
+        rows += batch
+        if len(batch) < limit:
+            return rows
+        after = core._page_key(batch[-1])
+
+
+# =====================
+# Keyset pagination
+# =====================
+def test_my_bookings_pages_cover_every_booking_once(make_show, make_users):
+    (user,) = make_users(1)
+    # Several bookings per show, so pages break inside a run of equal start times
+    shows = [make_show(start=_tomorrow(10 + i)) for i in range(4)]
+    booked = [reservations.book_seats(user, show, [("A", n)])["booking_id"]
+              for show in shows for n in range(1, 6)]
+
+    rows = _pages(lambda after, limit: core.my_bookings(user, after, limit), 3)
+    ids = [r["booking_id"] for r in rows]
+    assert sorted(ids) == sorted(booked)
+    keys = [core._page_key(r) for r in rows]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_browse_showtimes_pages_in_start_order(make_show):
+    # Pairs of shows starting together, so pages break between equal start times
+    ids = [make_show(start=_tomorrow(9 + i // 2)) for i in range(11)]
+
+    rows = _pages(lambda after, limit: core.browse_showtimes(after=after, limit=limit), 4)
+    assert sorted(r["id"] for r in rows) == sorted(ids)
+    keys = [core._page_key(r) for r in rows]
+    assert keys == sorted(keys)
+
+
+def test_browse_showtimes_can_hide_sold_out_shows(make_show, make_users):
+    full, open_ = make_show(1, 2, start=_tomorrow(10)), make_show(1, 2, start=_tomorrow(11))
+    (user,) = make_users(1)
+    reservations.book_seats(user, full, [("A", 1), ("A", 2)])
+    rows = core.run(core.browse_showtimes(hide_sold_out=True))
+    assert [r["id"] for r in rows] == [open_]
+
+
+# =====================
+# Report cache
+# =====================
+def test_daily_report_is_cached_until_its_day_changes(make_show, make_users):
+    day = _tomorrow(0).date().isoformat()
+    show = make_show(start=_tomorrow(20))
+    (user,) = make_users(1)
+    cache = core.reportcache._cache
+
+    assert core.run(core.daily_report(day))["total_tickets"] == 0
+    assert core.run(core.daily_report(day))["total_tickets"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    reservations.book_seats(user, show, [("A", 1), ("A", 2)])
+    assert core.run(core.daily_report(day))["total_tickets"] == 2
+    assert cache.stale == 1
+
+    # Bookings on other days leave the report alone
+    reservations.book_seats(user, make_show(start=_tomorrow(20) + timedelta(days=1)), [("A", 1)])
+    assert core.run(core.daily_report(day))["total_tickets"] == 2
+    assert cache.hits == 2
+
+
+def test_rollup_rebuild_invalidates_cached_reports(make_show, make_users):
+    day = _tomorrow(0).date().isoformat()
+    show = make_show(start=_tomorrow(20))
+    (user,) = make_users(1)
+    reservations.book_seats(user, show, [("A", 1)])
+    core.run(core.daily_report(day))
+
+    # Drift the rollup behind the cache's back, then repair it
+    with db.unit_of_work() as cur:
+        cur.execute("UPDATE showtime_sales SET seats_sold = 99")
+    rollups.rebuild()
+    assert core.run(core.daily_report(day))["total_tickets"] == 1
+    assert core.reportcache._cache.stale == 1
+
+
+# =====================
+# Scheduling
+# =====================
+def test_schedule_conflicts_include_the_cleaning_buffer():
+    start = _tomorrow(18)
+    schedule = scheduling.ScreenSchedule([(start, scheduling.end_of(start, 120), "first")])
+    assert schedule.conflict(start + timedelta(minutes=130), start + timedelta(hours=4)) == "first"
+    assert schedule.conflict(start + timedelta(minutes=135), start + timedelta(hours=4)) is None
+    assert schedule.conflict(start - timedelta(hours=2), start) is None
+
+
+def test_schedule_finds_overlaps_hidden_behind_a_long_show():
+    start = _tomorrow(9)
+    schedule = scheduling.ScreenSchedule([
+        (start, start + timedelta(hours=8), "marathon"),
+        (start + timedelta(hours=1), start + timedelta(hours=2), "short"),
+    ])
+    # Starts after "short" ends but still inside "marathon"
+    assert schedule.conflict(start + timedelta(hours=3), start + timedelta(hours=4)) == "marathon"
+
+
+def test_check_and_check_batch_against_the_database(backend, make_show):
+    first = make_show(start=_tomorrow(18), duration_min=120)
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT screen_id FROM showtimes WHERE id = %s", (first,))
+        screen = cur.fetchone()[0]
+    with db.unit_of_work(dictionary=True) as cur:
+        assert scheduling.check(cur, 90, screen, _tomorrow(19)) == f"showtime #{first}"
+        assert scheduling.check(cur, 90, screen, _tomorrow(20, 15)) is None
+
+        rows = [("late", screen, _tomorrow(20, 15)),       # free
+                ("clash", screen, _tomorrow(21)),          # overlaps "late"
+                ("early", screen, _tomorrow(17)),          # overlaps the existing show
+                ("elsewhere", screen + 1, _tomorrow(18))]  # another screen entirely
+        clashes = scheduling.check_batch(cur, rows, {"late": 90, "clash": 90,
+                                                     "early": 90, "elsewhere": 90})
+    assert clashes == {"clash": "late", "early": f"showtime #{first}"}
+
+
+def test_concurrent_check_and_insert_cannot_both_pass(backend, make_show):
+    first = make_show(start=_tomorrow(9))
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT screen_id, movie_id FROM showtimes WHERE id = %s", (first,))
+        screen, movie = cur.fetchone()
+    checked = threading.Event()
+
+    def add(start, slow):
+        with db.unit_of_work(dictionary=True) as cur:
+            clash = scheduling.check(cur, 120, screen, start)
+            if slow:
+                checked.set()
+                time.sleep(0.2)  # the other admin checks meanwhile
+            if clash is None:
+                cur.execute("INSERT INTO showtimes (movie_id, screen_id, start_time, price) "
+                            "VALUES (%s, %s, %s, %s)",
+                            (movie, screen, start.strftime("%Y-%m-%d %H:%M:%S"), 200))
+        return clash
+
+    with ThreadPoolExecutor(2) as pool:
+        slow = pool.submit(add, _tomorrow(18), True)
+        checked.wait(5)
+        fast = pool.submit(add, _tomorrow(19), False)
+        results = [slow.result(), fast.result()]
+    assert results[0] is None and results[1] is not None
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT COUNT(*) FROM showtimes WHERE screen_id = %s", (screen,))
+        assert cur.fetchone()[0] == 2
+
+
+def test_import_reports_overlapping_showtimes(backend, make_show):
+    first = make_show(start=_tomorrow(9), duration_min=120)
+    with db.unit_of_work() as cur:
+        cur.execute("SELECT screen_id, movie_id FROM showtimes WHERE id = %s", (first,))
+        screen, movie = cur.fetchone()
+    day = _tomorrow(0).date().isoformat()
+    csv = io.StringIO("movie_id,screen_id,start_time,price\n"
+                      f"{movie},{screen},{day} 10:00,200\n"     # overlaps the existing show
+                      f"{movie},{screen},{day} 14:00,200\n"
+                      f"{movie},{screen},{day} 15:00,200\n"     # overlaps the line above
+                      f"{movie},{screen},{day} 18:00,200\n")
+    result = importer.import_csv("showtimes", csv)
+    assert result["inserted"] == 2
+    assert [line for line, _ in sorted(result["conflicts"])] == [2, 4]
@@ -0,0 +1,190 @@
+"""
+SQL statement tracing and slow-query log.
+
+When tracing is enabled, every cursor handed out by db.unit_of_work() is
+wrapped in a TracedCursor that times execute()/executemany() and counts the
+rows fetched, aggregated per statement fingerprint (literals and IN/VALUES
+lists collapsed). Statements slower than slow_ms are appended to a slow-query
+log together with their EXPLAIN plan.
+
+When tracing is disabled, cursors are not wrapped at all; the only cost is
+one attribute check per unit of work.
+
+    tracing.configure(enabled=True, slow_ms=50, slow_log="slow_queries.log")
+    ...
+    for row in tracing.top(10): ...
+"""
+import json
+import re
+import threading
+import time
+from functools import lru_cache
+
+_WS = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|\?")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalise a statement so calls differing only in values group together."""
+    text = _WS.sub(" ", sql).strip().rstrip(";")
+    text = _STRING.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    return _LIST.sub("(...)", text)
+
+
+class StatementStats:
+    __slots__ = ("calls", "total", "max", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.slow_ms = 100.0
+        self.slow_log = "slow_queries.log"
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def active(self):
+        """Enabled, and not inside the tracer's own EXPLAIN lookups."""
+        return self.enabled and not getattr(self._local, "paused", False)
+
+    def record(self, key, elapsed, rows=0):
+        with self._lock:
+            st = self._stats.get(key)
+            if st is None:
+                st = self._stats[key] = StatementStats()
+            st.calls += 1
+            st.total += elapsed
+            st.max = max(st.max, elapsed)
+            st.rows += rows
+
+    def add_rows(self, key, rows):
+        with self._lock:
+            st = self._stats.get(key)
+            if st is not None:
+                st.rows += rows
+
+    def top(self, n=10, by="total"):
+        with self._lock:
+            items = [(key, st.calls, st.total, st.max, st.rows) for key, st in self._stats.items()]
+        order = {"total": 2, "max": 3, "calls": 1, "rows": 4}[by]
+        items.sort(key=lambda item: item[order], reverse=True)
+        return [{
+            "statement": key,
+            "calls": calls,
+            "total_ms": total * 1000,
+            "avg_ms": total / calls * 1000,
+            "max_ms": peak * 1000,
+            "rows": rows,
+        } for key, calls, total, peak, rows in items[:n]]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def log_slow(self, pool, entries):
+        """Append slow statements with their plans; runs after the connection is returned."""
+        self._local.paused = True
+        try:
+            with open(self.slow_log, "a", encoding="utf-8") as out:
+                for sql, params, elapsed in entries:
+                    plan = None
+                    if isinstance(params, (list, tuple)) and sql.lstrip().upper().startswith("SELECT"):
+                        try:
+                            with pool.unit_of_work(dictionary=True) as cur:
+                                cur.execute(pool.explain_prefix + sql, params)
+                                plan = cur.fetchall()
+                        except Exception as exc:
+                            plan = f"EXPLAIN failed: {exc}"
+                    out.write(json.dumps({
+                        "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "ms": round(elapsed * 1000, 3),
+                        "statement": fingerprint(sql),
+                        "params": params,
+                        "plan": plan,
+                    }, default=str) + "\n")
+        finally:
+            self._local.paused = False
+
+
+class TracedCursor:
+    """Times statements on a driver cursor; everything else passes through."""
+
+    def __init__(self, cur, tracer):
+        self._cur = cur
+        self._tracer = tracer
+        self._key = None
+        self.slow = []
+
+    def _timed(self, method, sql, params, logged_params):
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._key = fingerprint(sql)
+            rowcount = getattr(self._cur, "rowcount", -1)
+            is_select = sql.lstrip().upper().startswith("SELECT")
+            self._tracer.record(self._key, elapsed, 0 if is_select or rowcount < 0 else rowcount)
+            if elapsed * 1000 >= self._tracer.slow_ms:
+                self.slow.append((sql, logged_params, elapsed))
+
+    def execute(self, sql, params=()):
+        return self._timed(self._cur.execute, sql, params, params)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        return self._timed(self._cur.executemany, sql, seq_of_params,
+                           f"<{len(seq_of_params)} parameter sets>")
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        if row is not None:
+            self._tracer.add_rows(self._key, 1)
+        return row
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        self._tracer.add_rows(self._key, len(rows))
+        return rows
+
+    def fetchmany(self, size=1):
+        rows = self._cur.fetchmany(size)
+        self._tracer.add_rows(self._key, len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cur:
+            self._tracer.add_rows(self._key, 1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+tracer = Tracer()
+
+
+def configure(enabled=True, slow_ms=None, slow_log=None):
+    tracer.enabled = enabled
+    if slow_ms is not None:
+        tracer.slow_ms = slow_ms
+    if slow_log is not None:
+        tracer.slow_log = slow_log
+
+
+def top(n=10, by="total"):
+    return tracer.top(n, by)